@@ -5,18 +5,40 @@
 # Author: Matthew DeVenny
 #
 
+import hashlib
+import json
 import logging
-import yaml
+import os
+import time
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from six import iteritems
 
+from bb.utils import cache_utils
 from bb.utils import file_utils as file_util
-from bb.aws import ec2_utils as ec2
-from bb.aws import asg_utils as asg
+from bb.utils import import_utils as import_util
+from bb.aws import region_utils as aws_region
 
 log = logging.getLogger(__name__)
 
+# only loaded when an inventory is built, a cached inventory never needs boto3
+ec2 = import_util.lazy_import('bb.aws.ec2_utils')
+asg = import_util.lazy_import('bb.aws.asg_utils')
+ec2_snapshot = import_util.lazy_import('bb.aws.ec2_snapshot')
+
+# definitions with at least this many groups are resolved from one region
+# snapshot instead of a DescribeInstances call per group, override with
+# BB_INVENTORY_SNAPSHOT_MIN_GROUPS (0 disables). A sweep pages through every
+# instance of the region so it only pays off once it replaces several
+# filtered calls.
+DEFAULT_SNAPSHOT_MIN_GROUPS = 5
+# seconds a generated inventory is served from the on-disk cache, override
+# with BB_INVENTORY_CACHE_TTL (0 disables)
+DEFAULT_CACHE_TTL = 300
+# groups resolved concurrently, override with BB_INVENTORY_MAX_WORKERS
+DEFAULT_MAX_WORKERS = 8
+
 
 def create_inventory(groups):
     """ Create a fully formed ansible inventory dictionary from a `list` of
@@ -85,7 +107,76 @@ def create_inventory_group(name, host_list, vars=[], child_groups=[]):
     return group
 
 
-def create_dynamic_ec2_inventory(definition, region=None):
+def get_cached_inventory(key_parts, create, ttl=None, refresh=False):
+    """ Return an inventory from the on-disk cache or build and cache it.
+    Builds are serialized with a lock file so concurrent ansible forks wait
+    for one build instead of each querying AWS. The active AWS_PROFILE is
+    part of the cache key so switching accounts never serves another
+    account's hosts.
+
+    Parameters
+    ----------
+        key_parts: `list`
+            JSON serializable values identifying the inventory, e.g.
+            definition contents and region
+        create: `callable`
+            returns the inventory `dict` on a cache miss
+        ttl: `float`
+            seconds a cached inventory is valid (default
+            BB_INVENTORY_CACHE_TTL or 300, 0 disables the cache)
+        refresh: `bool`
+            ignore any cached inventory and rebuild it
+
+    Returns
+    -------
+    ansible inventory `dict`
+    """
+    if ttl is None:
+        ttl = float(os.getenv('BB_INVENTORY_CACHE_TTL', DEFAULT_CACHE_TTL))
+    if ttl <= 0:
+        return create()
+    key_parts = [os.getenv('AWS_PROFILE', '')] + list(key_parts)
+    key = hashlib.sha256(
+        json.dumps(key_parts, sort_keys=True).encode('utf-8')).hexdigest()
+    name = os.path.join('inventory', key + '.json')
+    if not refresh:
+        inv = cache_utils.read_cache(name, ttl)
+        if inv is not None:
+            log.debug('Using cached inventory: %s', name)
+            return inv
+    started = time.time()
+    with cache_utils.lock(name + '.lock'):
+        # another process may have rebuilt the inventory while we waited
+        age = cache_utils.cache_age(name)
+        if age is not None and age < time.time() - started:
+            inv = cache_utils.read_cache(name, ttl)
+            if inv is not None:
+                log.debug('Using inventory built while waiting: %s', name)
+                return inv
+        inv = create()
+        cache_utils.write_cache(name, inv)
+        return inv
+
+
+def read_definition(definition):
+    """ Contents of an inventory definition
+
+    Parameters
+    ----------
+        definition: `str`
+            filename of the definition yaml file or yaml string
+
+    Returns
+    -------
+    definition yaml `str`
+    """
+    if file_util.is_file(definition):
+        with open(definition, 'r') as stream:
+            return stream.read()
+    return definition
+
+
+def create_dynamic_ec2_inventory(definition, region=None, snapshot=None):
     """ Create a fully formed ansible ec2 inventory dictionary based on the
     definition file.
 
@@ -95,6 +186,10 @@ def create_dynamic_ec2_inventory(definition, region=None):
             filename of the definition yaml file or yaml string
         region: `str`
             aws region
+        snapshot: `bb.aws.ec2_snapshot.Ec2Snapshot`
+            snapshot to resolve groups from, by default one is taken when the
+            definition has BB_INVENTORY_SNAPSHOT_MIN_GROUPS or more groups
+            (optional)
 
     Returns
     -------
@@ -130,56 +225,109 @@ def create_dynamic_ec2_inventory(definition, region=None):
     if file_util.is_file(definition):
         inv = file_util.read_yaml_file(definition)
     else:
+        import yaml
         inv = yaml.load(definition, Loader=yaml.FullLoader)
 
     log.debug('Definition File Contents: %s', inv)
+    if region is None:
+        region = aws_region.get_region()
+    if snapshot is None:
+        min_groups = int(os.getenv(
+            'BB_INVENTORY_SNAPSHOT_MIN_GROUPS', DEFAULT_SNAPSHOT_MIN_GROUPS))
+        group_count = (
+            len(inv['ec2_inventory_groups'].get('ec2_groups') or [])
+            + len(inv['ec2_inventory_groups'].get('asg_groups') or []))
+        if min_groups > 0 and group_count >= min_groups:
+            snapshot = ec2_snapshot.get_snapshot(region)
+    # one bulk DescribeAutoScalingGroups sweep for every asg group
+    asg_groups = inv['ec2_inventory_groups'].get('asg_groups') or []
+    asg_details = {}
+    if asg_groups:
+        asg_details = asg.get_asg_details(
+            [g['name'] for g in asg_groups], region)
+
+    # resolve every group concurrently, keeping definition order
+    tasks = []
+    for g in inv['ec2_inventory_groups'].get('ec2_groups') or []:
+        tasks.append((__resolve_ec2_group, g))
+    for g in asg_groups:
+        tasks.append((__resolve_asg_group, g))
+    max_workers = int(
+        os.getenv('BB_INVENTORY_MAX_WORKERS', DEFAULT_MAX_WORKERS))
     groups = []
-    if 'ec2_groups' in inv['ec2_inventory_groups']:
-        for g in inv['ec2_inventory_groups']['ec2_groups']:
-            ipAddressType = 'PrivateIpAddress'
-            if 'addressType' in g.keys():
-                ipAddressType = g['addressType']
-
-            results = OrderedDict(
-                sorted(
-                    iteritems(ec2.get_ec2_instances(g['name'], region)),
-                    key=lambda x: x[1]['Name']))
-            if len(results) > 0:
-                instances = []
-                for k, v in iteritems(results):
-                    if v[ipAddressType] is not None:
-                        instances.append(v[ipAddressType])
-                groups.append(
-                    create_inventory_group(
-                        g['inventory']['name'],
-                        instances,
-                        g['inventory'].get('vars', []),
-                        g['inventory'].get('children', [])
-                    )
-                )
-
-    if 'asg_groups' in inv['ec2_inventory_groups']:
-        for g in inv['ec2_inventory_groups']['asg_groups']:
-            ipAddressType = 'PrivateIpAddress'
-            if 'addressType' in g.keys():
-                ipAddressType = g['addressType']
-            results = OrderedDict(
-                sorted(
-                    iteritems(
-                        ec2.get_ec2_instance_info(
-                            asg.get_asg_ec2_instance_ids(g['name'], region))),
-                    key=lambda x: x[1]['Name']))
-            if len(results) > 0:
-                instances = []
-                for k, v in iteritems(results):
-                    if v[ipAddressType] is not None:
-                        instances.append(v[ipAddressType])
-                groups.append(
-                    create_inventory_group(
-                        g['inventory']['name'],
-                        instances,
-                        g['inventory'].get('vars', []),
-                        g['inventory'].get('children', [])
-                    )
-                )
+    errors = []
+    if tasks:
+        with ThreadPoolExecutor(
+                max_workers=max(1, min(max_workers, len(tasks)))) as pool:
+            futures = [
+                pool.submit(resolve, g, region, snapshot, asg_details)
+                for resolve, g in tasks
+            ]
+            for (resolve, g), future in zip(tasks, futures):
+                try:
+                    group = future.result()
+                except Exception as e:
+                    log.error('Unable to resolve group %s: %s', g['name'], e)
+                    errors.append('%s: %s' % (g['name'], e))
+                    continue
+                if group is not None:
+                    groups.append(group)
+    if errors:
+        raise Exception(
+            'Unable to resolve inventory groups [%s]' % '; '.join(errors))
     return create_inventory(groups)
+
+
+def __resolve_ec2_group(g, region, snapshot, asg_details):
+    return __create_group(
+        g, __get_ec2_instances(g['name'], region, snapshot))
+
+
+def __resolve_asg_group(g, region, snapshot, asg_details):
+    if g['name'] not in asg_details:
+        raise Exception(g['name'] + ' not found')
+    return __create_group(
+        g,
+        __get_ec2_instance_info(
+            asg_details[g['name']]['InstanceIds'],
+            region,
+            snapshot))
+
+
+def __create_group(g, instance_info):
+    ipAddressType = 'PrivateIpAddress'
+    if 'addressType' in g.keys():
+        ipAddressType = g['addressType']
+    results = OrderedDict(
+        sorted(
+            iteritems(instance_info),
+            key=lambda x: x[1]['Name']))
+    if len(results) == 0:
+        return None
+    instances = []
+    for k, v in iteritems(results):
+        if v[ipAddressType] is not None:
+            instances.append(v[ipAddressType])
+    return create_inventory_group(
+        g['inventory']['name'],
+        instances,
+        g['inventory'].get('vars', []),
+        g['inventory'].get('children', [])
+    )
+
+
+def __get_ec2_instances(name, region, snapshot):
+    if snapshot is not None:
+        return snapshot.get_ec2_instances(name)
+    return ec2.get_ec2_instances(name, region)
+
+
+def __get_ec2_instance_info(instance_ids, region, snapshot):
+    if snapshot is None:
+        return ec2.get_ec2_instance_info(instance_ids, region)
+    info = snapshot.get_ec2_instance_info(instance_ids)
+    # instances launched after the snapshot was taken
+    missing = [i for i in instance_ids if i not in info]
+    if missing:
+        info.update(ec2.get_ec2_instance_info(missing, region))
+    return info
@@ -7,46 +7,165 @@
 
 import logging
 
+from botocore.exceptions import ClientError
+from collections import OrderedDict
 from six import iteritems
 from . import client_factory as aws_client_factory
+from . import metadata
 
 log = logging.getLogger(__name__)
 
+# maximum group names accepted by one DescribeAutoScalingGroups request
+MAX_ASG_NAMES_PER_REQUEST = 50
+# maximum instance ids accepted by one DescribeAutoScalingInstances request
+MAX_INSTANCE_IDS_PER_REQUEST = 50
+# tag added by Auto Scaling to every instance it launches
+ASG_NAME_TAG = 'aws:autoscaling:groupName'
 
-def get_asg_name(instance_id, region=None):
+
+def get_asg_name(instance_id, region=None, use_metadata=False):
     """Get the asg name associated with this instance id (if one exists).
 
+    Uses DescribeAutoScalingInstances for the single instance. If that call
+    is not permitted or fails, falls back to the `aws:autoscaling:groupName`
+    tag read from instance metadata (when use_metadata is True) or
+    DescribeTags.
+
     Parameters
     ----------
         instance_id: str
             The instance_id to look for
         region: str
             AWS region name (optional)
+        use_metadata: bool
+            True if instance_id is the instance this method is called from
+            and its metadata tags may be used (optional)
     Returns
     -------
     The ASG name or None
 
     """
     log.debug('Retrieve ASG containing instance: %s', instance_id)
-    client = aws_client_factory.get_asg_client(region)
-    next_token = ''
-    asgs = []
-    while next_token is not None:
-        kwargs = {}
-        if next_token != '':
-            kwargs = {'NextToken': next_token}
-        response = client.describe_auto_scaling_groups(**kwargs)
-        next_token = response.get('NextToken', None)
-        asgs += response['AutoScalingGroups']
-
-    for asg in asgs:
-        for instance in asg['Instances']:
-            if instance_id in [x for v in iteritems(instance) for x in v]:
-                log.debug('Found ASG: %s', asg['AutoScalingGroupName'])
-                return asg['AutoScalingGroupName']
+    try:
+        asg_name = get_asg_names([instance_id], region).get(instance_id)
+        log.debug('Found ASG: %s', asg_name)
+        return asg_name
+    except ClientError as e:
+        log.debug('DescribeAutoScalingInstances failed, using %s tag: %s',
+                  ASG_NAME_TAG, e)
+    if use_metadata:
+        try:
+            return metadata.get('meta-data/tags/instance/' + ASG_NAME_TAG)
+        except Exception as e:
+            log.debug('Instance metadata tags unavailable: %s', e)
+    client = aws_client_factory.get_ec2_client(region)
+    response = client.describe_tags(
+        Filters=[
+            {'Name': 'resource-id', 'Values': [instance_id]},
+            {'Name': 'key', 'Values': [ASG_NAME_TAG]},
+        ]
+    )
+    for tag in response['Tags']:
+        log.debug('Found ASG: %s', tag['Value'])
+        return tag['Value']
     return None
 
 
+def get_asg_names(instance_ids, region=None):
+    """Get the asg names of many instances using DescribeAutoScalingInstances
+    in batches of MAX_INSTANCE_IDS_PER_REQUEST
+
+    Parameters
+    ----------
+        instance_ids: list
+            instance ids to look for
+        region: str
+            AWS region name (optional)
+    Returns
+    -------
+    `dict` of instance id to ASG name, instances that are not part of an ASG
+    are left out
+    """
+    ids = list(dict.fromkeys(instance_ids))
+    client = aws_client_factory.get_asg_client(region)
+    paginator = client.get_paginator('describe_auto_scaling_instances')
+    names = {}
+    for i in range(0, len(ids), MAX_INSTANCE_IDS_PER_REQUEST):
+        iterator = paginator.paginate(
+            InstanceIds=ids[i:i + MAX_INSTANCE_IDS_PER_REQUEST])
+        for page in iterator:
+            for instance in page['AutoScalingInstances']:
+                names[instance['InstanceId']] = (
+                    instance['AutoScalingGroupName'])
+    return names
+
+
+def get_asg_instance_index(region=None):
+    """Get the asg name of every instance in an Auto Scaling Group in the
+    region, for callers that need many lookups
+
+    Parameters
+    ----------
+        region: str
+            AWS region name (optional)
+    Returns
+    -------
+    `dict` of instance id to ASG name
+    """
+    log.debug('Retrieve ASG instance index')
+    client = aws_client_factory.get_asg_client(region)
+    paginator = client.get_paginator('describe_auto_scaling_instances')
+    index = {}
+    for page in paginator.paginate(PaginationConfig={'PageSize': 50}):
+        for instance in page['AutoScalingInstances']:
+            index[instance['InstanceId']] = instance['AutoScalingGroupName']
+    log.debug('ASG instance index holds %s instances', len(index))
+    return index
+
+
+def get_asg_details(asg_names, region=None):
+    """Get InService instance ids, desired capacity and instance lifecycle
+    states for many Auto Scaling Groups. Names are requested in batches of
+    MAX_ASG_NAMES_PER_REQUEST through the describe_auto_scaling_groups
+    paginator.
+
+    Parameters
+    ----------
+        asg_names: list
+            Names of the auto scaling groups
+        region: str
+            AWS region name (optional)
+    Returns
+    -------
+    `dict` of ASG name to `dict` with `InstanceIds` (InService instance ids),
+    `DesiredCapacity` and `LifecycleStates` (instance id to lifecycle state).
+    Groups that do not exist are left out.
+    """
+    names = list(dict.fromkeys(asg_names))
+    log.debug('Retrieve ASGs: %s', names)
+    client = aws_client_factory.get_asg_client(region)
+    paginator = client.get_paginator('describe_auto_scaling_groups')
+    details = {}
+    for i in range(0, len(names), MAX_ASG_NAMES_PER_REQUEST):
+        iterator = paginator.paginate(
+            AutoScalingGroupNames=names[i:i + MAX_ASG_NAMES_PER_REQUEST],
+            PaginationConfig={'PageSize': 100})
+        for page in iterator:
+            for group in page['AutoScalingGroups']:
+                states = OrderedDict(
+                    (instance['InstanceId'], instance['LifecycleState'])
+                    for instance in group['Instances'])
+                details[group['AutoScalingGroupName']] = {
+                    'InstanceIds': [
+                        k for k, v in iteritems(states) if v == 'InService'
+                    ],
+                    'DesiredCapacity': group['DesiredCapacity'],
+                    'LifecycleStates': states,
+                }
+    log.debug('Found ASGs: %s', list(details))
+    return details
+
+
 def get_asg_desired_size(asg_name, region=None):
     """Get desired size of provided asg.
 
@@ -60,16 +179,8 @@ def get_asg_desired_size(asg_name, region=None):
     -------
     Desired size of ASG
     """
-    log.debug('Retrieve %s desired capacity')
-    client = aws_client_factory.get_asg_client(region)
-    response = client.describe_auto_scaling_groups(
-        AutoScalingGroupNames=[
-            asg_name,
-        ]
-    )
-    if len(response['AutoScalingGroups']) != 1:
-        raise Exception(asg_name + ' not found')
-    capacity = response['AutoScalingGroups'][0]['DesiredCapacity']
+    log.debug('Retrieve %s desired capacity', asg_name)
+    capacity = __get_asg_detail(asg_name, region)['DesiredCapacity']
     log.debug('%s desired capacity: %s', asg_name, capacity)
     return capacity
 
@@ -89,17 +200,13 @@ def get_asg_ec2_instance_ids(asg_name, region=None):
     A list of EC2 instance-ids
 
     """
-    client = aws_client_factory.get_asg_client(region)
-    response = client.describe_auto_scaling_groups(
-        AutoScalingGroupNames=[
-            asg_name,
-        ]
-    )
-    if len(response['AutoScalingGroups']) != 1:
-        raise Exception(asg_name + ' not found')
-    instances = []
-    for i in response['AutoScalingGroups'][0]['Instances']:
-        if (i['LifecycleState'] == 'InService'):
-            instances.append(i['InstanceId'])
+    instances = __get_asg_detail(asg_name, region)['InstanceIds']
     log.debug('Found %s with instances: %s', asg_name, instances)
     return instances
+
+
+def __get_asg_detail(asg_name, region):
+    details = get_asg_details([asg_name], region)
+    if asg_name not in details:
+        raise Exception(asg_name + ' not found')
+    return details[asg_name]
@@ -5,105 +5,315 @@
 # Author: Matthew DeVenny
 #
 
-import boto3
 import logging
+import os
+import threading
+
+from collections import OrderedDict
 
 from . import region_utils as aws_region
+from bb.utils import import_utils as import_util
 
 log = logging.getLogger(__name__)
 
+# loaded when the first config is built, boto3 itself is imported by
+# __get_session since importing its package already loads all of it
+botocore = import_util.lazy_import('botocore')
+botocore_config = import_util.lazy_import('botocore.config')
+
+# oldest botocore accepting retries={'mode': ...}
+RETRY_MODE_MIN_BOTOCORE = (1, 15, 0)
+
+# default maximum number of clients/resources held by the pool, override with
+# BB_AWS_CLIENT_POOL_SIZE
+DEFAULT_POOL_SIZE = 64
+
+# (kind, service, region, profile, settings) -> client or resource, in LRU
+# order
+__pool = OrderedDict()
+# profile -> boto3 session shared by every client created for that profile
+__sessions = {}
+# boto3 sessions are not thread safe so creation happens under this lock
+__lock = threading.RLock()
+__pool_size = None
 
-def get_asg_client(region = None):
-    # type: (str) -> object
+# connection settings accepted as keyword arguments by the get_* functions,
+# mapped to the environment variable supplying their default
+CONFIG_ENV = OrderedDict([
+    ('max_pool_connections', 'BB_AWS_MAX_POOL_CONNECTIONS'),
+    ('retry_mode', 'BB_AWS_RETRY_MODE'),
+    ('max_attempts', 'BB_AWS_MAX_ATTEMPTS'),
+    ('connect_timeout', 'BB_AWS_CONNECT_TIMEOUT'),
+    ('read_timeout', 'BB_AWS_READ_TIMEOUT'),
+    ('tcp_keepalive', 'BB_AWS_TCP_KEEPALIVE'),
+])
+
+
+def get_asg_client(region = None, profile = None, **config):
+    # type: (str, str, ...) -> object
     """Get boto3 asg client
 
     Parameters
     ----------
         region: str
             AWS region (optional)
+        profile: str
+            AWS credentials profile (optional)
+        config:
+            connection settings, see `client_config` (optional)
     Returns
     -------
     AutoScaling client
     """
-    return __get_client('autoscaling', region)
+    return __get_client('autoscaling', region, profile, config)
 
 
-def get_ec2_client(region = None):
-    # type: (str) -> object
+def get_ec2_client(region = None, profile = None, **config):
+    # type: (str, str, ...) -> object
     """Get boto3 ec2 client
 
     Parameters
     ----------
         region: str
             AWS region (optional)
+        profile: str
+            AWS credentials profile (optional)
+        config:
+            connection settings, see `client_config` (optional)
     Returns
     -------
     ec2 client
     """
-    return __get_client('ec2', region)
+    return __get_client('ec2', region, profile, config)
 
 
-def get_ec2_resource(region = None):
-    # type: (str) -> object
+def get_ec2_resource(region = None, profile = None, **config):
+    # type: (str, str, ...) -> object
     """Get boto3 ec2 resource
 
     Parameters
     ----------
         region: str
             AWS region (optional)
+        profile: str
+            AWS credentials profile (optional)
+        config:
+            connection settings, see `client_config` (optional)
     Returns
     -------
     ec2 resource
     """
-    return __get_resource('ec2', region)
+    return __get_resource('ec2', region, profile, config)
 
 
-def get_route53_client(region = None):
-    # type: (str) -> object
-    """Get boto3 s3 client
+def get_route53_client(region = None, profile = None, **config):
+    # type: (str, str, ...) -> object
+    """Get boto3 route53 client
 
     Parameters
     ----------
         region: str
             AWS region (optional)
+        profile: str
+            AWS credentials profile (optional)
+        config:
+            connection settings, see `client_config` (optional)
     Returns
     -------
     route53 client
     """
-    return __get_client('route53', region)
+    return __get_client('route53', region, profile, config)
 
 
-def get_s3_client(region = None):
-    # type: (str) -> object
+def get_s3_client(region = None, profile = None, **config):
+    # type: (str, str, ...) -> object
     """Get boto3 s3 client
 
     Parameters
     ----------
         region: str
             AWS region (optional)
+        profile: str
+            AWS credentials profile (optional)
+        config:
+            connection settings, see `client_config` (optional)
     Returns
     -------
-    ec2 client
+    s3 client
     """
-    return __get_client('s3', region)
+    return __get_client('s3', region, profile, config)
 
 
-def get_s3_resource(region = None):
-    # type: (str) -> object
+def get_s3_resource(region = None, profile = None, **config):
+    # type: (str, str, ...) -> object
     """Get boto3 s3 resource
 
     Parameters
     ----------
         region: str
             AWS region (optional)
+        profile: str
+            AWS credentials profile (optional)
+        config:
+            connection settings, see `client_config` (optional)
     Returns
     -------
-    ec2 client
+    s3 resource
+    """
+    return __get_resource('s3', region, profile, config)
+
+
+def set_pool_size(size):
+    # type: (int) -> None
+    """Set the maximum number of clients and resources held by the pool.
+    Least recently used entries are evicted once the pool is full.
+
+    Parameters
+    ----------
+        size: int
+            maximum pool size
+    """
+    global __pool_size
+    if size < 1:
+        raise Exception('Client pool size must be at least 1')
+    with __lock:
+        __pool_size = size
+        __evict()
+
+
+def invalidate(service = None, region = None, profile = None):
+    # type: (str, str, str) -> int
+    """Drop pooled clients and resources matching the provided filters, e.g.
+    after rotating credentials. Filters left as `None` match everything.
+
+    Parameters
+    ----------
+        service: str
+            AWS service (optional)
+        region: str
+            AWS region (optional)
+        profile: str
+            AWS credentials profile (optional)
+    Returns
+    -------
+    number of pooled entries removed
     """
-    return __get_resource('s3', region)
+    with __lock:
+        keys = [
+            k for k in __pool
+            if (service is None or k[1] == service)
+            and (region is None or k[2] == region)
+            and (profile is None or k[3] == profile)
+        ]
+        for k in keys:
+            del __pool[k]
+        if service is None and region is None:
+            if profile is None:
+                __sessions.clear()
+            else:
+                __sessions.pop(profile, None)
+    log.debug('Invalidated %s pooled clients', len(keys))
+    return len(keys)
+
+
+def clear():
+    """Drop every pooled client, resource and session"""
+    invalidate()
 
 
-def __get_client(service, region):
+def client_config(**config):
+    # type: (...) -> botocore.config.Config
+    """Build the botocore config applied to every client and resource handed
+    out by this module. Settings not passed as keyword arguments are read
+    from the environment, unset settings keep the botocore default.
+
+    Parameters
+    ----------
+        max_pool_connections: int
+            size of the urllib3 connection pool (BB_AWS_MAX_POOL_CONNECTIONS)
+        retry_mode: str
+            legacy, standard or adaptive (BB_AWS_RETRY_MODE)
+        max_attempts: int
+            maximum attempts per request (BB_AWS_MAX_ATTEMPTS)
+        connect_timeout: float
+            socket connect timeout in seconds (BB_AWS_CONNECT_TIMEOUT)
+        read_timeout: float
+            socket read timeout in seconds (BB_AWS_READ_TIMEOUT)
+        tcp_keepalive: bool
+            enable TCP keepalive on sockets (BB_AWS_TCP_KEEPALIVE)
+    Returns
+    -------
+    `botocore.config.Config`
+    """
+    return __build_config(__resolve_config(config))
+
+
+def __resolve_config(config):
+    """Merge keyword settings with environment defaults into a hashable
+    `tuple` of (name, value) pairs used as part of the pool key"""
+    unknown = set(config) - set(CONFIG_ENV)
+    if unknown:
+        raise Exception('Unknown client settings: %s' % ', '.join(unknown))
+    resolved = []
+    for name, env in CONFIG_ENV.items():
+        value = config.get(name)
+        if value is None:
+            value = os.getenv(env)
+        if value is None or value == '':
+            continue
+        if name in ('max_pool_connections', 'max_attempts'):
+            value = int(value)
+        elif name in ('connect_timeout', 'read_timeout'):
+            value = float(value)
+        elif name == 'tcp_keepalive' and not isinstance(value, bool):
+            value = str(value).lower() in ('1', 'true', 'yes', 'on')
+        resolved.append((name, value))
+    return tuple(resolved)
+
+
+def __build_config(settings):
+    kwargs = {}
+    retries = {}
+    for name, value in settings:
+        if name == 'retry_mode':
+            retries['mode'] = value
+        elif name == 'max_attempts':
+            retries['max_attempts'] = value
+        else:
+            kwargs[name] = value
+    if retries:
+        kwargs['retries'] = retries
+    __check_supported(kwargs)
+    return botocore_config.Config(**kwargs)
+
+
+def __check_supported(kwargs):
+    """Reject settings the installed botocore predates with a clear error
+    instead of an obscure one at client creation"""
+    if ('mode' in kwargs.get('retries', {})
+            and botocore_version() < RETRY_MODE_MIN_BOTOCORE):
+        raise Exception(
+            'retry_mode (BB_AWS_RETRY_MODE) requires botocore >= %s, '
+            'installed: %s' % ('.'.join(map(str, RETRY_MODE_MIN_BOTOCORE)),
+                               botocore.__version__))
+    if ('tcp_keepalive' in kwargs
+            and 'tcp_keepalive' not in botocore_config.Config.OPTION_DEFAULTS):
+        raise Exception(
+            'tcp_keepalive (BB_AWS_TCP_KEEPALIVE) is not supported by '
+            'botocore %s, upgrade botocore' % botocore.__version__)
+
+
+def botocore_version():
+    # type: () -> tuple
+    """Installed botocore version as a `tuple` of `int`"""
+    parts = []
+    for part in botocore.__version__.split('.'):
+        digits = ''.join(c for c in part if c.isdigit())
+        parts.append(int(digits or 0))
+    return tuple(parts)
+
+
+def __get_client(service, region, profile, config):
     """Get boto3 service client
 
     Parameters
@@ -112,17 +322,20 @@ def __get_client(service, region):
             AWS service
         region: str
             AWS region (optional)
+        profile: str
+            AWS credentials profile (optional)
+        config: dict
+            connection settings (optional)
     Returns
     -------
-    ec2 client
+    service client
     """
-    if region is None:
-        region = aws_region.get_region()
-    return boto3.client(service, region_name=region)
+    return __get_pooled('client', service, region, profile, config)
 
 
-def __get_resource(service, region):
-    """Get boto3 service resource
+def __get_resource(service, region, profile, config):
+    """Get boto3 service resource. Resources are not thread safe, share
+    clients rather than resources across threads.
 
     Parameters
     ----------
@@ -130,10 +343,64 @@ def __get_resource(service, region):
             AWS service
         region: str
             AWS region (optional)
+        profile: str
+            AWS credentials profile (optional)
+        config: dict
+            connection settings (optional)
     Returns
     -------
-    ec2 client
+    service resource
     """
+    return __get_pooled('resource', service, region, profile, config)
+
+
+def __get_pooled(kind, service, region, profile, config):
     if region is None:
         region = aws_region.get_region()
-    return boto3.resource(service, region_name=region)
+    if profile is None:
+        profile = os.getenv('AWS_PROFILE')
+    settings = __resolve_config(config or {})
+    key = (kind, service, region, profile, settings)
+    with __lock:
+        pooled = __pool.get(key)
+        if pooled is not None:
+            __pool.move_to_end(key)
+            return pooled
+        log.debug('Create %s %s for region: %s profile: %s settings: %s',
+                  service, kind, region, profile, settings)
+        session = __get_session(profile)
+        if kind == 'client':
+            pooled = session.client(
+                service,
+                region_name=region,
+                config=__build_config(settings))
+        else:
+            pooled = session.resource(
+                service,
+                region_name=region,
+                config=__build_config(settings))
+        __pool[key] = pooled
+        __evict()
+        return pooled
+
+
+def __get_session(profile):
+    session = __sessions.get(profile)
+    if session is None:
+        # boto3 is imported with the first client rather than with this module
+        # so commands that never reach AWS do not pay for it
+        import boto3.session
+
+        session = boto3.session.Session(profile_name=profile)
+        __sessions[profile] = session
+    return session
+
+
+def __evict():
+    size = __pool_size
+    if size is None:
+        size = int(os.getenv('BB_AWS_CLIENT_POOL_SIZE', DEFAULT_POOL_SIZE))
+    while len(__pool) > size:
+        key, _ = __pool.popitem(last=False)
+        log.debug('Evict pooled %s %s for region: %s profile: %s',
+                  key[1], key[0], key[2], key[3])
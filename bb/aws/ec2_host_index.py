@@ -0,0 +1,128 @@
+#
+# 2018 Copyright BoxBoat Technologies
+# All Rights Reserved
+#
+# Author: Matthew DeVenny
+#
+
+import logging
+import os
+
+from . import region_utils as aws_region
+from bb.utils import cache_utils as cache_util
+from bb.utils import fuzzy_utils as fuzzy
+from bb.utils import import_utils as import_util
+
+log = logging.getLogger(__name__)
+
+# only loaded when the index is rebuilt, a cached search never needs boto3
+ec2 = import_util.lazy_import('bb.aws.ec2_utils')
+
+# seconds the host index is reused before DescribeInstances is called
+# again, override with BB_EC2_HOST_INDEX_TTL
+DEFAULT_HOST_INDEX_TTL = 300
+
+# host field -> weight of a match in that field
+SEARCH_FIELDS = (
+    ('Name', 1.0),
+    ('InstanceId', 0.9),
+    ('PrivateIpAddress', 0.9),
+    ('PublicIpAddress', 0.9),
+    ('AvailabilityZone', 0.5),
+)
+# weight of a match in a tag value
+TAG_WEIGHT = 0.5
+
+
+def get_host_index(region=None, ttl=None, refresh=False):
+    """Get the running instances of a region as a list of host `dict` with
+    InstanceId, Name, PrivateIpAddress, PublicIpAddress, AvailabilityZone
+    and Tags (key to value). The index is cached on disk per AWS_PROFILE and
+    region and rebuilt with one DescribeInstances sweep when it is older
+    than ttl.
+
+    Parameters
+    ----------
+        region: `str`
+            AWS region name (optional)
+        ttl: `float`
+            seconds (default BB_EC2_HOST_INDEX_TTL or 300)
+        refresh: `bool`
+            always rebuild the index
+    Returns
+    -------
+    `list` of host `dict`
+    """
+    if region is None:
+        region = aws_region.get_region()
+    if ttl is None:
+        ttl = float(os.getenv('BB_EC2_HOST_INDEX_TTL', DEFAULT_HOST_INDEX_TTL))
+    # keyed by profile so another account's hosts are never offered
+    name = 'ec2/hosts-%s-%s.json' % (
+        os.getenv('AWS_PROFILE') or 'default', region)
+    if not refresh:
+        hosts = cache_util.read_cache(name, ttl)
+        if hosts is not None:
+            log.debug('Using host index of %s hosts cached %.0fs ago',
+                      len(hosts), cache_util.cache_age(name))
+            return hosts
+    log.debug('Building host index of region: %s', region)
+    hosts = [
+        {
+            'InstanceId': instance_id,
+            'Name': info['Name'],
+            'PrivateIpAddress': info['PrivateIpAddress'],
+            'PublicIpAddress': info['PublicIpAddress'],
+            'AvailabilityZone': info['AvailabilityZone'],
+            'Tags': dict(info.tags),
+        }
+        for instance_id, info in ec2.iter_ec2_instances(
+            region=region, states=['running'])
+    ]
+    cache_util.write_cache(name, hosts)
+    return hosts
+
+
+def search_hosts(hosts, query, limit=None):
+    """Rank hosts by how well their name, instance id, ip addresses,
+    availability zone or tag values match query, see
+    `fuzzy_utils.match_score`. Hosts only similar by trigrams are left out
+    when any host matches as a substring or subsequence.
+
+    Parameters
+    ----------
+        hosts: `list`
+            host `dict` from `get_host_index`
+        query: `str`
+            search string, every host matches an empty query
+        limit: `int`
+            maximum hosts returned (optional)
+    Returns
+    -------
+    `list` of host `dict`, best match first
+    """
+    if not query:
+        ranked = sorted(hosts, key=lambda h: (h['Name'], h['InstanceId']))
+        return ranked[:limit] if limit else ranked
+    scored = []
+    for host in hosts:
+        best = None
+        strict = False
+        fields = [(host.get(f), w) for f, w in SEARCH_FIELDS]
+        fields += [(v, TAG_WEIGHT) for v in host.get('Tags', {}).values()]
+        for value, weight in fields:
+            score = fuzzy.match_score(query, value)
+            if score is None:
+                continue
+            strict = strict or score >= fuzzy.SUBSEQUENCE_SCORE
+            if best is None or score * weight > best:
+                best = score * weight
+        if best is not None:
+            scored.append((-best, host['Name'], host['InstanceId'], host,
+                           strict))
+    # typo tolerant trigram matches only count when nothing matches strictly
+    if any(s[4] for s in scored):
+        scored = [s for s in scored if s[4]]
+    scored.sort(key=lambda s: s[:3])
+    ranked = [s[3] for s in scored]
+    return ranked[:limit] if limit else ranked
@@ -0,0 +1,148 @@
+#
+# 2018 Copyright BoxBoat Technologies
+# All Rights Reserved
+#
+# Author: Matthew DeVenny
+#
+
+import sys
+
+from collections import OrderedDict
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# dict key exposed by the mapping view -> slot holding the value
+FIELDS = OrderedDict([
+    ('Tags', 'tags'),
+    ('AvailabilityZone', 'availability_zone'),
+    ('PrivateIpAddress', 'private_ip_address'),
+    ('PrivateDnsName', 'private_dns_name'),
+    ('PublicDnsName', 'public_dns_name'),
+    ('PublicIpAddress', 'public_ip_address'),
+    ('VpcId', 'vpc_id'),
+    ('SubnetId', 'subnet_id'),
+    ('State', 'state'),
+    ('Name', 'name'),
+    ('Resource', 'resource'),
+])
+
+
+def _intern(value):
+    if value is None:
+        return None
+    return sys.intern(value)
+
+
+class Ec2Instance(Mapping):
+    """Compact, read-only record of the EC2 instance fields used by bb-py.
+
+    Values shared by many instances (availability zone, vpc, subnet, state,
+    tag keys) are interned and tags are held as a `tuple` of (key, value)
+    pairs. The record is also a read-only mapping with the same keys as the
+    `dict` previously returned by `ec2_utils`, so `info['Name']`,
+    `info.get('PublicIpAddress')` and `info['Tags']` keep working.
+    """
+
+    __slots__ = ('instance_id',) + tuple(FIELDS.values())
+
+    def __init__(self, instance_id, name='', resource='',
+                 availability_zone=None, private_ip_address=None,
+                 private_dns_name=None, public_dns_name=None,
+                 public_ip_address=None, vpc_id=None, subnet_id=None,
+                 state=None, tags=()):
+        self.instance_id = instance_id
+        self.name = name
+        self.resource = resource
+        self.availability_zone = _intern(availability_zone)
+        self.private_ip_address = private_ip_address
+        self.private_dns_name = private_dns_name
+        self.public_dns_name = public_dns_name
+        self.public_ip_address = public_ip_address
+        self.vpc_id = _intern(vpc_id)
+        self.subnet_id = _intern(subnet_id)
+        self.state = _intern(state)
+        self.tags = tuple((_intern(k), v) for k, v in tags)
+
+    @classmethod
+    def from_api(cls, i):
+        """Build a record from a DescribeInstances instance entry
+
+        Parameters
+        ----------
+            i: `dict`
+                instance entry from a DescribeInstances reservation
+        Returns
+        -------
+        `Ec2Instance`
+        """
+        tags = [(t['Key'], t['Value']) for t in i.get('Tags', [])]
+        name = ''
+        resource = ''
+        for k, v in tags:
+            if k == 'Name':
+                name = v
+            if k == 'Resource':
+                resource = v
+        return cls(
+            i['InstanceId'],
+            name=name,
+            resource=resource,
+            availability_zone=i['Placement']['AvailabilityZone'],
+            private_ip_address=i.get('PrivateIpAddress', None),
+            private_dns_name=i.get('PrivateDnsName', None),
+            public_dns_name=i.get('PublicDnsName', None),
+            public_ip_address=i.get('PublicIpAddress', None),
+            vpc_id=i.get('VpcId', None),
+            subnet_id=i.get('SubnetId', None),
+            state=i['State']['Name'],
+            tags=tags)
+
+    def tag(self, key, default=None):
+        """Value of the tag with the provided key
+
+        Parameters
+        ----------
+            key: `str`
+                tag key
+            default:
+                returned if the tag is not set (optional)
+        Returns
+        -------
+        tag value
+        """
+        for k, v in self.tags:
+            if k == key:
+                return v
+        return default
+
+    def to_dict(self):
+        """Plain `dict` copy, e.g. for `json.dumps`"""
+        return dict((k, self[k]) for k in FIELDS)
+
+    def __getitem__(self, key):
+        if key == 'Tags':
+            return [{'Key': k, 'Value': v} for k, v in self.tags]
+        try:
+            return getattr(self, FIELDS[key])
+        except KeyError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __repr__(self):
+        return 'Ec2Instance(%s, name=%r, state=%s)' % (
+            self.instance_id, self.name, self.state)
+
+    def __getstate__(self):
+        return tuple(getattr(self, s) for s in self.__slots__)
+
+    def __setstate__(self, state):
+        for s, v in zip(self.__slots__, state):
+            setattr(self, s, v)
@@ -0,0 +1,270 @@
+#
+# 2018 Copyright BoxBoat Technologies
+# All Rights Reserved
+#
+# Author: Matthew DeVenny
+#
+
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+
+from . import ec2_utils as ec2
+from . import region_utils as aws_region
+
+log = logging.getLogger(__name__)
+
+# seconds a snapshot returned by `get_snapshot` is reused, override with
+# BB_AWS_SNAPSHOT_TTL
+DEFAULT_SNAPSHOT_TTL = 60
+
+# region -> Ec2Snapshot
+__snapshots = {}
+__lock = threading.Lock()
+
+
+class Ec2Snapshot(object):
+    """Every EC2 instance in a region, fetched with one paginated
+    DescribeInstances sweep and indexed by instance id, Name tag, Resource
+    tag, vpc, subnet, availability zone and state. The lookup methods mirror
+    the functions in `ec2_utils` but are answered from memory.
+    """
+
+    def __init__(self, region=None, instances=None):
+        """
+        Parameters
+        ----------
+            region: `str`
+                AWS region name (optional)
+            instances: iterable
+                (instance-id, `Ec2Instance`) pairs, when `None` the region is
+                described (optional)
+        """
+        if region is None:
+            region = aws_region.get_region()
+        self.region = region
+        self.created = time.time()
+        if instances is None:
+            log.debug('Creating EC2 snapshot of region: %s', region)
+            instances = ec2.iter_ec2_instances(region=region)
+        self.instances = {}
+        self.by_name = {}
+        self.by_resource = {}
+        self.by_vpc = {}
+        self.by_subnet = {}
+        self.by_availability_zone = {}
+        self.by_state = {}
+        for instance_id, info in instances:
+            self.instances[instance_id] = info
+            # like the tag:Name filter, instances without a Name tag never
+            # match a name query, not even `*`
+            if info['Name']:
+                _index(self.by_name, info['Name'], instance_id)
+            _index(self.by_resource, info['Resource'], instance_id)
+            _index(self.by_vpc, info['VpcId'], instance_id)
+            _index(self.by_subnet, info['SubnetId'], instance_id)
+            _index(self.by_availability_zone, info['AvailabilityZone'],
+                   instance_id)
+            _index(self.by_state, info['State'], instance_id)
+        # sorted names for prefix lookups of wildcard Name queries
+        self.names = sorted(self.by_name)
+        log.debug('EC2 snapshot of %s holds %s instances',
+                  region, len(self.instances))
+
+    @property
+    def age(self):
+        """Seconds since the snapshot was taken"""
+        return time.time() - self.created
+
+    def get_ec2_instances(self, name, states=None):
+        """Get `dict` of ec2 instances matching provided name, supporting the
+        same `*` and `?` wildcards as the EC2 tag:Name filter
+
+        Parameters
+        ----------
+            name: `str`
+                Name of the ec2 instance
+            states: `list`
+                instance-state-name values to include (optional)
+        Returns
+        -------
+        A `dict` of instance-id to `Ec2Instance`
+        """
+        prefix, pattern = _compile_name_filter(name)
+        if pattern is None:
+            ids = self.by_name.get(prefix, [])
+        else:
+            ids = []
+            start = bisect.bisect_left(self.names, prefix)
+            for n in self.names[start:]:
+                if not n.startswith(prefix):
+                    break
+                if pattern.match(n):
+                    ids += self.by_name[n]
+        return self.__select(ids, states)
+
+    def get_ec2_instance_info(self, instance_ids):
+        """Get `dict` of ec2 instances matching provided instance-ids, ids
+        not present in the snapshot are left out
+
+        Parameters
+        ----------
+            instance_ids: `list`
+                List of ec2 instance ids
+        Returns
+        -------
+        A `dict` of instance-id to `Ec2Instance`
+        """
+        return self.__select(instance_ids)
+
+    def get_ec2_instances_in_vpc(self, vpc_id, states=None):
+        """Get `dict` of ec2 instances in provided vpc
+
+        Parameters
+        ----------
+            vpc_id: `str`
+                vpc-id to retrieve instances from
+            states: `list`
+                instance-state-name values to include (optional)
+        Returns
+        -------
+        A `dict` of instance-id to `Ec2Instance`
+        """
+        return self.__select(self.by_vpc.get(vpc_id, []), states)
+
+    def get_ec2_instances_in_subnet(self, subnet_id, states=None):
+        """Get `dict` of ec2 instances in provided subnet"""
+        return self.__select(self.by_subnet.get(subnet_id, []), states)
+
+    def get_ec2_instances_in_availability_zone(self, zone, states=None):
+        """Get `dict` of ec2 instances in provided availability zone"""
+        return self.__select(
+            self.by_availability_zone.get(zone, []), states)
+
+    def get_ec2_instances_with_resource(self, resource, states=None):
+        """Get `dict` of ec2 instances with provided Resource tag"""
+        return self.__select(self.by_resource.get(resource, []), states)
+
+    def get_ec2_instances_in_state(self, states):
+        """Get `dict` of ec2 instances in any of the provided states"""
+        ids = []
+        for state in states:
+            ids += self.by_state.get(state, [])
+        return self.__select(ids)
+
+    def get_instance_name(self, instance_id, strip_resource_tag=False):
+        """Name tag of provided instance id, see `ec2_utils.get_instance_name`
+        """
+        info = self.instances[instance_id]
+        if strip_resource_tag:
+            return ec2.strip_resource_prefix(info)
+        return info['Name']
+
+    def get_instance_private_ip(self, instance_id):
+        """Private ip address of provided instance id"""
+        return self.instances[instance_id]['PrivateIpAddress']
+
+    def get_instance_public_ip(self, instance_id):
+        """Public ip address of provided instance id"""
+        return self.instances[instance_id]['PublicIpAddress']
+
+    def __select(self, ids, states=None):
+        selected = {}
+        for instance_id in ids:
+            info = self.instances.get(instance_id)
+            if info is not None and (not states or info['State'] in states):
+                selected[instance_id] = info
+        return selected
+
+
+def get_snapshot(region=None, max_age=None, refresh=False):
+    """Get the process wide snapshot of a region, creating it if it does not
+    exist or is older than max_age
+
+    Parameters
+    ----------
+        region: `str`
+            AWS region name (optional)
+        max_age: `float`
+            seconds (default BB_AWS_SNAPSHOT_TTL or 60)
+        refresh: `bool`
+            always create a new snapshot
+    Returns
+    -------
+    `Ec2Snapshot`
+    """
+    if region is None:
+        region = aws_region.get_region()
+    if max_age is None:
+        max_age = float(os.getenv('BB_AWS_SNAPSHOT_TTL', DEFAULT_SNAPSHOT_TTL))
+    with __lock:
+        snapshot = __snapshots.get(region)
+        if refresh or snapshot is None or snapshot.age > max_age:
+            snapshot = Ec2Snapshot(region)
+            __snapshots[region] = snapshot
+        return snapshot
+
+
+def invalidate_snapshot(region=None):
+    """Drop the snapshot of the provided region, or all regions
+
+    Parameters
+    ----------
+        region: `str`
+            AWS region name (optional)
+    """
+    with __lock:
+        if region is None:
+            __snapshots.clear()
+        else:
+            __snapshots.pop(region, None)
+
+
+def _index(index, key, instance_id):
+    if key is None:
+        return
+    ids = index.get(key)
+    if ids is None:
+        index[key] = [instance_id]
+    else:
+        ids.append(instance_id)
+
+
+def _compile_name_filter(name):
+    """Split an EC2 filter value into its literal prefix and a regular
+    expression. `*` matches any run of characters, `?` exactly one and a
+    backslash escapes either.
+
+    Returns
+    -------
+    (prefix, pattern) `tuple`, pattern is `None` when name has no wildcards
+    """
+    prefix = ''
+    parts = []
+    wildcard = False
+    i = 0
+    while i < len(name):
+        c = name[i]
+        if c == '\\' and i + 1 < len(name) and name[i + 1] in '*?\\':
+            i += 1
+            c = name[i]
+            parts.append(re.escape(c))
+            if not wildcard:
+                prefix += c
+        elif c == '*':
+            wildcard = True
+            parts.append('.*')
+        elif c == '?':
+            wildcard = True
+            parts.append('.')
+        else:
+            parts.append(re.escape(c))
+            if not wildcard:
+                prefix += c
+        i += 1
+    if not wildcard:
+        return prefix, None
+    return prefix, re.compile(''.join(parts) + r'\Z', re.DOTALL)
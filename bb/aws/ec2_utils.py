@@ -6,15 +6,40 @@
 #
 
 import logging
-import requests
+import os
+import re
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 
 from . import client_factory as aws_client_factory
+from . import metadata
+from .ec2_instance import Ec2Instance
+from . import region_utils as aws_region
 
 log = logging.getLogger(__name__)
 
+# seconds DescribeInstances results are served from memory, override with
+# BB_AWS_INSTANCE_CACHE_TTL (0 disables)
+DEFAULT_INSTANCE_CACHE_TTL = 60
+# maximum instance ids sent in one DescribeInstances request
+MAX_INSTANCE_IDS_PER_REQUEST = 1000
+# concurrent DescribeInstances requests, override with BB_AWS_MAX_WORKERS
+DEFAULT_MAX_WORKERS = 8
+
+# errors isolated to individual ids rather than the whole request
+__INVALID_ID_ERRORS = ('InvalidInstanceID.NotFound',
+                       'InvalidInstanceID.Malformed')
+
+# (region, instance_id) -> (expires, instance info)
+__instance_cache = {}
+__instance_cache_lock = threading.Lock()
+
 
 def get_instance_id():
-    """ Retrieve the EC2 instance id from the instance-data url for instance
+    """ Retrieve the EC2 instance id from the instance metadata for instance
     this method is called from.
 
     Returns
@@ -22,17 +47,7 @@ def get_instance_id():
     instance-id of current instance
     """
     log.debug('Get instance-id for current instance')
-    id_request = requests.get(
-        'http://instance-data/latest/meta-data/instance-id'
-    )
-    if id_request.status_code != 200:
-        raise Exception(
-            'Unable to retrieve instance-id, Response: %s %s',
-            id_request.status_code,
-            id_request.text
-        )
-    log.debug('Return instance-id: %s', id_request.text)
-    return id_request.text
+    return metadata.get_instance_id()
 
 
 def get_current_instance_name(strip_resource_tag=False):
@@ -83,12 +98,30 @@ def get_instance_name(instance_id, strip_resource_tag=False, region=None):
     Name of provided instance
     """
     instance_info = get_ec2_instance_info([instance_id], region)[instance_id]
-    if strip_resource_tag and instance_info['Resource'] != '':
-        return instance_info['Name'][len(instance_info['Resource'])+1:]
+    if strip_resource_tag:
+        return strip_resource_prefix(instance_info)
     else:
         return instance_info['Name']
 
 
+def strip_resource_prefix(instance_info):
+    """ Remove the Resource tag prefix from the instance Name tag e.g.
+    Resource: foo, Name: foo-bar-02 results in bar-02
+
+    Paramters
+    ---------
+        instance_info: `dict`
+            instance info returned by the lookup functions in this module
+
+    Returns
+    -------
+    Name of provided instance without the Resource prefix
+    """
+    if instance_info['Resource'] != '':
+        return instance_info['Name'][len(instance_info['Resource'])+1:]
+    return instance_info['Name']
+
+
 def get_instance_private_ip(instance_id, region=None):
     """ Retrieve the EC2 instance private ip address for provided instance id
 
@@ -124,7 +157,7 @@ def get_instance_public_ip(instance_id, region=None):
 
 
 def get_instance_vpc_id():
-    """ Retrieve the EC2 vpc id from the instance-data url for instance this
+    """ Retrieve the EC2 vpc id from the instance metadata for instance this
     method is called from.
 
     Returns
@@ -132,29 +165,7 @@ def get_instance_vpc_id():
     vpc-id of current instance
     """
     log.debug('Get instance vpc-id for current instance')
-    macs_request = requests.get(
-        'http://instance-data/latest/meta-data/network/interfaces/macs/'
-    )
-    if macs_request.status_code != 200:
-        raise Exception(
-            'Unable to retrieve macs, Response: %s %s',
-            macs_request.status_code,
-            macs_request.text
-        )
-    mac = macs_request.text
-    vpc_id_request = requests.get(
-        'http://instance-data/latest/meta-data/network/interfaces/macs/'
-        + mac
-        + 'vpc-id'
-    )
-    if vpc_id_request.status_code != 200:
-        raise Exception(
-            'Unable to retrieve vpc-id, Response: %s %s',
-            vpc_id_request.status_code,
-            vpc_id_request.text
-        )
-    log.debug('Return vpc-id: %s', vpc_id_request.text)
-    return vpc_id_request.text
+    return metadata.get_vpc_id()
 
 
 def get_vpc_id_using_vpc_name(vpc_name, region=None):
@@ -185,7 +196,7 @@ def get_vpc_id_using_vpc_name(vpc_name, region=None):
         return None
 
 
-def get_ec2_instances_in_vpc(vpc_id, region=None):
+def get_ec2_instances_in_vpc(vpc_id, region=None, states=None, page_size=None):
     """Get `dict` of ec2 instances in provided vpc
 
     Parameters
@@ -194,35 +205,25 @@ def get_ec2_instances_in_vpc(vpc_id, region=None):
             vpc-id to retrieve instances from
         region: str
             AWS region name (optional)
+        states: list
+            instance-state-name values to include e.g. ['running'] (optional)
+        page_size: int
+            DescribeInstances page size (optional)
     Returns
     -------
-    A `dict` of EC2 instances
+    A `dict` of instance-id to `Ec2Instance`
 
     """
     log.debug('Retrieving EC2 instances in vpc: %s', vpc_id)
-    client = aws_client_factory.get_ec2_client(region)
-    reservations = []
-    next_token = ''
-    while next_token is not None:
-        kwargs = {
-            'Filters': [
-                {
-                    'Name': 'vpc-id',
-                    'Values': [
-                        vpc_id
-                    ],
-                }
-            ]
-        }
-        if next_token != '':
-            kwargs['NextToken'] = next_token
-        response = client.describe_instances(**kwargs)
-        next_token = response.get('NextToken', None)
-        reservations += response['Reservations']
-    return __parse_reservation_info(reservations)
+    return dict(
+        iter_ec2_instances(
+            [{'Name': 'vpc-id', 'Values': [vpc_id]}],
+            region,
+            states,
+            page_size))
 
 
-def get_ec2_instances(name, region=None):
+def get_ec2_instances(name, region=None, states=None, page_size=None):
     """Get `dict` of ec2 instances matching provided name
 
     Parameters
@@ -231,46 +232,224 @@ def get_ec2_instances(name, region=None):
             Name of the ec2 instance
         region: str
             AWS region name (optional)
+        states: list
+            instance-state-name values to include e.g. ['running'] (optional)
+        page_size: int
+            DescribeInstances page size (optional)
     Returns
     -------
-    A `dict` of EC2 instances
+    A `dict` of instance-id to `Ec2Instance`
 
     """
     log.debug('Retrieving EC2 instances matching name: %s', name)
+    return dict(
+        iter_ec2_instances(
+            [{'Name': 'tag:Name', 'Values': [name]}],
+            region,
+            states,
+            page_size))
+
+
+def iter_ec2_instances(filters=None, region=None, states=None, page_size=None):
+    """Generate (instance-id, instance info) pairs matching the provided
+    DescribeInstances filters. Pages are fetched and parsed one at a time so
+    memory does not grow with the number of instances.
+
+    Parameters
+    ----------
+        filters: list
+            DescribeInstances filters (optional)
+        region: str
+            AWS region name (optional)
+        states: list
+            instance-state-name values to include e.g. ['running'] (optional)
+        page_size: int
+            DescribeInstances page size (optional)
+    Returns
+    -------
+    generator of (`str`, `Ec2Instance`) tuples
+
+    """
+    filters = list(filters or [])
+    if states:
+        filters.append({'Name': 'instance-state-name', 'Values': list(states)})
+    kwargs = {}
+    if filters:
+        kwargs['Filters'] = filters
+    if page_size:
+        kwargs['PaginationConfig'] = {'PageSize': page_size}
     client = aws_client_factory.get_ec2_client(region)
-    instances = client.describe_instances(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    name,
-                ]
-            },
-        ]
-    )
-    return __parse_reservation_info(instances['Reservations'])
+    paginator = client.get_paginator('describe_instances')
+    for page in paginator.paginate(**kwargs):
+        for r in page['Reservations']:
+            for i in r['Instances']:
+                yield i['InstanceId'], Ec2Instance.from_api(i)
 
 
-def get_ec2_instance_info(instance_ids, region=None):
-    """Get `dict` of ec2 instances matching provided instance-ids
+def get_ec2_instance_info(instance_ids, region=None, use_cache=True):
+    """Get `dict` of ec2 instances matching provided instance-ids. Instances
+    looked up within the last BB_AWS_INSTANCE_CACHE_TTL seconds are served
+    from memory and only the remaining ids are sent to DescribeInstances.
+    Unknown or malformed ids are logged and left out of the result, any
+    other error is raised.
 
     Parameters
     ----------
-        name: list
+        instance_ids: list
             List of ec2 instance ids
         region: str
             AWS region name (optional)
+        use_cache: bool
+            False to bypass the instance cache (default True)
     Returns
     -------
-    A `dict` of EC2 instances
+    A `dict` of instance-id to `Ec2Instance`
 
     """
-    log.debug('Retrieving EC2 instances: %s', instance_ids)
-    client = aws_client_factory.get_ec2_client(region)
-    instances = client.describe_instances(
-        InstanceIds=instance_ids
-    )
-    return __parse_reservation_info(instances['Reservations'])
+    info, failed = get_ec2_instance_info_batch(instance_ids, region, use_cache)
+    for instance_id, error in failed.items():
+        log.warning('Unable to describe %s: %s', instance_id, error)
+    return info
+
+
+def get_ec2_instance_info_batch(instance_ids,
+                                region=None,
+                                use_cache=True,
+                                max_workers=None):
+    """Get ec2 instances matching provided instance-ids, reporting unknown
+    or malformed ids instead of failing the whole lookup. Other errors such
+    as AccessDenied or throttling are raised. Ids are sent in chunks of
+    MAX_INSTANCE_IDS_PER_REQUEST on a bounded thread pool.
+
+    Parameters
+    ----------
+        instance_ids: list
+            List of ec2 instance ids
+        region: str
+            AWS region name (optional)
+        use_cache: bool
+            False to bypass the instance cache (default True)
+        max_workers: int
+            concurrent requests (default BB_AWS_MAX_WORKERS or 8)
+    Returns
+    -------
+    `tuple` of `dict` of instance-id to `Ec2Instance` and `dict` of failed
+    instance id to error message
+
+    """
+    if region is None:
+        region = aws_region.get_region()
+    info = {}
+    missing = []
+    if use_cache:
+        now = time.time()
+        with __instance_cache_lock:
+            for instance_id in instance_ids:
+                cached = __instance_cache.get((region, instance_id))
+                if cached is not None and cached[0] > now:
+                    info[instance_id] = cached[1]
+                else:
+                    missing.append(instance_id)
+    else:
+        missing = list(instance_ids)
+    # preserve order while dropping duplicates
+    missing = list(dict.fromkeys(missing))
+
+    failed = {}
+    if missing:
+        log.debug('Retrieving EC2 instances: %s', missing)
+        client = aws_client_factory.get_ec2_client(region)
+        chunks = [
+            missing[i:i + MAX_INSTANCE_IDS_PER_REQUEST]
+            for i in range(0, len(missing), MAX_INSTANCE_IDS_PER_REQUEST)
+        ]
+        if max_workers is None:
+            max_workers = int(
+                os.getenv('BB_AWS_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+        with ThreadPoolExecutor(
+                max_workers=max(1, min(max_workers, len(chunks)))) as pool:
+            results = pool.map(
+                lambda chunk: __describe_instance_ids(client, chunk),
+                chunks)
+            for fetched, chunk_failed in results:
+                __cache_instance_info(fetched, region)
+                info.update(fetched)
+                failed.update(chunk_failed)
+    else:
+        log.debug('EC2 instances served from cache: %s', instance_ids)
+    return info, failed
+
+
+def invalidate_instance_info(instance_ids=None, region=None):
+    """Remove instances from the `get_ec2_instance_info` cache, e.g. after
+    modifying their tags
+
+    Parameters
+    ----------
+        instance_ids: list
+            ec2 instance ids to remove, `None` removes all (optional)
+        region: str
+            AWS region name, `None` matches every region (optional)
+    """
+    with __instance_cache_lock:
+        if instance_ids is None and region is None:
+            __instance_cache.clear()
+            return
+        for key in list(__instance_cache):
+            if ((region is None or key[0] == region)
+                    and (instance_ids is None or key[1] in instance_ids)):
+                del __instance_cache[key]
+
+
+def __describe_instance_ids(client, instance_ids):
+    """Describe instance ids following NextToken. When the request is
+    rejected because of invalid ids those ids are marked failed and the rest
+    retried, splitting the chunk if the offending ids cannot be determined.
+    Any other error applies to the whole request and is raised.
+
+    Returns
+    -------
+    `tuple` of `dict` of EC2 instances and `dict` of failed id to error
+    """
+    try:
+        reservations = []
+        paginator = client.get_paginator('describe_instances')
+        for page in paginator.paginate(InstanceIds=instance_ids):
+            reservations += page['Reservations']
+        return __parse_reservation_info(reservations), {}
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        if code not in __INVALID_ID_ERRORS:
+            raise
+        message = e.response.get('Error', {}).get('Message', str(e))
+        if len(instance_ids) == 1:
+            return {}, {instance_ids[0]: message}
+        bad = set(re.findall(r'i-[0-9a-zA-Z]+', message)) & set(instance_ids)
+        if bad:
+            failed = dict((i, message) for i in bad)
+            remaining = [i for i in instance_ids if i not in bad]
+            parts = [remaining] if remaining else []
+        else:
+            failed = {}
+            half = len(instance_ids) // 2
+            parts = [instance_ids[:half], instance_ids[half:]]
+        info = {}
+        for part in parts:
+            part_info, part_failed = __describe_instance_ids(client, part)
+            info.update(part_info)
+            failed.update(part_failed)
+        return info, failed
+
+
+def __cache_instance_info(info, region):
+    ttl = float(
+        os.getenv('BB_AWS_INSTANCE_CACHE_TTL', DEFAULT_INSTANCE_CACHE_TTL))
+    if ttl <= 0:
+        return
+    expires = time.time() + ttl
+    with __instance_cache_lock:
+        for instance_id, i in info.items():
+            __instance_cache[(region, instance_id)] = (expires, i)
 
 
 def set_ec2_instance_name(instance_id, name, region=None):
@@ -302,31 +481,22 @@ def set_ec2_instance_name(instance_id, name, region=None):
             },
         ]
     )
+    invalidate_instance_info([instance_id], region)
 
 
 def __parse_reservation_info(reservations):
     info = {}
     for r in reservations:
         for i in r['Instances']:
-            name = ''
-            resource = ''
-            for tag in i['Tags']:
-                if tag['Key'] == 'Name':
-                    name = tag['Value']
-                if tag['Key'] == 'Resource':
-                    resource = tag['Value']
-            info[i['InstanceId']] = {
-                'Tags': i['Tags'],
-                'AvailabilityZone': i['Placement']['AvailabilityZone'],
-                'PrivateIpAddress': i.get('PrivateIpAddress', None),
-                'PrivateDnsName': i.get('PrivateDnsName', None),
-                'PublicDnsName': i.get('PublicDnsName', None),
-                'PublicIpAddress': i.get('PublicIpAddress', None),
-                'VpcId': i.get('VpcId', None),
-                'SubnetId': i.get('SubnetId', None),
-                'State': i['State']['Name'],
-                'Name': name,
-                'Resource': resource,
-            }
-    log.debug('EC2 instance info: %s', info)
+            info[i['InstanceId']] = Ec2Instance.from_api(i)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('Parsed %s EC2 instances: %s', len(info), __summarize(info))
     return info
+
+
+def __summarize(info, limit=10):
+    ids = sorted(info)
+    summary = ', '.join(ids[:limit])
+    if len(ids) > limit:
+        summary += ', ... (%s more)' % (len(ids) - limit)
+    return summary
@@ -0,0 +1,255 @@
+#
+# 2018 Copyright BoxBoat Technologies
+# All Rights Reserved
+#
+# Author: Matthew DeVenny
+#
+
+import json
+import logging
+import os
+import threading
+import time
+
+from bb.utils import cache_utils
+
+log = logging.getLogger(__name__)
+
+# instance metadata service endpoint, override with BB_AWS_METADATA_ENDPOINT
+DEFAULT_ENDPOINT = 'http://169.254.169.254'
+# seconds to wait on the metadata service, override with
+# BB_AWS_METADATA_TIMEOUT
+DEFAULT_TIMEOUT = 1.0
+# lifetime requested for IMDSv2 session tokens
+DEFAULT_TOKEN_TTL = 21600
+# seconds immutable fields are cached on disk, override with
+# BB_AWS_METADATA_CACHE_TTL (0 disables)
+DEFAULT_CACHE_TTL = 86400
+
+# fields that never change for the lifetime of an instance
+IMMUTABLE_FIELDS = ('instance-id', 'region', 'mac', 'vpc-id')
+
+__CACHE = 'metadata.json'
+__BOOT_ID = '/proc/sys/kernel/random/boot_id'
+
+__lock = threading.RLock()
+__session = None
+__token = None
+__token_expires = 0
+__memo = {}
+
+
+def get_instance_id():
+    """Retrieve the instance-id of the instance this method is called from
+
+    Returns
+    -------
+    instance-id `str`
+    """
+    return __get_immutable('instance-id', lambda: get('meta-data/instance-id'))
+
+
+def get_region():
+    """Retrieve the region of the instance this method is called from
+
+    Returns
+    -------
+    aws region `str`
+    """
+    return __get_immutable(
+        'region',
+        lambda: get_identity_document()['region'])
+
+
+def get_mac():
+    """Retrieve the mac address of the primary network interface
+
+    Returns
+    -------
+    mac address `str`
+    """
+    return __get_immutable('mac', lambda: get('meta-data/mac'))
+
+
+def get_vpc_id():
+    """Retrieve the vpc-id of the primary network interface
+
+    Returns
+    -------
+    vpc-id `str`
+    """
+    return __get_immutable(
+        'vpc-id',
+        lambda: get(
+            'meta-data/network/interfaces/macs/' + get_mac() + '/vpc-id'))
+
+
+def get_identity_document():
+    """Retrieve the instance identity document
+
+    Returns
+    -------
+    identity document `dict`
+    """
+    return json.loads(get('dynamic/instance-identity/document'))
+
+
+def get(path, timeout=None):
+    """Retrieve a metadata path, e.g. `meta-data/instance-id`, using an
+    IMDSv2 token when the service supports one.
+
+    Parameters
+    ----------
+        path: `str`
+            path relative to `/latest/`
+        timeout: `float`
+            seconds to wait (optional)
+    Returns
+    -------
+    response body `str`
+    """
+    if timeout is None:
+        timeout = __timeout()
+    url = __endpoint() + '/latest/' + path.lstrip('/')
+    log.debug('Get instance metadata: %s', url)
+    response = __get_session().get(
+        url, headers=__token_headers(timeout), timeout=timeout)
+    if response.status_code == 401:
+        # token expired or revoked, fetch a new one and retry once
+        __reset_token()
+        response = __get_session().get(
+            url, headers=__token_headers(timeout), timeout=timeout)
+    if response.status_code != 200:
+        raise Exception(
+            'Unable to retrieve %s, Response: %s %s' % (
+                path,
+                response.status_code,
+                response.text))
+    return response.text
+
+
+def clear(disk=False):
+    """Forget memoized fields, token and session
+
+    Parameters
+    ----------
+        disk: `bool`
+            also remove the on-disk cache
+    """
+    global __session, __token, __token_expires
+    with __lock:
+        __memo.clear()
+        __token = None
+        __token_expires = 0
+        if __session is not None:
+            __session.close()
+        __session = None
+    if disk:
+        try:
+            os.remove(cache_utils.cache_path(__CACHE))
+        except OSError:
+            pass
+
+
+def __get_immutable(field, fetch):
+    with __lock:
+        if field in __memo:
+            return __memo[field]
+        cached = __read_disk_cache()
+        if field in cached:
+            __memo[field] = cached[field]
+            return cached[field]
+    value = fetch()
+    with __lock:
+        __memo[field] = value
+        __write_disk_cache(field, value)
+    return value
+
+
+def __read_disk_cache():
+    boot_id = __boot_id()
+    if boot_id is None:
+        return {}
+    cached = cache_utils.read_cache(__CACHE, __cache_ttl())
+    # a cache copied into an image or left over from a previous boot may
+    # describe a different instance
+    if not cached or cached.get('boot-id') != boot_id:
+        return {}
+    return cached
+
+
+def __write_disk_cache(field, value):
+    boot_id = __boot_id()
+    if boot_id is None or __cache_ttl() <= 0:
+        return
+    cached = __read_disk_cache()
+    cached['boot-id'] = boot_id
+    cached[field] = value
+    cache_utils.write_cache(__CACHE, cached)
+
+
+def __boot_id():
+    try:
+        with open(__BOOT_ID, 'r') as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def __get_session():
+    global __session
+    with __lock:
+        if __session is None:
+            # requests is only needed off the cached path
+            import requests
+            __session = requests.Session()
+        return __session
+
+
+def __token_headers(timeout):
+    global __token, __token_expires
+    with __lock:
+        if __token is None or time.time() >= __token_expires:
+            __token = ''
+            import requests
+            try:
+                response = __get_session().put(
+                    __endpoint() + '/latest/api/token',
+                    headers={
+                        'X-aws-ec2-metadata-token-ttl-seconds':
+                            str(DEFAULT_TOKEN_TTL)
+                    },
+                    timeout=timeout)
+            except requests.RequestException as e:
+                # the PUT response does not make it back into containers
+                # when the hop limit is 1, carry on with IMDSv1
+                log.debug('IMDSv2 token request failed: %s', e)
+                response = None
+            if response is not None and response.status_code == 200:
+                __token = response.text
+            elif response is not None:
+                # IMDSv1 only service
+                log.debug('IMDSv2 token unavailable: %s',
+                          response.status_code)
+            __token_expires = time.time() + DEFAULT_TOKEN_TTL - 60
+        if __token:
+            return {'X-aws-ec2-metadata-token': __token}
+        return {}
+
+
+def __reset_token():
+    global __token
+    with __lock:
+        __token = None
+
+
+def __endpoint():
+    return os.getenv('BB_AWS_METADATA_ENDPOINT', DEFAULT_ENDPOINT).rstrip('/')
+
+
+def __timeout():
+    return float(os.getenv('BB_AWS_METADATA_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def __cache_ttl():
+    return float(os.getenv('BB_AWS_METADATA_CACHE_TTL', DEFAULT_CACHE_TTL))
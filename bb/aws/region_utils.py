@@ -6,12 +6,10 @@
 #
 
 import logging
-import requests
-import json
-import boto3
 import os
 
 import bb.aws
+from bb.aws import metadata
 
 log = logging.getLogger(__name__)
 
@@ -31,21 +29,51 @@ def __init_region():
 
     if region is None:
         try:
-            __set_region(get_instance_region())
+            # cached on disk by metadata for the current boot
+            region = get_instance_region()
+            __set_region(region)
         except Exception as e:
             log.warn('Could not determine region automatically, set --region')
             exit(1)
 
 
 def __get_default_region():
-    """Get default region
+    """Get default region from AWS_REGION, AWS_DEFAULT_REGION or the AWS
+    config file without building a boto3 session
+
+    Returns
+    -------
+    The default AWS region or `None`
+    """
+    region = os.getenv('AWS_REGION') or os.getenv('AWS_DEFAULT_REGION')
+    if region:
+        return region
+    return __get_config_file_region()
+
+
+def __get_config_file_region():
+    """Read the region of the active profile from the AWS config file
 
-    Requires user to have default region configured
     Returns
     -------
-    The default AWS region
+    region `str` or `None`
     """
-    return boto3.session.Session().region_name
+    config_file = os.path.expanduser(
+        os.getenv('AWS_CONFIG_FILE', os.path.join('~', '.aws', 'config')))
+    if not os.path.isfile(config_file):
+        return None
+    profile = (
+        os.getenv('AWS_PROFILE')
+        or os.getenv('AWS_DEFAULT_PROFILE')
+        or 'default')
+    section = profile if profile == 'default' else 'profile ' + profile
+
+    from six.moves import configparser
+    parser = configparser.RawConfigParser()
+    parser.read(config_file)
+    if parser.has_option(section, 'region'):
+        return parser.get(section, 'region')
+    return None
 
 
 def __set_region(region_name):
@@ -78,21 +106,11 @@ def get_region():
 
 
 def get_instance_region():
-    """ Retrieve the region from the instance-data url for instance this
+    """ Retrieve the region from the instance metadata for instance this
     method is called from.
 
     Returns
     -------
     aws region of current instance
     """
-    id_request = requests.get(
-        'http://instance-data/latest/dynamic/instance-identity/document'
-    )
-    if id_request.status_code != 200:
-        raise Exception(
-            'Unable to retrieve instance-identity, Response: %s %s',
-            id_request.status_code,
-            id_request.text
-        )
-    json_response = json.loads(id_request.text)
-    return json_response['region']
+    return metadata.get_region()
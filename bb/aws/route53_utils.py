@@ -6,19 +6,441 @@
 #
 
 import logging
-import requests
+import os
+import random
+import threading
+import time
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from botocore.exceptions import ClientError
 from . import client_factory as aws_client_factory
+from bb.utils import cache_utils as cache_util
 
 log = logging.getLogger(__name__)
 
+# ChangeResourceRecordSets limits, UPSERT changes count twice
+MAX_RECORDS_PER_BATCH = 1000
+MAX_VALUE_CHARS_PER_BATCH = 32000
+
+# seconds zone name -> id lookups are cached on disk, override with
+# BB_ROUTE53_ZONE_CACHE_TTL
+DEFAULT_ZONE_CACHE_TTL = 86400
+ZONE_CACHE = 'route53/zones.json'
+
+# seconds a ChangeTracker waits for changes to be INSYNC, override with
+# BB_ROUTE53_WAIT_TIMEOUT
+DEFAULT_WAIT_TIMEOUT = 300
+# GetChange polling, Route53 allows 5 requests per second per account
+DEFAULT_POLL_WORKERS = 4
+INITIAL_POLL_DELAY = 2.0
+MAX_POLL_DELAY = 20.0
+
+# (profile, zone name, private) -> zone id, the disk cache maps the same key
+# to {'Id': zone id, 'Time': epoch seconds of the lookup}
+__zone_ids = {}
+__zone_lock = threading.Lock()
+
+
+class ChangeBatch(object):
+    """Collects UPSERT and DELETE changes across names and hosted zones and
+    submits them with as few ChangeResourceRecordSets calls as Route53
+    allows. Changes are grouped per zone and split at the per-batch record
+    and character limits. A later change to the same record set replaces an
+    earlier one.
+    """
+
+    def __init__(self, region=None, comment=None):
+        """
+        Parameters
+        ----------
+            region: `str`
+                AWS region name (optional)
+            comment: `str`
+                comment attached to each submitted batch (optional)
+        """
+        self.region = region
+        self.comment = comment
+        # zone id -> (name, type, set identifier) -> change
+        self.changes = OrderedDict()
+        # zone id -> (zone DNS, private) of zones looked up by name, looked
+        # up again when the cached id no longer exists
+        self.zones = {}
+
+    def __len__(self):
+        return sum(len(c) for c in self.changes.values())
+
+    def add(self, action, record_set, zone_dns=None, zone_id=None,
+            private=None):
+        """Add a change
+
+        Parameters
+        ----------
+            action: `str`
+                CREATE, UPSERT or DELETE
+            record_set: `dict`
+                ResourceRecordSet of the change
+            zone_dns: `str`
+                hosted zone DNS, used to look up zone_id when not provided
+            zone_id: `str`
+                hosted zone id (optional)
+            private: `bool`
+                look up the private (True) or public (False) zone when both
+                share zone_dns (optional)
+        """
+        if zone_id is None:
+            zone_id = self.hosted_zone_id(zone_dns, private)
+        key = (
+            normalize_dns_name(record_set['Name']),
+            record_set['Type'],
+            record_set.get('SetIdentifier'))
+        self.changes.setdefault(zone_id, OrderedDict())[key] = {
+            'Action': action,
+            'ResourceRecordSet': record_set,
+        }
+
+    def upsert_a_record(self, name, zone_prefix, zone_dns, ip_addresses,
+                        zone_id=None, ttl=300, private=None):
+        """Add an UPSERT of an A record, see `create_or_update_dns_a_record`
+
+        Parameters
+        ----------
+            ip_addresses: `str` or `list`
+                ip address(es) of the A record
+        """
+        if isinstance(ip_addresses, str):
+            ip_addresses = [ip_addresses]
+        self.add('UPSERT',
+                 a_record_set(get_dns_name(name, zone_prefix, zone_dns),
+                              ip_addresses, ttl),
+                 zone_dns, zone_id, private)
+
+    def delete(self, record_set, zone_dns=None, zone_id=None, private=None):
+        """Add a DELETE of an existing record set, which must match the
+        record set in Route53 exactly (TTL and values)"""
+        self.add('DELETE', record_set, zone_dns, zone_id, private)
+
+    def hosted_zone_id(self, zone_dns, private=None):
+        """Look up a hosted zone id with `get_hosted_zone_id`, `submit` looks
+        the zone up again when Route53 reports the cached id no longer
+        exists
+
+        Returns
+        -------
+        hosted zone id `str`
+        """
+        zone_id = get_hosted_zone_id(zone_dns, self.region, private)
+        self.zones[zone_id] = (zone_dns, private)
+        return zone_id
+
+    def batches(self):
+        """Split the changes into ChangeResourceRecordSets calls
+
+        Returns
+        -------
+        `list` of (zone id, `list` of changes) `tuple`
+        """
+        batches = []
+        for zone_id, changes in self.changes.items():
+            batch = []
+            records = 0
+            chars = 0
+            for change in changes.values():
+                weight = 2 if change['Action'] == 'UPSERT' else 1
+                record_set = change['ResourceRecordSet']
+                values = record_set.get('ResourceRecords', [])
+                change_records = weight * max(len(values), 1)
+                change_chars = weight * sum(len(v['Value']) for v in values)
+                if batch and (
+                        records + change_records > MAX_RECORDS_PER_BATCH
+                        or chars + change_chars > MAX_VALUE_CHARS_PER_BATCH):
+                    batches.append((zone_id, batch))
+                    batch = []
+                    records = 0
+                    chars = 0
+                batch.append(change)
+                records += change_records
+                chars += change_chars
+            if batch:
+                batches.append((zone_id, batch))
+        return batches
+
+    def submit(self):
+        """Submit every batch and clear the changes
+
+        Returns
+        -------
+        `list` of ChangeInfo `dict`, one per submitted batch
+        """
+        client = aws_client_factory.get_route53_client(self.region)
+        infos = []
+        # stale zone id -> id looked up again
+        replaced = {}
+        for zone_id, batch in self.batches():
+            zone_id = replaced.get(zone_id, zone_id)
+            log.debug('Submit %s changes to hosted zone %s',
+                      len(batch), zone_id)
+            change_batch = {'Changes': batch}
+            if self.comment:
+                change_batch['Comment'] = self.comment
+            try:
+                response = client.change_resource_record_sets(
+                    HostedZoneId=zone_id,
+                    ChangeBatch=change_batch)
+            except ClientError as e:
+                if zone_id not in self.zones or not _is_no_such_zone(e):
+                    raise
+                zone_dns, private = self.zones.pop(zone_id)
+                log.debug('Hosted zone %s no longer exists, look up %s again',
+                          zone_id, zone_dns)
+                forget_hosted_zone_id(zone_id)
+                replaced[zone_id] = self.hosted_zone_id(zone_dns, private)
+                response = client.change_resource_record_sets(
+                    HostedZoneId=replaced[zone_id],
+                    ChangeBatch=change_batch)
+            infos.append(response['ChangeInfo'])
+        self.changes.clear()
+        return infos
+
+
+class ChangeTracker(object):
+    """Waits for Route53 changes to propagate. Each change id is polled with
+    GetChange on a thread pool, backing off exponentially with jitter, until
+    it is INSYNC or the deadline shared by every change passes.
+
+    Use `wait` to block until every change is INSYNC or `as_completed` to
+    handle changes as they finish.
+    """
+
+    def __init__(self, changes=(), region=None, timeout=None,
+                 max_workers=None, poll_delay=None):
+        """
+        Parameters
+        ----------
+            changes: iterable
+                change ids or ChangeInfo `dict` to track (optional)
+            region: `str`
+                AWS region name (optional)
+            timeout: `float`
+                seconds from now until the deadline
+                (default BB_ROUTE53_WAIT_TIMEOUT or 300)
+            max_workers: `int`
+                changes polled concurrently (default 4)
+            poll_delay: `float`
+                seconds before the second poll, doubled after each poll up
+                to MAX_POLL_DELAY (default INITIAL_POLL_DELAY)
+        """
+        if timeout is None:
+            timeout = float(os.getenv(
+                'BB_ROUTE53_WAIT_TIMEOUT', DEFAULT_WAIT_TIMEOUT))
+        self.region = region
+        self.deadline = time.time() + timeout
+        self.poll_delay = poll_delay or INITIAL_POLL_DELAY
+        self.stopped = threading.Event()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or DEFAULT_POLL_WORKERS)
+        # change id -> future returning the INSYNC ChangeInfo
+        self.futures = OrderedDict()
+        for change in changes:
+            self.add(change)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, change):
+        """Track another change
+
+        Parameters
+        ----------
+            change: `str` or `dict`
+                change id or the ChangeInfo returned when it was submitted
+        """
+        change_id = change['Id'] if isinstance(change, dict) else change
+        if change_id not in self.futures:
+            self.futures[change_id] = self.executor.submit(
+                self._poll, change_id)
+
+    def as_completed(self):
+        """Yield the ChangeInfo of each change as it becomes INSYNC
+
+        Raises
+        ------
+        Exception if the deadline passes first
+        """
+        futures = dict((f, k) for k, f in self.futures.items())
+        # pollers give up at the deadline, the margin covers a final poll
+        timeout = max(0, self.deadline - time.time()) + 30
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                yield future.result()
+        except FuturesTimeoutError:
+            raise Exception('Timed out waiting for changes: ' + ', '.join(
+                k for f, k in futures.items() if not f.done()))
+
+    def wait(self):
+        """Block until every change is INSYNC
+
+        Returns
+        -------
+        `OrderedDict` of change id to ChangeInfo
+        Raises
+        ------
+        Exception if the deadline passes first
+        """
+        for _ in self.as_completed():
+            pass
+        return OrderedDict((k, f.result()) for k, f in self.futures.items())
+
+    def close(self):
+        """Stop polling"""
+        self.stopped.set()
+        self.executor.shutdown(wait=True)
+
+    def _poll(self, change_id):
+        client = aws_client_factory.get_route53_client(self.region)
+        delay = self.poll_delay
+        while True:
+            info = client.get_change(Id=change_id)['ChangeInfo']
+            log.debug('Change %s is %s', change_id, info['Status'])
+            if info['Status'] == 'INSYNC':
+                return info
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                raise Exception('Timed out waiting for change ' + change_id)
+            # half fixed, half random so concurrent pollers spread out
+            sleep = delay / 2 + random.uniform(0, delay / 2)
+            if self.stopped.wait(min(sleep, remaining)):
+                raise Exception('Stopped waiting for change ' + change_id)
+            delay = min(delay * 2, MAX_POLL_DELAY)
+
+
+def list_record_sets(zone_id, region=None, record_type=None):
+    """List every record set of a hosted zone with one paginated sweep
+
+    Parameters
+    ----------
+        zone_id: str
+            hosted zone id
+        region: str
+            AWS region name (optional)
+        record_type: str
+            only include record sets of this type (optional)
+    Returns
+    -------
+    `OrderedDict` of (normalized name, type, set identifier) to
+    ResourceRecordSet
+    """
+    client = aws_client_factory.get_route53_client(region)
+    paginator = client.get_paginator('list_resource_record_sets')
+    record_sets = OrderedDict()
+    iterator = paginator.paginate(
+        HostedZoneId=zone_id,
+        PaginationConfig={'PageSize': 300})
+    for page in iterator:
+        for record_set in page['ResourceRecordSets']:
+            if record_type and record_set['Type'] != record_type:
+                continue
+            key = (
+                normalize_dns_name(record_set['Name']),
+                record_set['Type'],
+                record_set.get('SetIdentifier'))
+            record_sets[key] = record_set
+    log.debug('Listed %s record sets in %s', len(record_sets), zone_id)
+    return record_sets
+
+
+def reconcile_a_records(desired,
+                        zone_dns=None,
+                        zone_id=None,
+                        region=None,
+                        private=None,
+                        ttl=300,
+                        prune_domain=None,
+                        batch=None):
+    """Add the changes that make a zone's A records match desired to a
+    `ChangeBatch`. The zone is listed once and only records that are
+    missing or differ are changed.
+
+    Parameters
+    ----------
+        desired: dict
+            DNS name to `list` of ip addresses
+        zone_dns: str
+            hosted zone DNS, used to look up zone_id when not provided
+        zone_id: str
+            hosted zone id (optional)
+        region: str
+            AWS region name (optional)
+        private: bool
+            look up the private (True) or public (False) zone (optional)
+        ttl: int
+            TTL of the records
+        prune_domain: str
+            delete A records exactly one label below this domain that are not
+            desired, alias and routing policy records are never deleted
+            (optional)
+        batch: `ChangeBatch`
+            batch to add the changes to (optional)
+    Returns
+    -------
+    `ChangeBatch` holding the changes
+    """
+    if batch is None:
+        batch = ChangeBatch(region)
+    looked_up = zone_id is None
+    if looked_up:
+        zone_id = batch.hosted_zone_id(zone_dns, private)
+    try:
+        existing = list_record_sets(zone_id, region, 'A')
+    except ClientError as e:
+        if not looked_up or not _is_no_such_zone(e):
+            raise
+        log.debug('Hosted zone %s no longer exists, look up %s again',
+                  zone_id, zone_dns)
+        forget_hosted_zone_id(zone_id)
+        zone_id = batch.hosted_zone_id(zone_dns, private)
+        existing = list_record_sets(zone_id, region, 'A')
+    wanted = set()
+    for dns_name, ip_addresses in desired.items():
+        name = normalize_dns_name(dns_name)
+        wanted.add(name)
+        current = existing.get((name, 'A', None))
+        record_set = a_record_set(dns_name, sorted(set(ip_addresses)), ttl)
+        if current is not None and __same_records(current, record_set):
+            continue
+        log.debug('UPSERT %s %s', dns_name, record_set['ResourceRecords'])
+        batch.add('UPSERT', record_set, zone_id=zone_id)
+    if prune_domain:
+        domain = normalize_dns_name(prune_domain)
+        for (name, _, set_id), record_set in existing.items():
+            if (name in wanted or set_id is not None
+                    or 'AliasTarget' in record_set
+                    or name.partition('.')[2] != domain):
+                continue
+            log.debug('DELETE %s', record_set['Name'])
+            batch.delete(record_set, zone_id=zone_id)
+    return batch
+
+
+def __same_records(current, record_set):
+    return (
+        'AliasTarget' not in current
+        and current.get('TTL') == record_set['TTL']
+        and sorted(r['Value'] for r in current.get('ResourceRecords', []))
+        == [r['Value'] for r in record_set['ResourceRecords']])
+
 
 def create_or_update_dns_a_record(name,
                                   zone_prefix,
                                   zone_dns,
                                   ip_address,
                                   zone_id=None,
-                                  region=None):
+                                  region=None,
+                                  wait=False):
     """Create A record for provided details
 
     Parameters
@@ -35,75 +457,184 @@ def create_or_update_dns_a_record(name,
             ip_address for the A record
         region: str
             AWS region name (optional)
+        wait: bool
+            wait until the change is INSYNC, see `ChangeTracker` (optional)
     Returns
     -------
-    A `dict` of EC2 instances
+    The change status, PENDING or INSYNC
 
     """
-    dns_name = ''
-    if zone_prefix is not None:
-        if zone_prefix.endswith('.'):
-            zone_prefix = zone_prefix[:-1]
-        dns_name = name + '.' + zone_prefix + '.' + zone_dns
-    else:
-        dns_name = name + '.' + zone_dns
     log.debug(
         'Create or update A record: [ %s = %s ]',
-        dns_name,
+        get_dns_name(name, zone_prefix, zone_dns),
         ip_address)
-    client = aws_client_factory.get_route53_client(region)
+    batch = ChangeBatch(region)
+    batch.upsert_a_record(name, zone_prefix, zone_dns, ip_address, zone_id)
+    info = batch.submit()[0]
+    if wait:
+        with ChangeTracker([info], region) as tracker:
+            info = tracker.wait()[info['Id']]
+    return info['Status']
 
-    if zone_id is None:
-        log.debug(
-            'Retrieve HostedZone ID based upon name: [%s] from Route53',
-            zone_dns)
-        zone_id = get_hosted_zone_id(zone_dns, region)
 
-    response = client.change_resource_record_sets(
-        HostedZoneId=zone_id,
-        ChangeBatch={
-            'Changes': [
-                {
-                    'Action': 'UPSERT',
-                    'ResourceRecordSet': {
-                        'Name': dns_name,
-                        'Type': 'A',
-                        'TTL': 300,
-                        'ResourceRecords': [
-                            {
-                                'Value': ip_address
-                            },
-                        ]
-                    }
-                },
-            ]
-        }
-    )
-    return response['ChangeInfo']['Status']
+def get_dns_name(name, zone_prefix, zone_dns):
+    """DNS name of an A record, `<name>.<prefix>.<zone>` or `<name>.<zone>`
+
+    Parameters
+    ----------
+        name: str
+            prefix for the provided zone
+        zone_prefix: str
+            zone prefix (can be `None`)
+        zone_dns: str
+            hosted zone DNS
+    Returns
+    -------
+    DNS name `str`
+    """
+    if zone_prefix is not None:
+        if zone_prefix.endswith('.'):
+            zone_prefix = zone_prefix[:-1]
+        return name + '.' + zone_prefix + '.' + zone_dns
+    return name + '.' + zone_dns
 
 
-def get_hosted_zone_id(zone_dns, region=None):
-    """Retrive the hosted zone id give the provided zone DNS name
+def normalize_dns_name(dns_name):
+    """Lower case DNS name with the trailing dot Route53 returns"""
+    dns_name = dns_name.lower()
+    if not dns_name.endswith('.'):
+        dns_name += '.'
+    return dns_name
+
+
+def a_record_set(dns_name, ip_addresses, ttl=300):
+    """ResourceRecordSet of an A record
+
+    Parameters
+    ----------
+        dns_name: str
+            record name
+        ip_addresses: list
+            record values
+        ttl: int
+            record TTL
+    Returns
+    -------
+    ResourceRecordSet `dict`
+    """
+    return {
+        'Name': dns_name,
+        'Type': 'A',
+        'TTL': ttl,
+        'ResourceRecords': [{'Value': ip} for ip in ip_addresses],
+    }
+
+
+def get_hosted_zone_id(zone_dns, region=None, private=None):
+    """Retrive the hosted zone id give the provided zone DNS name. Lookups
+    are cached for the process and on disk for BB_ROUTE53_ZONE_CACHE_TTL
+    seconds (default 86400) from the time of each lookup. Use
+    `forget_hosted_zone_id` when a cached zone no longer exists.
 
     Parameters
     ----------
-        prefix: str
-            prefix for the provided zone
         zone_dns: str
             hosted zone DNS
         region: str
             AWS region name (optional)
+        private: bool
+            prefer the private (True) or public (False) zone when both
+            share the name (optional)
     Returns
     -------
     A `str` with the hosted zone ID populated
 
     """
+    zone_name = normalize_dns_name(zone_dns)
+    key = '%s|%s|%s' % (os.getenv('AWS_PROFILE', ''), zone_name, private)
+    with __zone_lock:
+        if key in __zone_ids:
+            return __zone_ids[key]
+        cached = __read_zone_cache()
+        if key in cached:
+            zone_id = cached[key]['Id']
+        else:
+            zone_id = __lookup_hosted_zone_id(zone_name, region, private)
+            cached[key] = {'Id': zone_id, 'Time': time.time()}
+            cache_util.write_cache(ZONE_CACHE, cached)
+        __zone_ids[key] = zone_id
+        return zone_id
+
+
+def forget_hosted_zone_id(zone_id):
+    """Drop a zone id from the process and disk caches, e.g. after Route53
+    reported NoSuchHostedZone for it
+
+    Parameters
+    ----------
+        zone_id: str
+            hosted zone id
+    """
+    with __zone_lock:
+        for key in [k for k, v in __zone_ids.items() if v == zone_id]:
+            del __zone_ids[key]
+        cached = __read_zone_cache()
+        kept = dict((k, v) for k, v in cached.items() if v['Id'] != zone_id)
+        if len(kept) != len(cached):
+            cache_util.write_cache(ZONE_CACHE, kept)
+
+
+def __read_zone_cache():
+    """Disk cache entries younger than BB_ROUTE53_ZONE_CACHE_TTL, the file
+    is rewritten by every lookup so each entry carries its own time"""
+    ttl = float(os.getenv('BB_ROUTE53_ZONE_CACHE_TTL', DEFAULT_ZONE_CACHE_TTL))
+    cached = cache_util.read_cache(ZONE_CACHE, ttl) or {}
+    now = time.time()
+    return dict(
+        (k, v) for k, v in cached.items()
+        if isinstance(v, dict) and now - v.get('Time', 0) <= ttl)
+
+
+def clear_zone_cache(disk=False):
+    """Forget cached zone ids
+
+    Parameters
+    ----------
+        disk: bool
+            also remove the on disk cache
+    """
+    with __zone_lock:
+        __zone_ids.clear()
+        if disk:
+            try:
+                os.remove(cache_util.cache_path(ZONE_CACHE))
+            except OSError:
+                pass
+
+
+def _is_no_such_zone(e):
+    return e.response.get('Error', {}).get('Code') == 'NoSuchHostedZone'
+
+
+def __lookup_hosted_zone_id(zone_name, region, private):
     log.debug(
         'Get the HostedZoneId [%s]',
-        zone_dns)
+        zone_name)
     client = aws_client_factory.get_route53_client(region)
+    # zones are listed in name order starting at zone_name, only zones with
+    # exactly that name are candidates
     response = client.list_hosted_zones_by_name(
-        DNSName=zone_dns,
-        MaxItems='1')
-
-    return response['HostedZones'][0]['Id']
+        DNSName=zone_name,
+        MaxItems='100')
+    zones = [
+        z for z in response['HostedZones']
+        if normalize_dns_name(z['Name']) == zone_name
+    ]
+    if private is not None:
+        zones = [
+            z for z in zones
+            if z.get('Config', {}).get('PrivateZone', False) == private
+        ] or zones
+    if not zones:
+        raise Exception('Hosted zone ' + zone_name + ' not found')
+    return zones[0]['Id']
@@ -5,17 +5,73 @@
 # Author: Matthew DeVenny
 #
 
+import calendar
+import copy
+import io
+import json
 import os
 import logging
-import boto3
+import random
+import threading
+import time
+
+from botocore.exceptions import BotoCoreError, ClientError
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from s3transfer.subscribers import BaseSubscriber
+from six.moves.urllib.parse import urlencode
 
 from bb.aws import client_factory as aws_client_factory
+from bb.utils import cache_utils as cache_util
 from bb.utils import file_utils as file_util
 
 log = logging.getLogger(__name__)
 
+# TransferConfig settings and the environment variables supplying their
+# defaults, unset settings keep the boto3 default
+TRANSFER_CONFIG_ENV = {
+    'multipart_threshold': 'BB_S3_MULTIPART_THRESHOLD',
+    'multipart_chunksize': 'BB_S3_MULTIPART_CHUNKSIZE',
+    'max_concurrency': 'BB_S3_MAX_CONCURRENCY',
+}
+
+# page size used when listing prefixes (the S3 maximum)
+LIST_PAGE_SIZE = 1000
+
+# sync comparisons, size plus modification time or size plus ETag
+SYNC_SIZE_MTIME = 'size-mtime'
+SYNC_ETAG = 'etag'
+SYNC_MODES = (SYNC_SIZE_MTIME, SYNC_ETAG)
+
+# read size of ranged GET bodies of large object downloads
+RANGE_BUFFER_SIZE = 256 * 1024
+
+# attempts per object of a remote copy, override with BB_S3_COPY_ATTEMPTS
+DEFAULT_COPY_ATTEMPTS = 3
+# error codes worth retrying besides 5xx responses
+RETRYABLE_COPY_ERRORS = ('SlowDown', 'RequestTimeout', 'Throttling',
+                         'ThrottlingException', 'RequestTimeTooSkewed')
+# multipart limits of S3
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+# largest object a single CopyObject request can copy
+MAX_COPY_OBJECT_SIZE = 5 * 1024 * 1024 * 1024
+# HeadObject fields carried over to the destination of a multipart copy,
+# CopyObject copies them itself
+COPY_HEAD_FIELDS = ('CacheControl', 'ContentDisposition', 'ContentEncoding',
+                    'ContentLanguage', 'ContentType', 'Expires', 'Metadata',
+                    'StorageClass', 'ServerSideEncryption', 'SSEKMSKeyId',
+                    'BucketKeyEnabled')
 
-def download_s3_uri(s3_uri, dest_dir, region=None):
+
+def download_s3_uri(s3_uri,
+                    dest_dir,
+                    region=None,
+                    transfer_config=None,
+                    sync=None,
+                    delete=False,
+                    large_object=False):
     """Convenience method that takes an s3:// uri and calls the `download`
     method after parsing the s3 uri
 
@@ -29,12 +85,28 @@ def download_s3_uri(s3_uri, dest_dir, region=None):
             create it.
         region: `str`
             aws region (optional)
+        transfer_config: `boto3.s3.transfer.TransferConfig`
+            transfer settings (optional)
+        sync: `str`
+            sync comparison, see `download` (optional)
+        delete: `bool`
+            with sync, remove extraneous local files (optional)
+        large_object: `bool`
+            use ranged GETs with resume for a single object (optional)
     """
     bucket, key = __parse_s3_uri(s3_uri)
-    return download(bucket, key, dest_dir, region)
+    return download(bucket, key, dest_dir, region, transfer_config, sync,
+                    delete, large_object)
 
 
-def download(bucket, object_key, dest_dir, region=None):
+def download(bucket,
+             object_key,
+             dest_dir,
+             region=None,
+             transfer_config=None,
+             sync=None,
+             delete=False,
+             large_object=False):
     """Download from S3
 
     Parameters
@@ -50,55 +122,378 @@ def download(bucket, object_key, dest_dir, region=None):
             create it.
         region: `str`
             aws region (optional)
+        transfer_config: `boto3.s3.transfer.TransferConfig`
+            transfer settings, `max_concurrency` bounds the number of objects
+            downloaded at once (default `get_transfer_config()`)
+        sync: `str`
+            only download objects that differ from the local file, compared
+            by `SYNC_SIZE_MTIME` or `SYNC_ETAG` (optional)
+        delete: `bool`
+            with sync, remove local files under dest_dir that do not exist
+            under the prefix (optional)
+        large_object: `bool`
+            download a single object with `download_large_object` (optional)
     """
-    s3 = aws_client_factory.get_s3_resource(region)
+    if transfer_config is None:
+        transfer_config = get_transfer_config()
+    client = __get_transfer_client(region, transfer_config)
 
     if object_key.startswith('/'):
         object_key = object_key[len('/'):]
 
-    if object_key.endswith('/'):
-        paginator = s3.meta.client.get_paginator('list_objects_v2')
-        iterator = paginator.paginate(
-            Bucket=bucket,
-            Prefix=object_key,
-            PaginationConfig={'PageSize': 50})
-        for page in iterator:
-            for obj in page['Contents']:
-                if not obj['Key'].endswith('/'):
+    stats = _TransferStats()
+    with create_transfer_manager(client, transfer_config) as manager:
+        if object_key.endswith('/'):
+            paginator = client.get_paginator('list_objects_v2')
+            iterator = paginator.paginate(
+                Bucket=bucket,
+                Prefix=object_key,
+                PaginationConfig={'PageSize': LIST_PAGE_SIZE})
+            created = set()
+            seen = set()
+            manifest = None
+            if sync == SYNC_ETAG:
+                manifest = file_util.FileManifest(dest_dir)
+            pending = deque()
+            for page in iterator:
+                for obj in page.get('Contents', []):
+                    if obj['Key'].endswith('/'):
+                        continue
                     final_dest = (
                         dest_dir
                         + os.sep
                         + obj['Key'][len(object_key):])
+                    if sync:
+                        seen.add(os.path.normpath(final_dest))
+                        if not __differs(
+                                final_dest, obj, sync, transfer_config,
+                                False, manifest):
+                            log.debug('Unchanged: %s', final_dest)
+                            stats.skip()
+                            continue
                     head, tail = os.path.split(final_dest)
-
-                    if not os.path.exists(head):
+                    if head not in created:
                         log.debug('Creating destination dir: %s', head)
-                        os.makedirs(head)
+                        os.makedirs(head, exist_ok=True)
+                        created.add(head)
 
-                    log.info(
+                    log.debug(
                         'Download s3://%s/%s to %s',
                         bucket,
                         obj['Key'],
                         final_dest)
-                    s3.meta.client.download_file(
-                        bucket,
-                        obj['Key'],
-                        final_dest)
-    else:
-        if not os.path.exists(dest_dir):
-            os.makedirs(dest_dir)
-        log.info(
-            'Download s3://%s/%s to %s',
-            bucket,
-            object_key,
-            dest_dir + os.sep + os.path.basename(object_key))
-        s3.meta.client.download_file(
-            bucket,
-            object_key,
-            dest_dir + os.sep + os.path.basename(object_key))
+                    pending.append(
+                        manager.download(
+                            bucket,
+                            obj['Key'],
+                            final_dest,
+                            subscribers=[
+                                _ProvideSize(obj['Size'], obj.get('ETag'))
+                            ]))
+                    stats.add(obj['Size'])
+                    # bound the futures held while the listing streams in
+                    while pending and (
+                            pending[0].done()
+                            or len(pending) > LIST_PAGE_SIZE):
+                        pending.popleft().result()
+            for future in pending:
+                future.result()
+            if manifest is not None:
+                manifest.save()
+            if sync and delete and os.path.isdir(dest_dir):
+                for file in file_util.get_files_in_directory(dest_dir, False):
+                    if os.path.normpath(file) not in seen:
+                        log.info('Delete %s', file)
+                        os.remove(file)
+        else:
+            if not os.path.exists(dest_dir):
+                os.makedirs(dest_dir)
+            final_dest = dest_dir + os.sep + os.path.basename(object_key)
+            if sync:
+                obj = __head_entry(client, bucket, object_key)
+                if obj is not None and not __differs(
+                        final_dest, obj, sync, transfer_config, False):
+                    log.info('Unchanged: %s', final_dest)
+                    return
+            if large_object:
+                return download_large_object(
+                    bucket, object_key, final_dest, region, transfer_config)
+            log.info(
+                'Download s3://%s/%s to %s',
+                bucket,
+                object_key,
+                final_dest)
+            future = manager.download(bucket, object_key, final_dest)
+            future.result()
+            stats.add(future.meta.size or 0)
+    stats.log('Downloaded', 's3://%s/%s' % (bucket, object_key))
+
+
+def download_large_object(bucket,
+                          object_key,
+                          dest_file,
+                          region=None,
+                          transfer_config=None,
+                          max_attempts=None):
+    """Download one large object with concurrent ranged GETs. Each range of
+    `multipart_chunksize` bytes is written straight to its offset in a
+    preallocated `<dest_file>.bbpart` file and recorded in a
+    `<dest_file>.bbpart.map` sidecar, so an interrupted download resumes
+    with the ranges still missing. The ETag is verified before the file is
+    moved into place.
+
+    Parameters
+    ----------
+        bucket: `str`
+            s3 bucket to retrieve object_key from
+        object_key: `str`
+            key for s3 object
+        dest_file: `str`
+            destination file
+        region: `str`
+            aws region (optional)
+        transfer_config: `boto3.s3.transfer.TransferConfig`
+            transfer settings, `max_concurrency` bounds the ranges fetched at
+            once (default `get_transfer_config()`)
+        max_attempts: `int`
+            attempts per range (default BB_S3_COPY_ATTEMPTS or 3)
+    """
+    if transfer_config is None:
+        transfer_config = get_transfer_config()
+    if max_attempts is None:
+        max_attempts = int(
+            os.getenv('BB_S3_COPY_ATTEMPTS', DEFAULT_COPY_ATTEMPTS))
+    client = __get_transfer_client(region, transfer_config)
+    if object_key.startswith('/'):
+        object_key = object_key[len('/'):]
+
+    head = client.head_object(Bucket=bucket, Key=object_key)
+    size = head['ContentLength']
+    etag = head.get('ETag')
+    chunksize = transfer_config.multipart_chunksize
+    part_file = dest_file + '.bbpart'
+    map_file = part_file + '.map'
+    header = {'etag': etag, 'size': size, 'chunksize': chunksize}
+    done = __read_part_map(map_file, header)
+    if done is None:
+        done = set()
+        cache_util.atomic_write(map_file, json.dumps(header) + '\n')
+    ranges = [
+        (number, offset, min(offset + chunksize, size) - 1)
+        for number, offset in enumerate(range(0, size, chunksize), 1)
+        if number not in done
+    ]
+    log.info('Download s3://%s/%s to %s, %s of %s ranges remaining',
+             bucket, object_key, dest_file, len(ranges),
+             -(-size // chunksize))
+
+    dest_dir = os.path.dirname(os.path.abspath(dest_file))
+    if not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir, exist_ok=True)
+    stats = _TransferStats()
+    fd = os.open(part_file, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)
+            if hasattr(os, 'posix_fallocate') and size:
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except OSError as e:
+                    log.debug('Unable to preallocate %s: %s', part_file, e)
+        lock = threading.Lock()
+        with open(map_file, 'a') as part_map, ThreadPoolExecutor(
+                max_workers=transfer_config.max_request_concurrency) as ex:
+            def fetch(number, first, last):
+                __fetch_range(client, bucket, object_key, etag, fd, first,
+                              last, max_attempts)
+                os.fsync(fd)
+                with lock:
+                    part_map.write('%s\n' % number)
+                    part_map.flush()
+                return last - first + 1
+            futures = [ex.submit(fetch, *r) for r in ranges]
+            try:
+                for future in futures:
+                    stats.add(future.result())
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        os.close(fd)
+
+    if not __verify_etag(part_file, head, transfer_config):
+        os.remove(part_file)
+        os.remove(map_file)
+        raise Exception('ETag mismatch downloading s3://%s/%s' % (
+            bucket, object_key))
+    os.replace(part_file, dest_file)
+    os.remove(map_file)
+    stats.log('Downloaded', 's3://%s/%s' % (bucket, object_key))
+
+
+def download_fileobj_s3_uri(s3_uri, fileobj, region=None,
+                            transfer_config=None):
+    """Convenience method that takes an s3:// uri and calls the
+    `download_fileobj` method after parsing the s3 uri
+
+    Parameters
+    ----------
+        s3_uri: `str`
+            URI for s3 object of the form `s3://<bucket>/some/path`
+        fileobj:
+            binary file-like object to write to
+        region: `str`
+            aws region (optional)
+        transfer_config: `boto3.s3.transfer.TransferConfig`
+            transfer settings (optional)
+    """
+    bucket, key = __parse_s3_uri(s3_uri)
+    return download_fileobj(bucket, key, fileobj, region, transfer_config)
+
+
+def download_fileobj(bucket,
+                     object_key,
+                     fileobj,
+                     region=None,
+                     transfer_config=None):
+    """Download an object into a binary file-like object such as stdout.
+    Objects above the multipart threshold are fetched with concurrent ranged
+    GETs. Parts are always written in order at the current position, even
+    when fileobj is seekable (e.g. stdout redirected to a file), so existing
+    contents are kept. At most `max_in_memory_download_chunks` parts are
+    buffered.
+
+    Parameters
+    ----------
+        bucket: `str`
+            s3 bucket to retrieve object_key from
+        object_key: `str`
+            key for s3 object
+        fileobj:
+            binary file-like object to write to
+        region: `str`
+            aws region (optional)
+        transfer_config: `boto3.s3.transfer.TransferConfig`
+            transfer settings (default `get_transfer_config()`)
+    """
+    if transfer_config is None:
+        transfer_config = get_transfer_config()
+    client = __get_transfer_client(region, transfer_config)
+    if object_key.startswith('/'):
+        object_key = object_key[len('/'):]
+    stats = _TransferStats()
+    log.debug('Download s3://%s/%s to stream', bucket, object_key)
+    with create_transfer_manager(client, transfer_config) as manager:
+        # s3transfer writes ranges at absolute offsets into seekable files
+        future = manager.download(bucket, object_key, _StreamWriter(fileobj))
+        future.result()
+        stats.add(future.meta.size or 0)
+    stats.log('Downloaded', 's3://%s/%s' % (bucket, object_key))
+
+
+def upload_fileobj_s3_uri(fileobj, uri, region=None, transfer_config=None,
+                          expected_size=None):
+    """Convenience method that takes an s3:// uri and calls the
+    `upload_fileobj` method after parsing the s3 uri
+
+    Parameters
+    ----------
+        fileobj:
+            binary file-like object to read from
+        uri: `str`
+            URI for s3 object of the form `s3://<bucket>/some/path`
+        region: `str`
+            aws region (optional)
+        transfer_config: `boto3.s3.transfer.TransferConfig`
+            transfer settings (optional)
+        expected_size: `int`
+            approximate stream size in bytes (optional)
+    """
+    bucket, key = __parse_s3_uri(uri)
+    return upload_fileobj(fileobj, bucket, key, region, transfer_config,
+                          expected_size)
+
+
+def upload_fileobj(fileobj,
+                   dest_bucket,
+                   dest_key,
+                   region=None,
+                   transfer_config=None,
+                   expected_size=None):
+    """Upload a binary file-like object such as stdin. Streams larger than
+    the multipart threshold are read into parts that upload concurrently, at
+    most `max_in_memory_upload_chunks` parts are held in memory.
+
+    Parameters
+    ----------
+        fileobj:
+            binary file-like object to read from
+        dest_bucket: `str`
+            destination bucket
+        dest_key: `str`
+            destination key
+        region: `str`
+            aws region (optional)
+        transfer_config: `boto3.s3.transfer.TransferConfig`
+            transfer settings (default `get_transfer_config()`)
+        expected_size: `int`
+            approximate stream size in bytes, raises the part size when
+            needed to stay within the S3 limit of 10000 parts (optional)
+    """
+    if transfer_config is None:
+        transfer_config = get_transfer_config()
+    if dest_key.startswith('/'):
+        dest_key = dest_key[len('/'):]
+    if not dest_key or dest_key.endswith('/'):
+        raise Exception('A destination key is required to upload a stream')
+    if expected_size:
+        chunksize = -(-expected_size // MAX_PARTS)
+        if chunksize > transfer_config.multipart_chunksize:
+            transfer_config = copy.copy(transfer_config)
+            transfer_config.multipart_chunksize = chunksize
+            log.debug('Using %s byte parts for %s byte stream',
+                      chunksize, expected_size)
+    client = __get_transfer_client(region, transfer_config)
+    stats = _TransferStats()
+    log.debug('Upload stream to s3://%s/%s', dest_bucket, dest_key)
+    counter = _CountBytes()
+    with create_transfer_manager(client, transfer_config) as manager:
+        manager.upload(
+            fileobj, dest_bucket, dest_key, subscribers=[counter]).result()
+    stats.add(counter.bytes)
+    stats.log('Uploaded', 's3://%s/%s' % (dest_bucket, dest_key))
+
+
+def get_transfer_config(**config):
+    """Build the `TransferConfig` shared by every object of a transfer.
+    Settings not passed as keyword arguments are read from the environment.
 
+    Parameters
+    ----------
+        multipart_threshold: `int`
+            size in bytes above which multipart transfers are used
+            (BB_S3_MULTIPART_THRESHOLD)
+        multipart_chunksize: `int`
+            multipart part size in bytes (BB_S3_MULTIPART_CHUNKSIZE)
+        max_concurrency: `int`
+            concurrent S3 requests (BB_S3_MAX_CONCURRENCY)
+    Returns
+    -------
+    `boto3.s3.transfer.TransferConfig`
+    """
+    kwargs = {}
+    for name, env in TRANSFER_CONFIG_ENV.items():
+        value = config.pop(name, None)
+        if value is None and os.getenv(env):
+            value = os.getenv(env)
+        if value is not None:
+            kwargs[name] = int(value)
+    kwargs.update(config)
+    return TransferConfig(**kwargs)
 
-def remote_copy_s3_uri(src, dest, region=None):
+
+def remote_copy_s3_uri(src, dest, region=None, transfer_config=None):
     """Convenience method that takes s3:// URI for src and dest and calls
     `remote_copy` after parsing URIs
 
@@ -110,14 +505,25 @@ def remote_copy_s3_uri(src, dest, region=None):
             URI for s3 object of the form `s3://<bucket>/some/path`
         region: `str`
             aws region (optional)
+        transfer_config: `boto3.s3.transfer.TransferConfig`
+            transfer settings (optional)
     """
     src_bucket, src_key = __parse_s3_uri(src)
     dest_bucket, dest_key = __parse_s3_uri(dest)
-    return remote_copy(src_bucket, src_key, dest_bucket, dest_key, region)
+    return remote_copy(src_bucket, src_key, dest_bucket, dest_key, region,
+                       transfer_config)
 
 
-def remote_copy(src_bucket, src_key, dest_bucket, dest_key, region=None):
-    """Remote S3 copy
+def remote_copy(src_bucket,
+                src_key,
+                dest_bucket,
+                dest_key,
+                region=None,
+                transfer_config=None,
+                max_attempts=None):
+    """Remote S3 copy. Objects are copied server side and concurrently,
+    objects larger than the multipart threshold are copied in parallel parts
+    with UploadPartCopy.
 
     Parameters
     ----------
@@ -131,60 +537,98 @@ def remote_copy(src_bucket, src_key, dest_bucket, dest_key, region=None):
             s3 dest key
         region: `str`
             aws region (optional)
+        transfer_config: `boto3.s3.transfer.TransferConfig`
+            transfer settings, `max_concurrency` bounds the number of objects
+            and the number of parts copied at once, `multipart_threshold` and
+            `multipart_chunksize` select and size multipart copies
+            (default `get_transfer_config()`)
+        max_attempts: `int`
+            attempts per object before it is reported as failed
+            (default BB_S3_COPY_ATTEMPTS or 3)
     """
-    s3 = aws_client_factory.get_s3_resource(region)
+    if transfer_config is None:
+        transfer_config = get_transfer_config()
+    if max_attempts is None:
+        max_attempts = int(
+            os.getenv('BB_S3_COPY_ATTEMPTS', DEFAULT_COPY_ATTEMPTS))
+    concurrency = transfer_config.max_request_concurrency
+    # objects and their parts run on separate pools that share the client
+    client = aws_client_factory.get_s3_client(
+        region, max_pool_connections=max(10, 2 * concurrency))
 
     if src_key.startswith('/'):
         src_key = src_key[len('/'):]
     if dest_key.startswith('/'):
         dest_key = dest_key[len('/'):]
-    if src_key.endswith('/'):
-        if not dest_key.endswith('/'):
-            dest_key = dest_key + '/'
-        paginator = s3.meta.client.get_paginator('list_objects_v2')
-        iterator = paginator.paginate(
-            Bucket=src_bucket,
-            Prefix=src_key,
-            PaginationConfig={'PageSize': 50})
-        for page in iterator:
-            for obj in page['Contents']:
-                    final_dest_key = (
-                        dest_key
-                        +
-                        obj['Key'][len(src_key):]
-                    )
-                    log.info(
-                        'Copy s3://%s/%s to s3://%s/%s',
+
+    stats = _TransferStats()
+    copier = _Copier(client, transfer_config, max_attempts)
+    failed = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor, copier:
+        pending = deque()
+        if src_key.endswith('/'):
+            if not dest_key.endswith('/'):
+                dest_key = dest_key + '/'
+            paginator = client.get_paginator('list_objects_v2')
+            iterator = paginator.paginate(
+                Bucket=src_bucket,
+                Prefix=src_key,
+                PaginationConfig={'PageSize': LIST_PAGE_SIZE})
+            for page in iterator:
+                for obj in page.get('Contents', []):
+                    final_dest_key = dest_key + obj['Key'][len(src_key):]
+                    pending.append((obj['Key'], executor.submit(
+                        copier.copy,
                         src_bucket,
                         obj['Key'],
                         dest_bucket,
-                        final_dest_key)
-                    s3.meta.client.copy(
-                        {
-                            'Bucket': src_bucket,
-                            'Key': obj['Key']
-                        },
-                        dest_bucket,
-                        final_dest_key)
-    else:
-        if (dest_key.endswith('/')):
-            dest_key = dest_key + os.path.basename(src_key)
-        log.info(
-            'Copy s3://%s/%s to s3://%s/%s',
-            src_bucket,
-            src_key,
-            dest_bucket,
-            dest_key)
-        s3.meta.client.copy(
-            {
-                'Bucket': src_bucket,
-                'Key': src_key
-            },
-            dest_bucket,
-            dest_key)
-
-
-def upload_s3_uri(src, uri, region=None):
+                        final_dest_key,
+                        obj['Size'],
+                        obj.get('ETag'))))
+                    stats.add(obj['Size'])
+                    # bound the futures held while the listing streams in
+                    while pending and (
+                            pending[0][1].done()
+                            or len(pending) > LIST_PAGE_SIZE):
+                        __collect_copy(pending.popleft(), failed)
+        else:
+            if (dest_key.endswith('/')):
+                dest_key = dest_key + os.path.basename(src_key)
+            head = client.head_object(Bucket=src_bucket, Key=src_key)
+            pending.append((src_key, executor.submit(
+                copier.copy,
+                src_bucket,
+                src_key,
+                dest_bucket,
+                dest_key,
+                head['ContentLength'],
+                head.get('ETag'),
+                head)))
+            stats.add(head['ContentLength'])
+        while pending:
+            __collect_copy(pending.popleft(), failed)
+    stats.log('Copied', 's3://%s/%s to s3://%s/%s' % (
+        src_bucket, src_key, dest_bucket, dest_key))
+    if failed:
+        raise Exception('Failed to copy %s objects: %s' % (
+            len(failed), ', '.join(sorted(failed))))
+
+
+def __collect_copy(entry, failed):
+    key, future = entry
+    try:
+        future.result()
+    except Exception as e:
+        log.error('Copy of s3 key %s failed: %s', key, e)
+        failed[key] = e
+
+
+def upload_s3_uri(src,
+                  uri,
+                  region=None,
+                  transfer_config=None,
+                  sync=None,
+                  delete=False):
     """Convenience method that takes s3:// URI for src and dest and calls
     `remote_copy` after parsing URIs
 
@@ -196,14 +640,28 @@ def upload_s3_uri(src, uri, region=None):
             URI for s3 object of the form `s3://<bucket>/some/path`
         region: `str`
             aws region (optional)
+        transfer_config: `boto3.s3.transfer.TransferConfig`
+            transfer settings (optional)
+        sync: `str`
+            sync comparison, see `upload` (optional)
+        delete: `bool`
+            with sync, delete extraneous objects (optional)
     """
 
     bucket, key = __parse_s3_uri(uri)
-    return upload(src, bucket, key, region)
+    return upload(src, bucket, key, region, transfer_config, sync, delete)
 
 
-def upload(src, dest_bucket, dest_key, region=None):
-    """Upload to s3
+def upload(src,
+           dest_bucket,
+           dest_key,
+           region=None,
+           transfer_config=None,
+           sync=None,
+           delete=False):
+    """Upload to s3. Files of a directory are submitted to a single transfer
+    manager so small files upload concurrently and large files use
+    multipart uploads.
 
     Parameters
     ----------
@@ -215,8 +673,18 @@ def upload(src, dest_bucket, dest_key, region=None):
             destination key
         region: `str`
             aws region (optional)
+        transfer_config: `boto3.s3.transfer.TransferConfig`
+            transfer settings, `max_concurrency` bounds the number of
+            requests made at once (default `get_transfer_config()`)
+        sync: `str`
+            only upload files that differ from the object in S3, compared by
+            `SYNC_SIZE_MTIME` or `SYNC_ETAG` (optional)
+        delete: `bool`
+            with sync, delete objects under the destination prefix that do
+            not exist locally (optional)
     """
-    s3 = aws_client_factory.get_s3_resource(region)
+    if transfer_config is None:
+        transfer_config = get_transfer_config()
     if dest_key.startswith('/'):
         dest_key = dest_key[len('/'):]
     if os.path.isdir(src):
@@ -224,28 +692,480 @@ def upload(src, dest_bucket, dest_key, region=None):
         if dest_key.endswith('/'):
             dest_key = dest_key.rstrip('/')
         files = file_util.get_files_in_directory(src, False)
-        for file in files:
-            transfer = boto3.s3.transfer.S3Transfer(s3.meta.client)
-            path, filename = os.path.split(file)
-            final_key = (
-                dest_key
-                + '/'
-                + os.path.basename(src)
-                + path[len(src):]
-                + '/'
-                + filename)
-            log.info('Upload %s to s3://%s/%s', file, dest_bucket, final_key)
-            transfer.upload_file(file, dest_bucket, final_key)
     elif os.path.isfile(src):
-        transfer = boto3.s3.transfer.S3Transfer(s3.meta.client)
-        final_key = dest_key
-        if dest_key.endswith('/'):
-            final_key = dest_key + os.path.basename(src)
-        log.info('Upload %s to s3://%s/%s', src, dest_bucket, final_key)
-        transfer.upload_file(src, dest_bucket, final_key)
+        files = None
     else:
         raise Exception('Invalid source')
 
+    client = __get_transfer_client(region, transfer_config)
+    stats = _TransferStats()
+    with create_transfer_manager(client, transfer_config) as manager:
+        if files is None:
+            final_key = dest_key
+            if dest_key.endswith('/'):
+                final_key = dest_key + os.path.basename(src)
+            if sync:
+                obj = __head_entry(client, dest_bucket, final_key)
+                if obj is not None and not __differs(
+                        src, obj, sync, transfer_config, True):
+                    log.info('Unchanged: %s', src)
+                    return
+            log.info('Upload %s to s3://%s/%s', src, dest_bucket, final_key)
+            manager.upload(src, dest_bucket, final_key).result()
+            stats.add(os.path.getsize(src))
+        else:
+            prefix = dest_key + '/' + os.path.basename(src) + '/'
+            remote = {}
+            manifest = None
+            if sync:
+                remote = __list_index(client, dest_bucket, prefix)
+            if sync == SYNC_ETAG:
+                manifest = file_util.FileManifest(src)
+                __hash_candidates(
+                    manifest, src, files, remote, transfer_config)
+            pending = deque()
+            for file in files:
+                path, filename = os.path.split(file)
+                final_key = (
+                    dest_key
+                    + '/'
+                    + os.path.basename(src)
+                    + path[len(src):]
+                    + '/'
+                    + filename)
+                if sync:
+                    obj = remote.pop(final_key[len(prefix):], None)
+                    if obj is not None and not __differs(
+                            file, obj, sync, transfer_config, True,
+                            manifest):
+                        log.debug('Unchanged: %s', file)
+                        stats.skip()
+                        continue
+                size = os.path.getsize(file)
+                log.debug(
+                    'Upload %s to s3://%s/%s', file, dest_bucket, final_key)
+                pending.append(manager.upload(
+                    file,
+                    dest_bucket,
+                    final_key,
+                    subscribers=[_ProvideSize(size)]))
+                stats.add(size)
+                # bound the futures held for large directories
+                while pending and (
+                        pending[0].done() or len(pending) > LIST_PAGE_SIZE):
+                    pending.popleft().result()
+            for future in pending:
+                future.result()
+            if manifest is not None:
+                manifest.save()
+            if sync and delete and remote:
+                # objects left in the index have no local file
+                __delete_objects(
+                    client, dest_bucket, [prefix + k for k in remote])
+    stats.log('Uploaded', 's3://%s/%s' % (dest_bucket, dest_key))
+
+
+def compute_etag(path, chunksize=None):
+    """ETag S3 reports for the file when uploaded in a multipart upload with
+    parts of chunksize, or by a single PutObject when chunksize is `None`
+
+    Parameters
+    ----------
+        path: `str`
+            local file
+        chunksize: `int`
+            multipart part size (optional)
+    Returns
+    -------
+    etag `str` without quotes
+    """
+    return file_util.compute_hashes(path, chunksize)[1]
+
+
+def __read_part_map(map_file, header):
+    """Part numbers recorded in a sidecar map, `None` when there is no map
+    or it belongs to another version of the object or chunk size"""
+    try:
+        with open(map_file, 'r') as stream:
+            lines = stream.read().splitlines()
+    except (IOError, OSError):
+        return None
+    try:
+        if not lines or json.loads(lines[0]) != header:
+            log.info('Ignoring stale part map: %s', map_file)
+            return None
+        # a trailing partial line comes from an interrupted write
+        return set(int(n) for n in lines[1:] if n.isdigit())
+    except ValueError:
+        return None
+
+
+def __fetch_range(client, bucket, key, etag, fd, first, last, max_attempts):
+    """GET one byte range and pwrite it at its offset, retrying failures that
+    may be transient"""
+    attempt = 1
+    while True:
+        try:
+            kwargs = {}
+            if etag:
+                kwargs['IfMatch'] = etag
+            body = client.get_object(
+                Bucket=bucket,
+                Key=key,
+                Range='bytes=%s-%s' % (first, last),
+                **kwargs)['Body']
+            offset = first
+            for data in iter(lambda: body.read(RANGE_BUFFER_SIZE), b''):
+                view = memoryview(data)
+                while view:
+                    written = os.pwrite(fd, view, offset)
+                    offset += written
+                    view = view[written:]
+            if offset != last + 1:
+                raise IOError('Incomplete range %s-%s of s3://%s/%s' % (
+                    first, last, bucket, key))
+            return
+        except Exception as e:
+            if attempt >= max_attempts or not (
+                    _is_retryable(e) or isinstance(e, IOError)):
+                raise
+            delay = random.uniform(0, min(2 ** attempt, 20))
+            log.debug('Retry range %s-%s of s3://%s/%s in %.1fs: %s',
+                      first, last, bucket, key, delay, e)
+            time.sleep(delay)
+            attempt += 1
+
+
+def __verify_etag(path, head, transfer_config):
+    """Compare a downloaded file with the ETag of its object. ETags of
+    SSE-KMS objects and unknown part sizes cannot be checked."""
+    if head.get('ServerSideEncryption') == 'aws:kms':
+        log.debug('Unable to verify ETag of SSE-KMS object: %s', path)
+        return True
+    obj = {'ETag': head.get('ETag', ''), 'Size': head['ContentLength']}
+    chunksizes = __etag_chunksizes(obj, transfer_config)
+    if not chunksizes:
+        log.warning('Unable to verify ETag %s of %s', obj['ETag'], path)
+        return True
+    log.debug('Verifying ETag of %s', path)
+    return __etag_matches(path, obj, transfer_config)
+
+
+def __list_index(client, bucket, prefix):
+    """Stream the listing of prefix into a `dict` of key relative to prefix
+    to listing entry"""
+    paginator = client.get_paginator('list_objects_v2')
+    iterator = paginator.paginate(
+        Bucket=bucket,
+        Prefix=prefix,
+        PaginationConfig={'PageSize': LIST_PAGE_SIZE})
+    index = {}
+    for page in iterator:
+        for obj in page.get('Contents', []):
+            if not obj['Key'].endswith('/'):
+                index[obj['Key'][len(prefix):]] = obj
+    log.debug('Listed %s objects under s3://%s/%s', len(index), bucket, prefix)
+    return index
+
+
+def __head_entry(client, bucket, key):
+    """HeadObject of a single key shaped like a listing entry, so syncing
+    one object does not list every key sharing its prefix. `None` when the
+    object does not exist."""
+    try:
+        head = client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in (
+                '404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    return {
+        'Key': key,
+        'Size': head['ContentLength'],
+        'ETag': head.get('ETag', ''),
+        'LastModified': head['LastModified'],
+    }
+
+
+def __differs(path, obj, sync, transfer_config, upload, manifest=None):
+    """Compare a local file with a listing entry. By size and mtime an
+    upload is needed when the file is newer than the object and a download
+    when the object is newer than the file."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return True
+    if stat.st_size != obj['Size']:
+        return True
+    if sync == SYNC_ETAG:
+        return not __etag_matches(path, obj, transfer_config, manifest)
+    remote_mtime = calendar.timegm(obj['LastModified'].utctimetuple())
+    if upload:
+        return int(stat.st_mtime) > remote_mtime
+    return remote_mtime > int(stat.st_mtime)
+
+
+def __hash_candidates(manifest, src, files, remote, transfer_config):
+    """Hash every file whose object has the same size up front so the
+    manifest can rehash them concurrently"""
+    batches = OrderedDict()
+    for file in files:
+        obj = remote.get(os.path.relpath(file, src).replace(os.sep, '/'))
+        if obj is None or os.path.getsize(file) != obj['Size']:
+            continue
+        chunksizes = __etag_chunksizes(obj, transfer_config)
+        if chunksizes:
+            batches.setdefault(chunksizes[0], []).append(file)
+    for chunksize, batch in batches.items():
+        manifest.get_etags(batch, chunksize)
+
+
+def __etag_matches(path, obj, transfer_config, manifest=None):
+    etag = obj.get('ETag', '').strip('"')
+    for chunksize in __etag_chunksizes(obj, transfer_config):
+        if manifest is not None:
+            local = manifest.get_etag(path, chunksize)
+        else:
+            local = compute_etag(path, chunksize)
+        if local == etag:
+            return True
+    return False
+
+
+def __etag_chunksizes(obj, transfer_config):
+    """Part sizes that could have produced the ETag of a listing entry,
+    `None` for a single part upload"""
+    etag = obj.get('ETag', '').strip('"')
+    if '-' not in etag:
+        return [None]
+    parts = int(etag.rsplit('-', 1)[1])
+    # the object may have been uploaded with another part size, try the one
+    # implied by its part count rounded up to a MiB as well
+    implied = -(-obj['Size'] // parts)
+    implied = -(-implied // (1024 * 1024)) * 1024 * 1024
+    return [
+        c for c in OrderedDict.fromkeys(
+            (transfer_config.multipart_chunksize, implied))
+        if -(-obj['Size'] // c) == parts
+    ]
+
+
+def __delete_objects(client, bucket, keys):
+    for i in range(0, len(keys), LIST_PAGE_SIZE):
+        batch = keys[i:i + LIST_PAGE_SIZE]
+        for key in batch:
+            log.info('Delete s3://%s/%s', bucket, key)
+        response = client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': k} for k in batch], 'Quiet': True})
+        errors = response.get('Errors', [])
+        if errors:
+            raise Exception('Failed to delete %s objects: %s' % (
+                len(errors), ', '.join(e['Key'] for e in errors)))
+
+
+def __get_transfer_client(region, transfer_config):
+    """S3 client with a connection pool large enough for the transfer"""
+    return aws_client_factory.get_s3_client(
+        region,
+        max_pool_connections=max(10, transfer_config.max_request_concurrency))
+
+
+class _ProvideSize(BaseSubscriber):
+    """Hands a size and ETag already known, e.g. from a listing, to the
+    transfer manager so it does not look them up per object"""
+
+    def __init__(self, size, etag=None):
+        self.size = size
+        self.etag = etag
+
+    def on_queued(self, future, **kwargs):
+        future.meta.provide_transfer_size(self.size)
+        # older s3transfer releases do not track the etag
+        if self.etag and hasattr(future.meta, 'provide_object_etag'):
+            future.meta.provide_object_etag(self.etag)
+
+
+class _StreamWriter(io.RawIOBase):
+    """Write-only, non-seekable view of a file-like object so s3transfer
+    uses its in-order stream writer"""
+
+    def __init__(self, fileobj):
+        super(_StreamWriter, self).__init__()
+        self.fileobj = fileobj
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def write(self, b):
+        view = memoryview(b)
+        while view:
+            written = self.fileobj.write(view)
+            # raw streams may accept only part of the buffer
+            view = view[written:] if written is not None else view[:0]
+        return len(b)
+
+
+class _CountBytes(BaseSubscriber):
+    """Counts the bytes of a transfer whose size is not known up front"""
+
+    def __init__(self):
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def on_progress(self, future, bytes_transferred, **kwargs):
+        with self.lock:
+            self.bytes += bytes_transferred
+
+
+class _TransferStats(object):
+    """Aggregate object count, bytes and throughput of a transfer"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.objects = 0
+        self.bytes = 0
+        self.skipped = 0
+
+    def add(self, size):
+        self.objects += 1
+        self.bytes += size
+
+    def skip(self):
+        self.skipped += 1
+
+    def log(self, action, location):
+        elapsed = max(time.time() - self.started, 0.001)
+        log.info(
+            '%s %s objects (%.1f MiB) %s in %.1fs, %.1f MiB/s',
+            action,
+            self.objects,
+            self.bytes / 1048576.0,
+            location,
+            elapsed,
+            self.bytes / 1048576.0 / elapsed)
+        if self.skipped:
+            log.info('Skipped %s unchanged objects', self.skipped)
+
+
+class _Copier(object):
+    """Server side copy of single objects with retries. Objects above the
+    multipart threshold or MAX_COPY_OBJECT_SIZE are copied with
+    UploadPartCopy, the parts running on
+    a pool of their own so object workers can wait on them.
+    """
+
+    def __init__(self, client, transfer_config, max_attempts):
+        self.client = client
+        self.threshold = transfer_config.multipart_threshold
+        self.chunksize = transfer_config.multipart_chunksize
+        self.max_attempts = max(1, max_attempts)
+        self.parts = ThreadPoolExecutor(
+            max_workers=transfer_config.max_request_concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.parts.shutdown()
+
+    def copy(self, src_bucket, src_key, dest_bucket, dest_key, size,
+             etag=None, head=None):
+        """Copy one object, retrying failures that may be transient"""
+        source = {'Bucket': src_bucket, 'Key': src_key}
+        attempt = 1
+        while True:
+            try:
+                log.debug('Copy s3://%s/%s to s3://%s/%s',
+                          src_bucket, src_key, dest_bucket, dest_key)
+                if size <= min(self.threshold, MAX_COPY_OBJECT_SIZE):
+                    kwargs = {}
+                    if etag:
+                        kwargs['CopySourceIfMatch'] = etag
+                    self.client.copy_object(
+                        CopySource=source,
+                        Bucket=dest_bucket,
+                        Key=dest_key,
+                        **kwargs)
+                else:
+                    if head is None:
+                        head = self.client.head_object(**source)
+                    self._copy_multipart(
+                        source, dest_bucket, dest_key, size, etag, head)
+                return
+            except Exception as e:
+                if attempt >= self.max_attempts or not _is_retryable(e):
+                    raise
+                delay = random.uniform(0, min(2 ** attempt, 20))
+                log.debug('Retry copy of s3://%s/%s in %.1fs: %s',
+                          src_bucket, src_key, delay, e)
+                time.sleep(delay)
+                attempt += 1
+
+    def _copy_multipart(self, source, dest_bucket, dest_key, size, etag,
+                        head):
+        # S3 allows at most 10000 parts of at least 5 MiB
+        chunksize = max(self.chunksize, MIN_PART_SIZE,
+                        -(-size // MAX_PARTS))
+        kwargs = dict((k, head[k]) for k in COPY_HEAD_FIELDS if k in head)
+        if head.get('TagCount'):
+            # CopyObject copies tags, UploadPartCopy has to be told them
+            tags = self.client.get_object_tagging(
+                Bucket=source['Bucket'], Key=source['Key'])['TagSet']
+            kwargs['Tagging'] = urlencode(
+                [(t['Key'], t['Value']) for t in tags])
+        upload_id = self.client.create_multipart_upload(
+            Bucket=dest_bucket, Key=dest_key, **kwargs)['UploadId']
+        try:
+            futures = []
+            for number, offset in enumerate(range(0, size, chunksize), 1):
+                last = min(offset + chunksize, size) - 1
+                futures.append(self.parts.submit(
+                    self._copy_part, source, dest_bucket, dest_key,
+                    upload_id, number, offset, last, etag))
+            parts = [f.result() for f in futures]
+            self.client.complete_multipart_upload(
+                Bucket=dest_bucket,
+                Key=dest_key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts})
+        except Exception:
+            for f in futures:
+                f.cancel()
+            self.client.abort_multipart_upload(
+                Bucket=dest_bucket, Key=dest_key, UploadId=upload_id)
+            raise
+
+    def _copy_part(self, source, dest_bucket, dest_key, upload_id, number,
+                   first, last, etag):
+        kwargs = {}
+        if etag:
+            kwargs['CopySourceIfMatch'] = etag
+        response = self.client.upload_part_copy(
+            CopySource=source,
+            CopySourceRange='bytes=%s-%s' % (first, last),
+            Bucket=dest_bucket,
+            Key=dest_key,
+            UploadId=upload_id,
+            PartNumber=number,
+            **kwargs)
+        return {'ETag': response['CopyPartResult']['ETag'],
+                'PartNumber': number}
+
+
+def _is_retryable(e):
+    """Client errors other than throttling and server errors will not
+    succeed on retry"""
+    if isinstance(e, ClientError):
+        code = e.response.get('Error', {}).get('Code')
+        status = e.response.get('ResponseMetadata', {}).get(
+            'HTTPStatusCode', 0)
+        return status >= 500 or code in RETRYABLE_COPY_ERRORS
+    return isinstance(e, BotoCoreError)
+
 
 def __parse_s3_uri(uri):
     """Parse s3 uri into bucket and key `tuple`
@@ -13,9 +13,15 @@ import bb
 
 from six import iteritems
 
-from bb.aws import ec2_utils as ec2
-from bb.aws import asg_utils as asg
 from bb.aws import region_utils as region_util
+from bb.utils import import_utils as import_util
+
+# loaded on first use so arguments are parsed before boto3 is imported
+ec2 = import_util.lazy_import('bb.aws.ec2_utils')
+asg = import_util.lazy_import('bb.aws.asg_utils')
+
+# every instance-state-name except terminated
+__LIVE_STATES = ['pending', 'running', 'shutting-down', 'stopping', 'stopped']
 
 
 def __parse_arguments():
@@ -70,12 +76,16 @@ def __parse_arguments():
 def __tag_instances(instance_id, asg_name, basename, digits):
     log = logging.getLogger(__name__)
     instances = {}
+    asg_detail = None
     if asg_name:
-        ids = asg.get_asg_ec2_instance_ids(asg_name)
-        instances = ec2.get_ec2_instance_info(ids)
+        details = asg.get_asg_details([asg_name])
+        if asg_name not in details:
+            raise Exception(asg_name + ' not found')
+        asg_detail = details[asg_name]
+        instances = ec2.get_ec2_instance_info(asg_detail['InstanceIds'])
     elif basename:
         basename = basename + '*'
-        instances = ec2.get_ec2_instances(basename)
+        instances = ec2.get_ec2_instances(basename, states=__LIVE_STATES)
 
     tag_map = {}
     used = {}
@@ -94,8 +104,8 @@ def __tag_instances(instance_id, asg_name, basename, digits):
         return 0
 
     size = len(tag_map)
-    if asg_name:
-        size = max(asg.get_asg_desired_size(asg_name), size)
+    if asg_detail is not None:
+        size = max(asg_detail['DesiredCapacity'], size)
 
     avail = []
     for i in range(0, size):
@@ -157,7 +167,9 @@ def main():
 
     asg_name = args.asg_name
     if not asg_name:
-        asg_name = asg.get_asg_name(instance_id)
+        asg_name = asg.get_asg_name(
+            instance_id,
+            use_metadata=not args.instance_id)
         log.info('Instance is associated with asg named: %s', asg_name)
 
     return __tag_instances(
@@ -11,7 +11,11 @@ import json
 import logging
 
 import bb
-from bb.ansible import inventory_utils as inv_util
+from bb.aws import region_utils as region_util
+from bb.utils import import_utils as import_util
+
+# loaded on first use so arguments are parsed before boto3 is imported
+inv_util = import_util.lazy_import('bb.ansible.inventory_utils')
 
 
 def __parse_arguments():
@@ -27,6 +31,11 @@ def __parse_arguments():
         action='store_true',
         help='Print ansible dynamic inventory')
     parser.add_argument('--host')
+    parser.add_argument(
+        '--refresh-cache',
+        action='store_true',
+        help='Ignore the cached inventory and query AWS (cache lifetime is '
+             'set with BB_INVENTORY_CACHE_TTL, default 300 seconds)')
     parser.add_argument(
         '--debug',
         action='store_true'
@@ -50,10 +59,16 @@ def main():
         exit(1)
 
     if args.list:
+        region = region_util.get_region()
         print(
             json.dumps(
-                inv_util.create_dynamic_ec2_inventory(
-                    def_yaml
+                inv_util.get_cached_inventory(
+                    ['ec2', inv_util.read_definition(def_yaml), region],
+                    lambda: inv_util.create_dynamic_ec2_inventory(
+                        def_yaml,
+                        region
+                    ),
+                    refresh=args.refresh_cache
                 ),
                 indent=2
             )
@@ -8,12 +8,9 @@
 import argparse
 import logging
 import os
-import inquirer
-
-from six import iteritems
 
 import bb
-from bb.aws import ec2_utils as ec2
+from bb.aws import ec2_host_index as host_index
 from bb.aws import region_utils as region_util
 
 
@@ -25,7 +22,10 @@ def __parse_arguments():
     parser.add_argument(
         'search',
         nargs='?',
-        help='Search string for ssh connection')
+        default='',
+        help='Fuzzy search string for ssh connection matched against the '
+             'Name, instance id, ip addresses, availability zone and tags '
+             '(default list every running instance)')
     parser.add_argument(
         '--user',
         required=False,
@@ -36,6 +36,17 @@ def __parse_arguments():
         action='store_true',
         help='Use public IP address if available default is to use private IP'
     )
+    parser.add_argument(
+        '--direct',
+        action='store_true',
+        help='Connect without prompting when exactly one host matches'
+    )
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        help='Rebuild the cached host index (default every '
+             'BB_EC2_HOST_INDEX_TTL seconds or 300)'
+    )
     parser.add_argument(
         '--debug',
         action='store_true'
@@ -62,10 +73,16 @@ def main():
     if args.region:
         region_util.set_region(args.region)
 
-    instances = ec2.get_ec2_instances('*' + args.search + '*')
+    hosts = host_index.get_host_index(refresh=args.refresh)
+    matches = host_index.search_hosts(hosts, args.search)
+    if not matches and not args.refresh:
+        # the host may have launched after the index was cached
+        log.debug('No cached host matches %s, refreshing', args.search)
+        hosts = host_index.get_host_index(refresh=True)
+        matches = host_index.search_hosts(hosts, args.search)
 
     selections = []
-    for k, v in iteritems(instances):
+    for v in matches:
         if args.public and v.get('PublicIpAddress') is not None:
             selections.append(
                 ('{name:{fill}<{n}}{0}'.format(
@@ -82,23 +99,34 @@ def main():
                         fill=' ',
                         n=30), v['PrivateIpAddress']))
 
-    log.debug('Selections: %s', sorted(selections))
-    selections.append(('Exit', 'exit'))
+    if not selections:
+        log.info('No running instances match: %s', args.search)
+        return 1
+    log.debug('Selections: %s', selections)
+    if args.direct and len(selections) == 1:
+        address = selections[0][1]
+    else:
+        selections.append(('Exit', 'exit'))
 
-    question = inquirer.List(
-        'ec2-ssh',
-        message='SSH to Host',
-        choices=selections)
+        # only needed when prompting, importing it costs more than the rest
+        # of the command
+        import inquirer
 
-    answer = inquirer.prompt([question])
-    host = ''
-    if not answer or answer['ec2-ssh'] == 'exit':
-        log.info('Exiting')
-        return 0
+        question = inquirer.List(
+            'ec2-ssh',
+            message='SSH to Host',
+            choices=selections)
 
+        answer = inquirer.prompt([question])
+        if not answer or answer['ec2-ssh'] == 'exit':
+            log.info('Exiting')
+            return 0
+        address = answer['ec2-ssh']
+
+    host = ''
     if args.user:
-        host = args.user + '@' + answer['ec2-ssh']
+        host = args.user + '@' + address
     else:
-        host = answer['ec2-ssh']
+        host = address
     log.info('ssh -A %s', host)
     os.execlp("ssh", "ssh", "-A", host)
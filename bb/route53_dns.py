@@ -9,9 +9,13 @@ import argparse
 import logging
 
 import bb
-from bb.aws import ec2_utils as ec2
-from bb.aws import route53_utils as route53
 from bb.aws import region_utils as region_util
+from bb.utils import import_utils as import_util
+
+# loaded on first use so arguments are parsed before boto3 is imported
+asg = import_util.lazy_import('bb.aws.asg_utils')
+ec2 = import_util.lazy_import('bb.aws.ec2_utils')
+route53 = import_util.lazy_import('bb.aws.route53_utils')
 
 
 def __parse_arguments():
@@ -77,6 +81,53 @@ def __parse_arguments():
              '<name>.<prefix>.<private-zone>'
     )
 
+    parser.add_argument(
+        '--reconcile',
+        action='store_true',
+        help='Reconcile the A records of every running instance in a VPC or '
+             'ASG with the zones, submitting only the differences'
+    )
+    parser.add_argument(
+        '--vpc-id',
+        required=False,
+        help='With --reconcile, VPC whose instances are registered '
+             '(default the vpc of this ec2 instance)'
+    )
+    parser.add_argument(
+        '--vpc-name',
+        required=False,
+        help='With --reconcile, Name tag of the VPC whose instances are '
+             'registered'
+    )
+    parser.add_argument(
+        '--asg-name',
+        required=False,
+        help='With --reconcile, Auto Scaling Group whose InService '
+             'instances are registered'
+    )
+    parser.add_argument(
+        '--prune',
+        action='store_true',
+        help='With --reconcile, delete A records directly under '
+             '<prefix>.<zone> that do not belong to an instance of the VPC. '
+             'Requires a zone prefix for every zone, the prefix domain must be '
+             'used only by this VPC. Not allowed with --asg-name since other '
+             'groups and hosts share the domain'
+    )
+
+    parser.add_argument(
+        '--wait',
+        action='store_true',
+        help='Wait until the changes have propagated (INSYNC)'
+    )
+    parser.add_argument(
+        '--wait-timeout',
+        type=float,
+        required=False,
+        help='Seconds --wait waits before failing '
+             '(default BB_ROUTE53_WAIT_TIMEOUT or 300)'
+    )
+
     parser.add_argument(
         '--debug',
         action='store_true'
@@ -87,16 +138,94 @@ def __parse_arguments():
         help='AWS Region (default ec2 instance configuration) or it will use '
              'the region this script is executing on'
     )
-    return parser, parser.parse_args()
+    args = parser.parse_args()
+    if not args.reconcile and (args.vpc_id or args.vpc_name
+                               or args.asg_name or args.prune):
+        parser.error('--vpc-id, --vpc-name, --asg-name and --prune require '
+                     '--reconcile')
+    if args.reconcile and (args.name or args.private_ip or args.public_ip):
+        parser.error('--name, --private-ip and --public-ip can not be used '
+                     'with --reconcile')
+    if args.prune and args.asg_name:
+        # records of other groups and standalone hosts share the domain
+        parser.error('--prune can not be used with --asg-name')
+    if args.prune and ((args.private_zone and not args.private_zone_prefix)
+                       or (args.public_zone and not args.public_zone_prefix)):
+        # a whole zone may hold the records of other VPCs, pruning is limited
+        # to a prefix domain dedicated to this VPC
+        parser.error('--prune requires --private-zone-prefix and '
+                     '--public-zone-prefix for the zones reconciled, naming a '
+                     'domain used only by this VPC')
+    return parser, args
+
+
+def __get_instances(args):
+    """Running instances of the ASG or VPC provided"""
+    if args.asg_name:
+        details = asg.get_asg_details([args.asg_name])
+        if args.asg_name not in details:
+            raise Exception(args.asg_name + ' not found')
+        instances = ec2.get_ec2_instance_info(
+            details[args.asg_name]['InstanceIds'])
+        return dict((k, v) for k, v in instances.items()
+                    if v['State'] == 'running')
+    vpc_id = args.vpc_id
+    if args.vpc_name:
+        vpc_id = ec2.get_vpc_id_using_vpc_name(args.vpc_name)
+        if not vpc_id:
+            raise Exception(args.vpc_name + ' not found')
+    if not vpc_id:
+        vpc_id = ec2.get_instance_vpc_id()
+    return ec2.get_ec2_instances_in_vpc(vpc_id, states=['running'])
+
+
+def __desired_records(instances, zone_prefix, zone, ip_key, log):
+    """DNS name to ip addresses of the instances for one zone"""
+    desired = {}
+    for instance_id, info in instances.items():
+        name = ec2.strip_resource_prefix(info)
+        ip_address = info[ip_key]
+        if not name:
+            log.warning('Skipping %s without a Name tag', instance_id)
+            continue
+        if ip_address:
+            dns_name = route53.get_dns_name(name, zone_prefix, zone)
+            desired.setdefault(dns_name, []).append(ip_address)
+    return desired
+
+
+def __reconcile(args, log):
+    instances = __get_instances(args)
+    log.info('Reconciling %s running instances', len(instances))
+    batch = route53.ChangeBatch()
+    zones = (
+        (args.private_zone, args.private_zone_prefix, args.private_zone_id,
+         'PrivateIpAddress', True),
+        (args.public_zone, args.public_zone_prefix, args.public_zone_id,
+         'PublicIpAddress', False),
+    )
+    for zone, zone_prefix, zone_id, ip_key, private in zones:
+        if not zone:
+            continue
+        prune_domain = None
+        if args.prune:
+            prune_domain = zone_prefix.rstrip('.') + '.' + zone
+        before = len(batch)
+        route53.reconcile_a_records(
+            __desired_records(instances, zone_prefix, zone, ip_key, log),
+            zone,
+            zone_id,
+            private=private,
+            prune_domain=prune_domain,
+            batch=batch)
+        log.info('%s changes for %s', len(batch) - before, zone)
+    return batch.submit()
 
 
-def __update_record(name, zone_prefix, zone, zone_id, ip_address):
-    return route53.create_or_update_dns_a_record(
-        name,
-        zone_prefix,
-        zone,
-        ip_address,
-        zone_id)
+def __wait(infos, timeout, log):
+    with route53.ChangeTracker(infos, timeout=timeout) as tracker:
+        for info in tracker.as_completed():
+            log.info('Change %s is %s', info['Id'], info['Status'])
 
 
 def main():
@@ -112,6 +241,12 @@ def main():
     if args.region:
         region_util.set_region(args.region)
 
+    if args.reconcile:
+        infos = __reconcile(args, log)
+        if args.wait:
+            __wait(infos, args.wait_timeout, log)
+        return
+
     name = None
     if args.name is not None:
         name = args.name
@@ -136,16 +271,22 @@ def main():
         public_ip = ec2.get_current_instance_public_ip()
         log.info('Using current ec2 public ip: %s', public_ip)
 
+    batch = route53.ChangeBatch()
     if args.private_zone and private_ip:
-        __update_record(name,
-                        args.private_zone_prefix,
-                        args.private_zone,
-                        args.private_zone_id,
-                        private_ip)
+        batch.upsert_a_record(name,
+                              args.private_zone_prefix,
+                              args.private_zone,
+                              private_ip,
+                              args.private_zone_id,
+                              private=True)
 
     if args.public_zone and public_ip:
-        __update_record(name,
-                        args.public_zone_prefix,
-                        args.public_zone,
-                        args.public_zone_id,
-                        public_ip)
+        batch.upsert_a_record(name,
+                              args.public_zone_prefix,
+                              args.public_zone,
+                              public_ip,
+                              args.public_zone_id,
+                              private=False)
+    infos = batch.submit()
+    if args.wait:
+        __wait(infos, args.wait_timeout, log)
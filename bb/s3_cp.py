@@ -7,10 +7,17 @@
 
 import argparse
 import logging
+import sys
 
 import bb
-from bb.aws import s3_utils as s3
 from bb.aws import region_utils as aws_region
+from bb.utils import import_utils as import_util
+
+# loaded on first use so arguments are parsed before boto3 is imported
+s3 = import_util.lazy_import('bb.aws.s3_utils')
+
+# s3_utils.SYNC_MODES, repeated so --help does not have to load s3_utils
+__SYNC_MODES = ('size-mtime', 'etag')
 
 
 def __parse_arguments():
@@ -22,12 +29,12 @@ def __parse_arguments():
     parser.add_argument(
         'src',
         nargs='?',
-        help='src file/directory s3 or local'
+        help='src file/directory s3 or local, - reads stdin'
     )
     parser.add_argument(
         'dest',
         nargs='?',
-        help='dest file/directory s3 or local'
+        help='dest file/directory s3 or local, - writes stdout'
     )
     parser.add_argument(
         '--region',
@@ -35,11 +42,81 @@ def __parse_arguments():
         help='AWS Region (default ec2 instance configuration) or it will use '
              'the region this script is executing on'
     )
+    parser.add_argument(
+        '--sync',
+        action='store_true',
+        help='Only transfer files that differ between source and destination'
+    )
+    parser.add_argument(
+        '--compare',
+        choices=__SYNC_MODES,
+        default=__SYNC_MODES[0],
+        help='How --sync compares files, by size and modification time or '
+             'by size and ETag (default %(default)s)'
+    )
+    parser.add_argument(
+        '--delete',
+        action='store_true',
+        help='With --sync, delete destination files that do not exist in '
+             'the source'
+    )
+    parser.add_argument(
+        '--multipart-threshold',
+        type=int,
+        required=False,
+        help='Size in bytes above which multipart transfers are used '
+             '(default BB_S3_MULTIPART_THRESHOLD or 8 MiB)'
+    )
+    parser.add_argument(
+        '--multipart-chunksize',
+        type=int,
+        required=False,
+        help='Multipart part size in bytes '
+             '(default BB_S3_MULTIPART_CHUNKSIZE or 8 MiB)'
+    )
+    parser.add_argument(
+        '--max-concurrency',
+        type=int,
+        required=False,
+        help='Maximum concurrent S3 requests '
+             '(default BB_S3_MAX_CONCURRENCY or 10)'
+    )
+    parser.add_argument(
+        '--expected-size',
+        type=int,
+        required=False,
+        help='Approximate size in bytes of a stream read from stdin, used to '
+             'choose a part size that stays within 10000 parts'
+    )
+    parser.add_argument(
+        '--large-object',
+        action='store_true',
+        help='Download a single object with concurrent ranged GETs written '
+             'in place, resuming an interrupted download'
+    )
     parser.add_argument(
         '--debug',
         action='store_true',
         help='Turn on debug logging')
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.delete and not args.sync:
+        parser.error('--delete requires --sync')
+    if (args.sync and args.src and args.dest and args.src.startswith('s3://')
+            and args.dest.startswith('s3://')):
+        parser.error('--sync is not supported for remote copies')
+    if args.src == '-' and not (args.dest or '').startswith('s3://'):
+        parser.error('stdin can only be uploaded to s3')
+    if args.dest == '-' and not (args.src or '').startswith('s3://'):
+        parser.error('stdout can only be written from s3')
+    if args.sync and '-' in (args.src, args.dest):
+        parser.error('--sync is not supported for streams')
+    if args.large_object and (
+            not (args.src or '').startswith('s3://')
+            or args.dest == '-' or (args.dest or '').startswith('s3://')):
+        parser.error('--large-object only downloads from s3 to a local file')
+    if args.large_object and args.src.endswith('/'):
+        parser.error('--large-object downloads a single object, not a prefix')
+    return args
 
 
 def main():
@@ -57,13 +134,31 @@ def main():
 
     src = args.src
     dest = args.dest
+    sync = args.compare if args.sync else None
+    transfer_config = s3.get_transfer_config(
+        multipart_threshold=args.multipart_threshold,
+        multipart_chunksize=args.multipart_chunksize,
+        max_concurrency=args.max_concurrency)
 
-    if src.startswith('s3://') and dest.startswith('s3://'):
+    if src == '-':
+        log.debug('Upload: [stdin] to [%s]', dest)
+        s3.upload_fileobj_s3_uri(
+            sys.stdin.buffer, dest, transfer_config=transfer_config,
+            expected_size=args.expected_size)
+    elif dest == '-':
+        log.debug('Download: [%s] to [stdout]', src)
+        s3.download_fileobj_s3_uri(
+            src, sys.stdout.buffer, transfer_config=transfer_config)
+        sys.stdout.buffer.flush()
+    elif src.startswith('s3://') and dest.startswith('s3://'):
         log.debug('Remote copy: [%s] to [%s]', src, dest)
-        s3.remote_copy_s3_uri(src, dest)
+        s3.remote_copy_s3_uri(src, dest, transfer_config=transfer_config)
     elif src.startswith('s3://'):
         log.debug('Download: [%s] to [%s]', src, dest)
-        s3.download_s3_uri(src, dest)
+        s3.download_s3_uri(src, dest, transfer_config=transfer_config,
+                           sync=sync, delete=args.delete,
+                           large_object=args.large_object)
     else:
         log.debug('Upload: [%s] to [%s]', src, dest)
-        s3.upload_s3_uri(src, dest)
+        s3.upload_s3_uri(src, dest, transfer_config=transfer_config,
+                         sync=sync, delete=args.delete)
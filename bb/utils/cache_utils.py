@@ -0,0 +1,168 @@
+#
+# 2018 Copyright BoxBoat Technologies
+# All Rights Reserved
+#
+# Author: Matthew DeVenny
+#
+
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+
+def get_cache_dir():
+    """Directory holding bb-py on-disk caches. Uses BB_CACHE_DIR when set,
+    otherwise `bb-py` under XDG_CACHE_HOME or `~/.cache`
+
+    Returns
+    -------
+    cache directory `str`
+    """
+    cache_dir = os.getenv('BB_CACHE_DIR')
+    if not cache_dir:
+        cache_dir = os.path.join(
+            os.getenv('XDG_CACHE_HOME')
+            or os.path.join(os.path.expanduser('~'), '.cache'),
+            'bb-py')
+    return cache_dir
+
+
+def cache_path(name):
+    """Absolute path of the named cache file
+
+    Parameters
+    ----------
+        name: `str`
+            cache file name relative to the cache directory
+    Returns
+    -------
+    path `str`
+    """
+    return os.path.join(get_cache_dir(), name)
+
+
+def read_cache(name, ttl):
+    """Read a JSON cache file if it is younger than ttl seconds
+
+    Parameters
+    ----------
+        name: `str`
+            cache file name relative to the cache directory
+        ttl: `float`
+            maximum age in seconds, a ttl <= 0 disables the cache
+    Returns
+    -------
+    cached object or `None` if missing, expired or unreadable
+    """
+    if ttl is None or ttl <= 0:
+        return None
+    path = cache_path(name)
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            log.debug('Cache expired: %s', path)
+            return None
+        with open(path, 'r') as stream:
+            return json.load(stream)
+    except (IOError, OSError, ValueError) as e:
+        log.debug('Cache miss: %s %s', path, e)
+        return None
+
+
+def write_cache(name, data):
+    """Atomically write a JSON cache file. Failures are logged and ignored
+    since the cache is only an optimization.
+
+    Parameters
+    ----------
+        name: `str`
+            cache file name relative to the cache directory
+        data:
+            JSON serializable object
+    Returns
+    -------
+    `bool` indicating the cache was written
+    """
+    path = cache_path(name)
+    try:
+        atomic_write(path, json.dumps(data))
+        return True
+    except (IOError, OSError, TypeError, ValueError) as e:
+        log.debug('Unable to write cache: %s %s', path, e)
+        return False
+
+
+def cache_age(name):
+    """Seconds since the named cache file was written
+
+    Parameters
+    ----------
+        name: `str`
+            cache file name relative to the cache directory
+    Returns
+    -------
+    age `float` or `None` if the file does not exist
+    """
+    try:
+        return time.time() - os.path.getmtime(cache_path(name))
+    except OSError:
+        return None
+
+
+@contextlib.contextmanager
+def lock(name):
+    """Hold an exclusive lock on the named lock file for the duration of the
+    `with` block so concurrent processes do not rebuild the same cache. On
+    platforms without `fcntl` no lock is taken.
+
+    Parameters
+    ----------
+        name: `str`
+            lock file name relative to the cache directory
+    """
+    path = cache_path(name)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a') as stream:
+        if fcntl is not None:
+            log.debug('Waiting on lock: %s', path)
+            fcntl.flock(stream.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(stream.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write(path, contents):
+    """Write contents to a temp file in the destination directory and rename
+    it into place so readers never see a partial file
+
+    Parameters
+    ----------
+        path: `str`
+            destination file
+        contents: `str`
+            file contents
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as stream:
+            stream.write(contents)
+        os.replace(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
@@ -6,9 +6,21 @@
 #
 
 from io import open
-import yaml
+import hashlib
+import logging
+import mmap
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+from bb.utils import cache_utils as cache_util
+
+log = logging.getLogger(__name__)
+
+# block size fed to the hash functions
+HASH_BUFFER_SIZE = 1024 * 1024
+# bump when the manifest format changes
+MANIFEST_VERSION = 1
+
 
 def get_files_in_directory(path, absolute, recursive=True):
     """Read a directory and return a list of filenames
@@ -53,6 +65,8 @@ def read_yaml_file(filename):
     -------
     yaml `dict`
     """
+    import yaml
+
     with open(filename, 'r') as stream:
         try:
             return yaml.load(stream, Loader=yaml.FullLoader)
@@ -75,3 +89,172 @@ def is_file(filename):
       return True
     except IOError:
       return False
+
+
+def compute_hashes(path, chunksize=None):
+    """MD5 of a file and, when chunksize is provided, the ETag S3 reports for
+    a multipart upload of the file in parts of chunksize. The file is read
+    once through a memory map.
+
+    Parameters
+    ----------
+        path: `str`
+            file to hash
+        chunksize: `int`
+            multipart part size (optional)
+    Returns
+    -------
+    (md5, etag) `tuple` of hex digests, etag is the md5 when chunksize is
+    `None`
+    """
+    md5 = hashlib.md5()
+    digests = []
+    with open(path, 'rb') as stream:
+        size = os.fstat(stream.fileno()).st_size
+        mapped = None
+        if size:
+            try:
+                mapped = mmap.mmap(
+                    stream.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError) as e:
+                log.debug('Unable to mmap %s, reading instead: %s', path, e)
+        try:
+            step = chunksize or max(size, 1)
+            for start in range(0, max(size, 1), step):
+                part = hashlib.md5()
+                for block in __read_blocks(
+                        stream, mapped, start, min(start + step, size)):
+                    md5.update(block)
+                    if chunksize:
+                        part.update(block)
+                digests.append(part.digest())
+        finally:
+            if mapped is not None:
+                mapped.close()
+    if not chunksize:
+        return md5.hexdigest(), md5.hexdigest()
+    return md5.hexdigest(), '%s-%s' % (
+        hashlib.md5(b''.join(digests)).hexdigest(), len(digests))
+
+
+def __read_blocks(stream, mapped, start, end):
+    """Yield the bytes of the file between start and end in HASH_BUFFER_SIZE
+    blocks, from the memory map when there is one"""
+    if mapped is None:
+        stream.seek(start)
+        while start < end:
+            block = stream.read(min(HASH_BUFFER_SIZE, end - start))
+            if not block:
+                break
+            start += len(block)
+            yield block
+        return
+    with memoryview(mapped) as view:
+        for offset in range(start, end, HASH_BUFFER_SIZE):
+            with view[offset:min(offset + HASH_BUFFER_SIZE, end)] as block:
+                yield block
+
+
+class FileManifest(object):
+    """Persistent record of the hashes of files under a root directory,
+    stored in the bb-py cache directory. Each entry keeps the size,
+    mtime_ns and inode the hashes were computed for, so only files whose
+    stat changed are read again.
+    """
+
+    def __init__(self, root, max_workers=None):
+        """
+        Parameters
+        ----------
+            root: `str`
+                directory the manifest covers
+            max_workers: `int`
+                concurrent files hashed (default BB_HASH_MAX_WORKERS or the
+                cpu count)
+        """
+        self.root = os.path.abspath(root)
+        self.name = 'manifest/%s.json' % hashlib.sha256(
+            self.root.encode('utf-8')).hexdigest()
+        if max_workers is None:
+            max_workers = int(os.getenv(
+                'BB_HASH_MAX_WORKERS', os.cpu_count() or 4))
+        self.max_workers = max_workers
+        data = cache_util.read_cache(self.name, float('inf'))
+        if data and data.get('version') == MANIFEST_VERSION:
+            self.files = data['files']
+        else:
+            self.files = {}
+        self.dirty = False
+
+    def get_etag(self, path, chunksize=None):
+        """MD5 or multipart ETag of one file, see `get_etags`"""
+        return self.get_etags([path], chunksize)[path]
+
+    def get_etags(self, paths, chunksize=None):
+        """MD5 or multipart ETag of many files. Files whose size, mtime_ns or
+        inode changed since they were last hashed are hashed concurrently.
+
+        Parameters
+        ----------
+            paths: `list`
+                files under root
+            chunksize: `int`
+                multipart part size, `None` for the MD5 (optional)
+        Returns
+        -------
+        `dict` of path to hex digest
+        """
+        etags = {}
+        stale = []
+        for path in paths:
+            key = os.path.relpath(os.path.abspath(path), self.root)
+            stat = os.stat(path)
+            entry = self.files.get(key)
+            if entry is not None and (
+                    entry['size'] != stat.st_size
+                    or entry['mtime_ns'] != stat.st_mtime_ns
+                    or entry['inode'] != stat.st_ino):
+                entry = None
+            if entry is None:
+                stale.append((path, key, stat))
+            elif chunksize is None:
+                etags[path] = entry['md5']
+            elif str(chunksize) in entry['etags']:
+                etags[path] = entry['etags'][str(chunksize)]
+            else:
+                stale.append((path, key, stat))
+        if not stale:
+            return etags
+        log.debug('Hashing %s of %s files under %s',
+                  len(stale), len(paths), self.root)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(
+                lambda s: compute_hashes(s[0], chunksize), stale)
+            for (path, key, stat), (md5, etag) in zip(stale, results):
+                entry = self.files.get(key)
+                if entry is None or entry['md5'] != md5:
+                    entry = {'etags': {}}
+                    self.files[key] = entry
+                entry.update({
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'inode': stat.st_ino,
+                    'md5': md5,
+                })
+                if chunksize:
+                    entry['etags'][str(chunksize)] = etag
+                etags[path] = etag
+        self.dirty = True
+        return etags
+
+    def save(self):
+        """Write the manifest if it changed, dropping entries of files that
+        no longer exist"""
+        if not self.dirty:
+            return
+        self.files = dict(
+            (k, v) for k, v in self.files.items()
+            if os.path.exists(os.path.join(self.root, k)))
+        cache_util.write_cache(
+            self.name, {'version': MANIFEST_VERSION, 'files': self.files})
+        self.dirty = False
@@ -0,0 +1,115 @@
+#
+# 2018 Copyright BoxBoat Technologies
+# All Rights Reserved
+#
+# Author: Matthew DeVenny
+#
+
+# score ranges of the match kinds, an exact match beats any substring match
+# which beats any subsequence match which beats any trigram match
+EXACT_SCORE = 4000.0
+SUBSTRING_SCORE = 3000.0
+SUBSEQUENCE_SCORE = 2000.0
+TRIGRAM_SCORE = 1000.0
+
+# minimum trigram similarity counted as a match
+TRIGRAM_THRESHOLD = 0.3
+
+# characters after which a match counts as the start of a word
+WORD_SEPARATORS = '-_. /:'
+
+
+def match_score(query, text):
+    """Score how well text matches query, case insensitive. Exact and
+    substring matches rank first, then subsequence matches (the query
+    characters in order, favouring consecutive characters and word starts)
+    and finally trigram similarity which tolerates typos.
+
+    Parameters
+    ----------
+        query: `str`
+            search string
+        text: `str`
+            candidate
+    Returns
+    -------
+    `float` score, higher is better, or `None` when text does not match
+    """
+    if not text:
+        return None
+    if not query:
+        return 0.0
+    query = query.lower()
+    text = text.lower()
+    if query == text:
+        return EXACT_SCORE
+    index = text.find(query)
+    if index >= 0:
+        bonus = 100 if __word_start(text, index) else 0
+        return SUBSTRING_SCORE + __band(
+            bonus - index - len(text) / 100.0)
+    score = __subsequence_score(query, text)
+    if score is not None:
+        return SUBSEQUENCE_SCORE + __band(score)
+    if len(query) >= 3:
+        similarity = trigram_similarity(query, text)
+        if similarity >= TRIGRAM_THRESHOLD:
+            return TRIGRAM_SCORE + similarity * 100
+    return None
+
+
+def trigram_similarity(query, text):
+    """Share of the character trigrams of query found in text, so a short
+    query is not penalized for the length of the text
+
+    Returns
+    -------
+    `float` between 0 and 1
+    """
+    tq = trigrams(query)
+    if not tq:
+        return 0.0
+    return len(tq & trigrams(text)) / float(len(tq))
+
+
+def trigrams(text):
+    """`set` of the character trigrams of each space padded word of the
+    lower case text"""
+    text = text.lower()
+    for c in WORD_SEPARATORS:
+        text = text.replace(c, ' ')
+    grams = set()
+    for word in text.split():
+        word = ' ' + word + ' '
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def __band(score):
+    """Keep a score relative to its match kind within the kind's range"""
+    return max(0.0, min(999.0, 500.0 + score))
+
+
+def __word_start(text, index):
+    return index == 0 or text[index - 1] in WORD_SEPARATORS
+
+
+def __subsequence_score(query, text):
+    """Greedy left to right subsequence match. Consecutive characters and
+    characters at word starts add to the score, gaps subtract from it."""
+    score = 0.0
+    position = 0
+    previous = -2
+    for c in query:
+        index = text.find(c, position)
+        if index < 0:
+            return None
+        if index == previous + 1:
+            score += 10
+        elif previous >= 0:
+            score -= min(index - previous, 10)
+        if __word_start(text, index):
+            score += 5
+        previous = index
+        position = index + 1
+    return score - len(text) / 100.0
@@ -0,0 +1,74 @@
+#
+# 2018 Copyright BoxBoat Technologies
+# All Rights Reserved
+#
+# Author: Matthew DeVenny
+#
+
+import importlib
+import importlib.util
+import sys
+import threading
+
+# serializes the first load of lazy modules, worker threads may touch the
+# same module at once
+_import_lock = threading.RLock()
+
+
+def lazy_import(name):
+    """Get a module whose code only runs on first attribute access, so the
+    console scripts can parse their arguments (and answer `--help`) before
+    boto3 and friends are loaded. A module already imported is returned
+    as is. The first access is serialized so it is safe from many threads.
+
+    Parameters
+    ----------
+        name: `str`
+            absolute module name, e.g. `bb.aws.s3_utils`
+    Returns
+    -------
+    module, or a proxy forwarding attribute access to it
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if importlib.util.find_spec(name) is None:
+        raise ImportError('No module named ' + name, name=name)
+    return _LazyModule(name)
+
+
+class _LazyModule(object):
+    """Stand-in for a module that imports it on first attribute access"""
+
+    __slots__ = ('_name', '_module')
+
+    def __init__(self, name):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_module', None)
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with _import_lock:
+                module = self._module
+                if module is None:
+                    module = importlib.import_module(self._name)
+                    object.__setattr__(self, '_module', module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        if self._module is None:
+            return '<lazy module %r>' % self._name
+        return repr(self._module)
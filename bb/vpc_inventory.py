@@ -13,8 +13,13 @@ import bb
 
 from collections import OrderedDict
 from six import iteritems
-from bb.ansible import inventory_utils as inv_util
-from bb.aws import ec2_utils as ec2
+from bb.aws import metadata
+from bb.aws import region_utils as region_util
+from bb.utils import import_utils as import_util
+
+# loaded on first use so arguments are parsed before boto3 is imported
+inv_util = import_util.lazy_import('bb.ansible.inventory_utils')
+ec2 = import_util.lazy_import('bb.aws.ec2_utils')
 
 
 def __parse_arguments():
@@ -30,6 +35,11 @@ def __parse_arguments():
         action='store_true',
         help='Print ansible dynamic inventory')
     parser.add_argument('--host')
+    parser.add_argument(
+        '--refresh-cache',
+        action='store_true',
+        help='Ignore the cached inventory and query AWS (cache lifetime is '
+             'set with BB_INVENTORY_CACHE_TTL, default 300 seconds)')
     parser.add_argument(
         '--debug',
         action='store_true',
@@ -38,18 +48,9 @@ def __parse_arguments():
     return parser.parse_args()
 
 
-def main():
-    args = __parse_arguments()
-
-    if args.debug:
-        # only establish logging handlers for DEBUG output
-        bb.setup_logging(__name__, logging.DEBUG)
-
+def __create_inventory(env_vpc_id, env_vpc_name, instance_vpc_id):
     log = logging.getLogger(__name__)
 
-    # determine vpc
-    env_vpc_id = os.getenv('VPC_ID')
-    env_vpc_name = os.getenv('VPC_NAME')
     vpc_id = None
     if env_vpc_name:
         vpc_id = ec2.get_vpc_id_using_vpc_name(env_vpc_name)
@@ -62,26 +63,47 @@ def main():
 
     # no vpc provided so use ec2 instance
     if not vpc_id:
-        vpc_id = ec2.get_instance_vpc_id()
+        vpc_id = instance_vpc_id or ec2.get_instance_vpc_id()
         log.debug(
             'No environment for VPC specified using instance vpc-id: %s',
             vpc_id)
 
     instances = OrderedDict(
         sorted(
-            iteritems(ec2.get_ec2_instances_in_vpc(vpc_id)),
+            iteritems(
+                ec2.get_ec2_instances_in_vpc(vpc_id, states=['running'])),
             key=lambda x: x[1]['Name']))
     vpcInstances = []
     for k, v in iteritems(instances):
         if v['PrivateIpAddress'] is not None:
             vpcInstances.append(v['PrivateIpAddress'])
-    vpc = inv_util.create_inventory([
+    return inv_util.create_inventory([
         inv_util.create_inventory_group(
             'vpc_inventory',
             vpcInstances
         )])
 
+
+def main():
+    args = __parse_arguments()
+
+    if args.debug:
+        # only establish logging handlers for DEBUG output
+        bb.setup_logging(__name__, logging.DEBUG)
+
     if args.list:
+        # determine vpc
+        env_vpc_id = os.getenv('VPC_ID')
+        env_vpc_name = os.getenv('VPC_NAME')
+        vpc_id = None
+        if not env_vpc_id and not env_vpc_name:
+            # read from the metadata disk cache, keeps boto3 off a cache hit
+            vpc_id = metadata.get_vpc_id()
+        vpc = inv_util.get_cached_inventory(
+            ['vpc', env_vpc_id, env_vpc_name, vpc_id,
+             region_util.get_region()],
+            lambda: __create_inventory(env_vpc_id, env_vpc_name, vpc_id),
+            refresh=args.refresh_cache)
         print(json.dumps(vpc, indent=2))
 
     # should not be called by ansible since _meta is in inventory added for
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# 2018 Copyright BoxBoat Technologies
+# All Rights Reserved
+#
+# Author: Matthew DeVenny
+#
+
+"""Measure the import cost of every console script declared in setup.py with
+`python -X importtime`, e.g.
+
+    python scripts/startup_benchmark.py --repeat 10
+
+For each entry point the median cumulative import time of its module is
+reported along with the heavy dependencies that were loaded. The exit code is
+1 when --max-ms is set and any entry point exceeds it.
+"""
+
+import argparse
+import ast
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# third party packages that should only load on the code paths needing them
+HEAVY_MODULES = ('boto3', 'botocore', 's3transfer', 'requests', 'yaml',
+                 'inquirer')
+
+__IMPORT_TIME = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+
+def __parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Startup benchmark of the bb-* console scripts')
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='Imports measured per entry point, the median is reported '
+             '(default %(default)s)'
+    )
+    parser.add_argument(
+        '--max-ms',
+        type=float,
+        help='Fail when the median import time of an entry point exceeds '
+             'this many milliseconds'
+    )
+    parser.add_argument(
+        '--python',
+        default=sys.executable,
+        help='Interpreter to benchmark (default %(default)s)'
+    )
+    return parser.parse_args()
+
+
+def console_scripts(setup_file=None):
+    """Read the console_scripts entry points from setup.py without running it
+
+    Parameters
+    ----------
+        setup_file: `str`
+            path of setup.py (default the repository setup.py)
+    Returns
+    -------
+    `list` of (script name, module, function) `tuple`
+    """
+    if setup_file is None:
+        setup_file = os.path.join(ROOT, 'setup.py')
+    with open(setup_file, 'r') as stream:
+        tree = ast.parse(stream.read(), setup_file)
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.keyword) or node.arg != 'entry_points':
+            continue
+        entry_points = ast.literal_eval(node.value)
+        scripts = []
+        for entry in entry_points.get('console_scripts', []):
+            name, target = [s.strip() for s in entry.split('=', 1)]
+            module, _, function = target.partition(':')
+            scripts.append((name, module.strip(), function.strip()))
+        return scripts
+    raise Exception('No entry_points found in ' + setup_file)
+
+
+def measure(module, python=None):
+    """Import module in a fresh interpreter with `-X importtime`
+
+    Parameters
+    ----------
+        module: `str`
+            module name
+        python: `str`
+            interpreter (default the current one)
+    Returns
+    -------
+    (cumulative microseconds `int`, `set` of imported top level packages)
+    """
+    output = subprocess.run(
+        [python or sys.executable, '-X', 'importtime', '-c',
+         'import ' + module],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True).stderr
+    cumulative = None
+    packages = set()
+    for line in output.splitlines():
+        match = __IMPORT_TIME.match(line)
+        if match is None:
+            continue
+        name = match.group(4)
+        packages.add(name.split('.')[0])
+        if name == module:
+            cumulative = int(match.group(2))
+    if cumulative is None:
+        raise Exception('No import time reported for ' + module)
+    return cumulative, packages
+
+
+def main():
+    args = __parse_arguments()
+    failed = False
+    print('{0:<24}{1:>12}  {2}'.format('script', 'import ms', 'heavy imports'))
+    for name, module, _ in console_scripts():
+        samples = []
+        packages = set()
+        for _ in range(max(args.repeat, 1)):
+            cumulative, packages = measure(module, args.python)
+            samples.append(cumulative / 1000.0)
+        median = statistics.median(samples)
+        heavy = [m for m in HEAVY_MODULES if m in packages]
+        print('{0:<24}{1:>12.1f}  {2}'.format(
+            name, median, ', '.join(heavy) or '-'))
+        if args.max_ms is not None and median > args.max_ms:
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,31 @@
+def instance(instance_id, name='', resource='', private_ip='10.0.0.1',
+             public_ip=None, vpc_id='vpc-1', subnet_id='subnet-1',
+             az='us-east-1a', state='running'):
+    """Build a DescribeInstances instance entry"""
+    tags = []
+    if name:
+        tags.append({'Key': 'Name', 'Value': name})
+    if resource:
+        tags.append({'Key': 'Resource', 'Value': resource})
+    i = {
+        'InstanceId': instance_id,
+        'Tags': tags,
+        'Placement': {'AvailabilityZone': az},
+        'PrivateIpAddress': private_ip,
+        'VpcId': vpc_id,
+        'SubnetId': subnet_id,
+        'State': {'Name': state},
+    }
+    if public_ip:
+        i['PublicIpAddress'] = public_ip
+    return i
+
+
+def describe_instances(*instances, **kwargs):
+    """Build a DescribeInstances response with one reservation per instance"""
+    response = {
+        'Reservations': [{'Instances': [i]} for i in instances]
+    }
+    if kwargs.get('next_token'):
+        response['NextToken'] = kwargs['next_token']
+    return response
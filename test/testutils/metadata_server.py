@@ -0,0 +1,72 @@
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+TOKEN = 'test-token'
+
+METADATA = {
+    '/latest/meta-data/instance-id': 'i-0123456789abcdef0',
+    '/latest/meta-data/mac': '0a:1b:2c:3d:4e:5f',
+    '/latest/meta-data/network/interfaces/macs/0a:1b:2c:3d:4e:5f/vpc-id':
+        'vpc-0123abcd',
+    '/latest/dynamic/instance-identity/document': json.dumps({
+        'instanceId': 'i-0123456789abcdef0',
+        'region': 'us-east-2',
+    }),
+}
+
+
+class MetadataServer(object):
+    """Local stand-in for the EC2 instance metadata service. Records every
+    request path in `requests` and only accepts IMDSv2 tokens unless
+    `imdsv1` is True."""
+
+    def __init__(self, imdsv1=False):
+        self.requests = []
+        self.imdsv1 = imdsv1
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_PUT(self):
+                server.requests.append(('PUT', self.path))
+                if server.imdsv1:
+                    self.__respond(404, '')
+                else:
+                    self.__respond(200, TOKEN)
+
+            def do_GET(self):
+                server.requests.append(('GET', self.path))
+                token = self.headers.get('X-aws-ec2-metadata-token')
+                if not server.imdsv1 and token != TOKEN:
+                    self.__respond(401, '')
+                elif self.path in METADATA:
+                    self.__respond(200, METADATA[self.path])
+                else:
+                    self.__respond(404, '')
+
+            def __respond(self, status, body):
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body.encode('utf-8'))
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def endpoint(self):
+        return 'http://127.0.0.1:%s' % self.httpd.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
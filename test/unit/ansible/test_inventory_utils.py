@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+from bb.ansible import inventory_utils
+from bb.aws import asg_utils
+from bb.aws.ec2_instance import Ec2Instance
+from bb.aws.ec2_snapshot import Ec2Snapshot
+from test.testutils import ec2_fixtures
+
+DEFINITION = '''
+ec2_inventory_groups:
+  asg_groups:
+    - name: workers
+      inventory:
+        name: worker-nodes
+    - name: masters
+      inventory:
+        name: master-nodes
+  ec2_groups:
+    - name: beta-dtr-*
+      inventory:
+        name: dtr-nodes
+        vars:
+          - ucp_username: boxboat
+'''
+
+
+def _asg_details(names, region=None):
+    details = {
+        'workers': {'InstanceIds': ['i-3'], 'DesiredCapacity': 1},
+        'masters': {'InstanceIds': ['i-4'], 'DesiredCapacity': 1},
+    }
+    return dict((n, details[n]) for n in names if n in details)
+
+
+class TestInventoryUtils(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = dict(os.environ)
+        os.environ['BB_CACHE_DIR'] = self.tmp.name
+        self.builds = 0
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        self.tmp.cleanup()
+
+    def __create(self):
+        self.builds += 1
+        return inventory_utils.create_inventory([
+            inventory_utils.create_inventory_group(
+                'web', ['10.0.0.%s' % self.builds])])
+
+    def test_cached_inventory(self):
+        first = inventory_utils.get_cached_inventory(
+            ['ec2', 'definition', 'us-east-1'], self.__create)
+        second = inventory_utils.get_cached_inventory(
+            ['ec2', 'definition', 'us-east-1'], self.__create)
+        self.assertEqual(first, second)
+        self.assertEqual(1, self.builds)
+        inventory_utils.get_cached_inventory(
+            ['ec2', 'definition', 'us-west-2'], self.__create)
+        self.assertEqual(2, self.builds)
+
+    def test_cached_inventory_per_profile(self):
+        os.environ['AWS_PROFILE'] = 'alpha'
+        inventory_utils.get_cached_inventory(['vpc'], self.__create)
+        os.environ['AWS_PROFILE'] = 'beta'
+        beta = inventory_utils.get_cached_inventory(['vpc'], self.__create)
+        self.assertEqual(['10.0.0.2'], beta['web']['hosts'])
+        self.assertEqual(2, self.builds)
+
+    def test_refresh_and_disable(self):
+        inventory_utils.get_cached_inventory(['vpc'], self.__create)
+        refreshed = inventory_utils.get_cached_inventory(
+            ['vpc'], self.__create, refresh=True)
+        self.assertEqual(['10.0.0.2'], refreshed['web']['hosts'])
+        inventory_utils.get_cached_inventory(['vpc'], self.__create, ttl=0)
+        self.assertEqual(3, self.builds)
+
+    def test_dynamic_inventory(self):
+        snapshot = Ec2Snapshot('us-east-1', [
+            (i['InstanceId'], Ec2Instance.from_api(i)) for i in [
+                ec2_fixtures.instance('i-1', 'beta-dtr-02', private_ip='1'),
+                ec2_fixtures.instance('i-2', 'beta-dtr-01', private_ip='2'),
+                ec2_fixtures.instance('i-3', 'worker', private_ip='3'),
+                ec2_fixtures.instance('i-4', 'master', private_ip='4'),
+            ]])
+        with mock.patch.object(asg_utils, 'get_asg_details',
+                               side_effect=_asg_details) as details:
+            inv = inventory_utils.create_dynamic_ec2_inventory(
+                DEFINITION, 'us-east-1', snapshot)
+            self.assertEqual(
+                ['_meta', 'dtr-nodes', 'worker-nodes', 'master-nodes'],
+                list(inv))
+            self.assertEqual(['2', '1'], inv['dtr-nodes']['hosts'])
+            self.assertEqual(
+                {'ucp_username': 'boxboat'}, inv['_meta']['hostvars']['1'])
+            details.assert_called_once_with(['workers', 'masters'], 'us-east-1')
+            with self.assertRaises(Exception) as e:
+                inventory_utils.create_dynamic_ec2_inventory(
+                    DEFINITION.replace('masters', 'missing'),
+                    'us-east-1',
+                    snapshot)
+            self.assertIn('missing not found', str(e.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
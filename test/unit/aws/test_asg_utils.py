@@ -0,0 +1,106 @@
+import unittest
+
+from botocore.stub import Stubber
+
+from bb.aws import asg_utils
+from bb.aws import client_factory
+
+REGION = 'us-east-1'
+
+
+def _group(name, capacity, *instances):
+    return {
+        'AutoScalingGroupName': name,
+        'MinSize': 0,
+        'MaxSize': 10,
+        'DesiredCapacity': capacity,
+        'DefaultCooldown': 300,
+        'AvailabilityZones': ['us-east-1a'],
+        'HealthCheckType': 'EC2',
+        'CreatedTime': '2018-01-01T00:00:00Z',
+        'Instances': [
+            {
+                'InstanceId': instance_id,
+                'AvailabilityZone': 'us-east-1a',
+                'LifecycleState': state,
+                'HealthStatus': 'Healthy',
+                'ProtectedFromScaleIn': False,
+            } for instance_id, state in instances
+        ],
+    }
+
+
+class TestAsgUtils(unittest.TestCase):
+
+    def setUp(self):
+        self.client = client_factory.get_asg_client(REGION)
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def test_asg_details_batched(self):
+        names = ['asg-%02d' % i for i in range(60)]
+        self.stubber.add_response(
+            'describe_auto_scaling_groups',
+            {'AutoScalingGroups': [
+                _group('asg-00', 2,
+                       ('i-1', 'InService'), ('i-2', 'Pending'))]},
+            {'AutoScalingGroupNames': names[:50], 'MaxRecords': 100})
+        self.stubber.add_response(
+            'describe_auto_scaling_groups',
+            {'AutoScalingGroups': [_group('asg-59', 1, ('i-3', 'InService'))]},
+            {'AutoScalingGroupNames': names[50:], 'MaxRecords': 100})
+        details = asg_utils.get_asg_details(names, REGION)
+        self.assertEqual(['asg-00', 'asg-59'], sorted(details))
+        self.assertEqual(['i-1'], details['asg-00']['InstanceIds'])
+        self.assertEqual(2, details['asg-00']['DesiredCapacity'])
+        self.assertEqual(
+            'Pending', details['asg-00']['LifecycleStates']['i-2'])
+        self.stubber.assert_no_pending_responses()
+
+    def test_asg_name(self):
+        self.stubber.add_response(
+            'describe_auto_scaling_instances',
+            {'AutoScalingInstances': [{
+                'InstanceId': 'i-1',
+                'AutoScalingGroupName': 'workers',
+                'AvailabilityZone': 'us-east-1a',
+                'LifecycleState': 'InService',
+                'HealthStatus': 'HEALTHY',
+                'ProtectedFromScaleIn': False,
+            }]},
+            {'InstanceIds': ['i-1']})
+        self.stubber.add_response(
+            'describe_auto_scaling_instances',
+            {'AutoScalingInstances': []},
+            {'InstanceIds': ['i-2']})
+        self.assertEqual('workers', asg_utils.get_asg_name('i-1', REGION))
+        self.assertIsNone(asg_utils.get_asg_name('i-2', REGION))
+        self.stubber.assert_no_pending_responses()
+
+    def test_asg_name_tag_fallback(self):
+        self.stubber.add_client_error(
+            'describe_auto_scaling_instances', 'AccessDenied')
+        ec2_client = client_factory.get_ec2_client(REGION)
+        with Stubber(ec2_client) as ec2_stubber:
+            ec2_stubber.add_response(
+                'describe_tags',
+                {'Tags': [{
+                    'Key': asg_utils.ASG_NAME_TAG,
+                    'ResourceId': 'i-1',
+                    'ResourceType': 'instance',
+                    'Value': 'workers',
+                }]})
+            self.assertEqual('workers', asg_utils.get_asg_name('i-1', REGION))
+
+    def test_asg_not_found(self):
+        self.stubber.add_response(
+            'describe_auto_scaling_groups', {'AutoScalingGroups': []})
+        with self.assertRaises(Exception):
+            asg_utils.get_asg_ec2_instance_ids('missing', REGION)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from unittest import mock
+
+from bb.aws import client_factory
+
+
+class TestClientFactory(unittest.TestCase):
+
+    def setUp(self):
+        client_factory.clear()
+
+    def tearDown(self):
+        client_factory.set_pool_size(client_factory.DEFAULT_POOL_SIZE)
+        client_factory.clear()
+
+    def test_client_reused(self):
+        first = client_factory.get_ec2_client('us-east-1')
+        second = client_factory.get_ec2_client('us-east-1')
+        self.assertIs(first, second)
+        self.assertIsNot(first, client_factory.get_ec2_client('us-west-2'))
+
+    def test_invalidate(self):
+        first = client_factory.get_s3_client('us-east-1')
+        client_factory.get_ec2_client('us-east-1')
+        self.assertEqual(1, client_factory.invalidate(service='s3'))
+        self.assertIsNot(first, client_factory.get_s3_client('us-east-1'))
+
+    @unittest.skipIf(
+        client_factory.botocore_version()
+        < client_factory.RETRY_MODE_MIN_BOTOCORE,
+        'retry modes require a newer botocore')
+    def test_config(self):
+        client = client_factory.get_s3_client(
+            'us-east-1',
+            max_pool_connections=32,
+            retry_mode='adaptive',
+            read_timeout=5)
+        self.assertEqual(32, client.meta.config.max_pool_connections)
+        self.assertEqual('adaptive', client.meta.config.retries['mode'])
+        self.assertEqual(5, client.meta.config.read_timeout)
+        self.assertIsNot(client, client_factory.get_s3_client('us-east-1'))
+
+    def test_config_unsupported_by_botocore(self):
+        with mock.patch.object(client_factory.botocore, '__version__',
+                               '1.12.214'):
+            with self.assertRaisesRegex(Exception, 'botocore >= 1.15.0'):
+                client_factory.client_config(retry_mode='standard')
+        with mock.patch.dict(client_factory.botocore_config.Config
+                             .OPTION_DEFAULTS):
+            client_factory.botocore_config.Config.OPTION_DEFAULTS.pop(
+                'tcp_keepalive', None)
+            with self.assertRaisesRegex(Exception, 'tcp_keepalive'):
+                client_factory.client_config(tcp_keepalive=True)
+
+    def test_pool_size(self):
+        client_factory.set_pool_size(1)
+        first = client_factory.get_ec2_client('us-east-1')
+        client_factory.get_s3_client('us-east-1')
+        self.assertIsNot(first, client_factory.get_ec2_client('us-east-1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+from botocore.stub import Stubber
+
+from bb.aws import client_factory
+from bb.aws import ec2_host_index
+from test.testutils import ec2_fixtures
+
+REGION = 'us-east-1'
+
+
+class TestEc2HostIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(
+            os.environ, {'BB_CACHE_DIR': self.tmp.name})
+        self.env.start()
+        self.client = client_factory.get_ec2_client(REGION)
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+        self.env.stop()
+        self.tmp.cleanup()
+
+    def test_index_cached_and_searched(self):
+        self.stubber.add_response(
+            'describe_instances',
+            ec2_fixtures.describe_instances(
+                ec2_fixtures.instance('i-1', 'prod-web-01', 'prod',
+                                      private_ip='10.0.1.5'),
+                ec2_fixtures.instance('i-2', 'prod-web-02', 'prod',
+                                      private_ip='10.0.1.6'),
+                ec2_fixtures.instance('i-3', 'prod-bastion-01', 'prod',
+                                      public_ip='54.0.0.1')))
+        hosts = ec2_host_index.get_host_index(REGION)
+        # served from the disk cache
+        self.assertEqual(hosts, ec2_host_index.get_host_index(REGION))
+        self.stubber.assert_no_pending_responses()
+
+        self.assertEqual(
+            ['i-3', 'i-1', 'i-2'],
+            [h['InstanceId'] for h in ec2_host_index.search_hosts(hosts, '')])
+        self.assertEqual(
+            ['i-2'],
+            [h['InstanceId']
+             for h in ec2_host_index.search_hosts(hosts, 'web02')])
+        self.assertEqual(
+            'i-3',
+            ec2_host_index.search_hosts(hosts, 'bastoin')[0]['InstanceId'])
+        self.assertEqual(
+            ['i-2'],
+            [h['InstanceId']
+             for h in ec2_host_index.search_hosts(hosts, '10.0.1.6')])
+
+    def test_index_cached_per_profile(self):
+        self.stubber.add_response(
+            'describe_instances',
+            ec2_fixtures.describe_instances(
+                ec2_fixtures.instance('i-1', 'prod-web-01', 'prod')))
+        self.assertEqual(
+            1, len(ec2_host_index.get_host_index(REGION)))
+        with mock.patch.dict(os.environ, {'AWS_PROFILE': 'other'}), \
+                mock.patch.object(ec2_host_index.ec2, 'iter_ec2_instances',
+                                  return_value=[]):
+            self.assertEqual([], ec2_host_index.get_host_index(REGION))
+        self.stubber.assert_no_pending_responses()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import pickle
+import unittest
+
+from bb.aws.ec2_instance import Ec2Instance
+from test.testutils import ec2_fixtures
+
+
+class TestEc2Instance(unittest.TestCase):
+
+    def setUp(self):
+        self.instance = Ec2Instance.from_api(
+            ec2_fixtures.instance(
+                'i-1', 'foo-web-01', 'foo', public_ip='1.2.3.4'))
+
+    def test_mapping_view(self):
+        self.assertEqual('foo-web-01', self.instance['Name'])
+        self.assertEqual('foo', self.instance['Resource'])
+        self.assertEqual('us-east-1a', self.instance['AvailabilityZone'])
+        self.assertEqual('1.2.3.4', self.instance.get('PublicIpAddress'))
+        self.assertIsNone(self.instance.get('PrivateDnsName'))
+        self.assertEqual(
+            [{'Key': 'Name', 'Value': 'foo-web-01'},
+             {'Key': 'Resource', 'Value': 'foo'}],
+            self.instance['Tags'])
+        self.assertEqual(11, len(self.instance.to_dict()))
+        with self.assertRaises(KeyError):
+            self.instance['Missing']
+
+    def test_compact(self):
+        self.assertFalse(hasattr(self.instance, '__dict__'))
+        self.assertEqual('foo', self.instance.tag('Resource'))
+        other = Ec2Instance.from_api(ec2_fixtures.instance('i-2'))
+        self.assertIs(self.instance.vpc_id, other.vpc_id)
+
+    def test_pickle(self):
+        copy = pickle.loads(pickle.dumps(self.instance))
+        self.assertEqual(self.instance.to_dict(), copy.to_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
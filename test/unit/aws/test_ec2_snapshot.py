@@ -0,0 +1,75 @@
+import unittest
+
+from bb.aws.ec2_instance import Ec2Instance
+from bb.aws.ec2_snapshot import Ec2Snapshot
+from test.testutils import ec2_fixtures
+
+
+def _snapshot(*instances):
+    return Ec2Snapshot(
+        'us-east-1',
+        [(i['InstanceId'], Ec2Instance.from_api(i)) for i in instances])
+
+
+class TestEc2Snapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshot = _snapshot(
+            ec2_fixtures.instance('i-1', 'beta-dtr-01', 'beta'),
+            ec2_fixtures.instance('i-2', 'beta-dtr-02', 'beta',
+                                  subnet_id='subnet-2', az='us-east-1b'),
+            ec2_fixtures.instance('i-3', 'beta-web-01', 'beta',
+                                  state='stopped'),
+            ec2_fixtures.instance('i-4', 'prod-dtr-01', 'prod',
+                                  vpc_id='vpc-2'),
+            ec2_fixtures.instance('i-5', 'beta-dtr-*'))
+
+    def test_name_wildcard_skips_untagged(self):
+        snapshot = _snapshot(
+            ec2_fixtures.instance('i-1', 'beta-dtr-01'),
+            ec2_fixtures.instance('i-2'))
+        self.assertEqual(['i-1'], list(snapshot.get_ec2_instances('*')))
+        self.assertEqual({}, snapshot.get_ec2_instances(''))
+
+    def test_name_lookup(self):
+        self.assertEqual(
+            ['i-1'], list(self.snapshot.get_ec2_instances('beta-dtr-01')))
+        self.assertEqual(
+            ['i-1', 'i-2', 'i-5'],
+            sorted(self.snapshot.get_ec2_instances('beta-dtr-*')))
+        self.assertEqual(
+            ['i-1', 'i-2'],
+            sorted(self.snapshot.get_ec2_instances('beta-dtr-0?')))
+        self.assertEqual(
+            ['i-1', 'i-2', 'i-4', 'i-5'],
+            sorted(self.snapshot.get_ec2_instances('*dtr*')))
+        self.assertEqual(
+            ['i-5'],
+            list(self.snapshot.get_ec2_instances('beta-dtr-\\*')))
+        self.assertEqual(
+            ['i-1', 'i-2'],
+            sorted(self.snapshot.get_ec2_instances('beta-*-0?', ['running'])))
+
+    def test_indexes(self):
+        self.assertEqual(
+            ['i-4'], list(self.snapshot.get_ec2_instances_in_vpc('vpc-2')))
+        self.assertEqual(
+            ['i-2'],
+            list(self.snapshot.get_ec2_instances_in_subnet('subnet-2')))
+        self.assertEqual(
+            ['i-2'],
+            list(self.snapshot.get_ec2_instances_in_availability_zone(
+                'us-east-1b')))
+        self.assertEqual(
+            ['i-3'],
+            list(self.snapshot.get_ec2_instances_in_state(['stopped'])))
+        self.assertEqual(
+            3, len(self.snapshot.get_ec2_instances_with_resource('beta')))
+        self.assertEqual(
+            ['i-1'], list(self.snapshot.get_ec2_instance_info(['i-1', 'i-9'])))
+        self.assertEqual(
+            'dtr-01', self.snapshot.get_instance_name('i-4', True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+
+from bb.aws import client_factory
+from bb.aws import ec2_utils
+from test.testutils import ec2_fixtures
+
+REGION = 'us-east-1'
+
+
+class TestEc2Utils(unittest.TestCase):
+
+    def setUp(self):
+        ec2_utils.invalidate_instance_info()
+        self.client = client_factory.get_ec2_client(REGION)
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+        ec2_utils.invalidate_instance_info()
+
+    def test_instance_info_cached(self):
+        self.stubber.add_response(
+            'describe_instances',
+            ec2_fixtures.describe_instances(
+                ec2_fixtures.instance('i-1', 'foo-web-01', 'foo')),
+            {'InstanceIds': ['i-1']})
+        self.stubber.add_response(
+            'describe_instances',
+            ec2_fixtures.describe_instances(
+                ec2_fixtures.instance('i-2', 'foo-web-02', 'foo')),
+            {'InstanceIds': ['i-2']})
+        self.assertEqual(
+            'web-01', ec2_utils.get_instance_name('i-1', True, REGION))
+        self.assertEqual(
+            '10.0.0.1', ec2_utils.get_instance_private_ip('i-1', REGION))
+        info = ec2_utils.get_ec2_instance_info(['i-1', 'i-2'], REGION)
+        self.assertEqual(['i-1', 'i-2'], sorted(info))
+        self.stubber.assert_no_pending_responses()
+
+    def test_instance_info_isolates_invalid_ids(self):
+        self.stubber.add_client_error(
+            'describe_instances',
+            'InvalidInstanceID.NotFound',
+            "The instance ID 'i-3' does not exist",
+            expected_params={'InstanceIds': ['i-1', 'i-3', 'i-2']})
+        self.stubber.add_response(
+            'describe_instances',
+            ec2_fixtures.describe_instances(
+                ec2_fixtures.instance('i-1'),
+                ec2_fixtures.instance('i-2')),
+            {'InstanceIds': ['i-1', 'i-2']})
+        info, failed = ec2_utils.get_ec2_instance_info_batch(
+            ['i-1', 'i-3', 'i-2', 'i-1'], REGION)
+        self.assertEqual(['i-1', 'i-2'], sorted(info))
+        self.assertEqual(['i-3'], list(failed))
+        self.stubber.assert_no_pending_responses()
+
+    def test_instance_info_raises_request_errors(self):
+        self.stubber.add_client_error(
+            'describe_instances',
+            'AccessDenied',
+            'Not authorized to perform ec2:DescribeInstances',
+            expected_params={'InstanceIds': ['i-1', 'i-2']})
+        with self.assertRaises(ClientError) as raised:
+            ec2_utils.get_ec2_instance_info(['i-1', 'i-2'], REGION)
+        self.assertEqual(
+            'AccessDenied', raised.exception.response['Error']['Code'])
+        self.stubber.assert_no_pending_responses()
+
+    def test_instances_paginated(self):
+        expected = {
+            'Filters': [
+                {'Name': 'vpc-id', 'Values': ['vpc-1']},
+                {'Name': 'instance-state-name', 'Values': ['running']},
+            ],
+            'MaxResults': 5,
+        }
+        self.stubber.add_response(
+            'describe_instances',
+            ec2_fixtures.describe_instances(
+                ec2_fixtures.instance('i-1'), next_token='page-2'),
+            expected)
+        expected = dict(expected, NextToken='page-2')
+        self.stubber.add_response(
+            'describe_instances',
+            ec2_fixtures.describe_instances(ec2_fixtures.instance('i-2')),
+            expected)
+        instances = ec2_utils.get_ec2_instances_in_vpc(
+            'vpc-1', REGION, states=['running'], page_size=5)
+        self.assertEqual(['i-1', 'i-2'], sorted(instances))
+        self.stubber.assert_no_pending_responses()
+
+    def test_set_name_invalidates(self):
+        self.stubber.add_response(
+            'describe_instances',
+            ec2_fixtures.describe_instances(
+                ec2_fixtures.instance('i-1', 'web')))
+        self.stubber.add_response('create_tags', {})
+        self.stubber.add_response(
+            'describe_instances',
+            ec2_fixtures.describe_instances(
+                ec2_fixtures.instance('i-1', 'web-01')))
+        self.assertEqual('web', ec2_utils.get_instance_name('i-1', region=REGION))
+        ec2_utils.set_ec2_instance_name('i-1', 'web-01', REGION)
+        self.assertEqual(
+            'web-01', ec2_utils.get_instance_name('i-1', region=REGION))
+        self.stubber.assert_no_pending_responses()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+import requests
+
+from unittest import mock
+
+from bb.aws import metadata
+from test.testutils.metadata_server import MetadataServer
+
+
+class TestMetadata(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = dict(os.environ)
+        os.environ['BB_CACHE_DIR'] = self.tmp.name
+        metadata.clear()
+
+    def tearDown(self):
+        metadata.clear()
+        os.environ.clear()
+        os.environ.update(self.env)
+        self.tmp.cleanup()
+
+    def test_imdsv2(self):
+        with MetadataServer() as server:
+            os.environ['BB_AWS_METADATA_ENDPOINT'] = server.endpoint
+            self.assertEqual('i-0123456789abcdef0', metadata.get_instance_id())
+            self.assertEqual('vpc-0123abcd', metadata.get_vpc_id())
+            self.assertEqual('us-east-2', metadata.get_region())
+            self.assertEqual('i-0123456789abcdef0', metadata.get_instance_id())
+            puts = [r for r in server.requests if r[0] == 'PUT']
+            self.assertEqual(1, len(puts))
+            self.assertEqual(5, len(server.requests))
+
+    def test_imdsv1_fallback(self):
+        with MetadataServer(imdsv1=True) as server:
+            os.environ['BB_AWS_METADATA_ENDPOINT'] = server.endpoint
+            self.assertEqual('i-0123456789abcdef0', metadata.get_instance_id())
+
+    def test_imdsv1_fallback_on_token_timeout(self):
+        with MetadataServer(imdsv1=True) as server, \
+                mock.patch.object(requests.Session, 'put',
+                                  side_effect=requests.ConnectTimeout):
+            os.environ['BB_AWS_METADATA_ENDPOINT'] = server.endpoint
+            self.assertEqual('i-0123456789abcdef0', metadata.get_instance_id())
+
+    def test_missing_path(self):
+        with MetadataServer() as server:
+            os.environ['BB_AWS_METADATA_ENDPOINT'] = server.endpoint
+            with self.assertRaises(Exception):
+                metadata.get('meta-data/missing')
+
+    @unittest.skipUnless(os.path.exists('/proc/sys/kernel/random/boot_id'),
+                         'requires boot_id')
+    def test_disk_cache(self):
+        with MetadataServer() as server:
+            os.environ['BB_AWS_METADATA_ENDPOINT'] = server.endpoint
+            metadata.get_instance_id()
+        metadata.clear()
+        os.environ['BB_AWS_METADATA_ENDPOINT'] = 'http://127.0.0.1:9'
+        self.assertEqual('i-0123456789abcdef0', metadata.get_instance_id())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+import bb.aws
+from bb.aws import metadata
+from bb.aws import region_utils
+from test.testutils.metadata_server import MetadataServer
+
+
+class TestRegionUtils(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = dict(os.environ)
+        for var in ('AWS_REGION', 'AWS_DEFAULT_REGION', 'AWS_PROFILE',
+                    'AWS_DEFAULT_PROFILE'):
+            os.environ.pop(var, None)
+        os.environ['AWS_CONFIG_FILE'] = os.path.join(self.tmp.name, 'config')
+        os.environ['BB_CACHE_DIR'] = self.tmp.name
+        bb.aws.region = None
+        metadata.clear()
+
+    def tearDown(self):
+        metadata.clear()
+        os.environ.clear()
+        os.environ.update(self.env)
+        bb.aws.region = None
+        self.tmp.cleanup()
+
+    def test_environment_region(self):
+        os.environ['AWS_DEFAULT_REGION'] = 'us-west-1'
+        self.assertEqual('us-west-1', region_utils.get_region())
+
+    def test_config_file_region(self):
+        with open(os.environ['AWS_CONFIG_FILE'], 'w') as f:
+            f.write('[default]\nregion = eu-west-1\n'
+                    '[profile other]\nregion = ap-south-1\n')
+        self.assertEqual('eu-west-1', region_utils.get_region())
+        bb.aws.region = None
+        os.environ['AWS_PROFILE'] = 'other'
+        self.assertEqual('ap-south-1', region_utils.get_region())
+
+    @unittest.skipUnless(os.path.exists('/proc/sys/kernel/random/boot_id'),
+                         'requires boot_id')
+    def test_instance_region_cached_by_metadata(self):
+        with MetadataServer() as server:
+            os.environ['BB_AWS_METADATA_ENDPOINT'] = server.endpoint
+            self.assertEqual('us-east-2', region_utils.get_region())
+        bb.aws.region = None
+        metadata.clear()
+        os.environ['BB_AWS_METADATA_ENDPOINT'] = 'http://127.0.0.1:9'
+        self.assertEqual('us-east-2', region_utils.get_region())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from unittest import mock
+from botocore.stub import ANY, Stubber
+
+from bb.aws import client_factory
+from bb.aws import route53_utils
+
+REGION = 'us-east-1'
+
+
+def _zone(zone_id, name, private=False):
+    return {
+        'Id': '/hostedzone/' + zone_id,
+        'Name': name,
+        'CallerReference': zone_id,
+        'Config': {'PrivateZone': private},
+    }
+
+
+def _change_info(change_id='C1', status='PENDING'):
+    return {'ChangeInfo': {
+        'Id': '/change/' + change_id,
+        'Status': status,
+        'SubmittedAt': '2018-01-01T00:00:00Z',
+    }}
+
+
+class TestRoute53Utils(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(
+            os.environ, {'BB_CACHE_DIR': self.tmp.name})
+        self.env.start()
+        route53_utils.clear_zone_cache()
+        self.client = client_factory.get_route53_client(REGION)
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+        route53_utils.clear_zone_cache()
+        self.env.stop()
+        self.tmp.cleanup()
+
+    def test_zone_id_cached(self):
+        self.stubber.add_response(
+            'list_hosted_zones_by_name',
+            {'HostedZones': [
+                _zone('PUB', 'example.com.'),
+                _zone('PRIV', 'example.com.', private=True),
+                _zone('OTHER', 'example.net.'),
+            ], 'IsTruncated': False, 'MaxItems': '100'},
+            {'DNSName': 'example.com.', 'MaxItems': '100'})
+        self.assertEqual(
+            '/hostedzone/PRIV',
+            route53_utils.get_hosted_zone_id('Example.com', REGION, True))
+        self.assertEqual(
+            '/hostedzone/PRIV',
+            route53_utils.get_hosted_zone_id('example.com.', REGION, True))
+        # a new process reads the disk cache
+        route53_utils.clear_zone_cache()
+        self.assertEqual(
+            '/hostedzone/PRIV',
+            route53_utils.get_hosted_zone_id('example.com', REGION, True))
+        self.stubber.assert_no_pending_responses()
+
+    def test_zone_not_found(self):
+        self.stubber.add_response(
+            'list_hosted_zones_by_name',
+            {'HostedZones': [_zone('OTHER', 'example.net.')],
+             'IsTruncated': False, 'MaxItems': '100'})
+        with self.assertRaises(Exception):
+            route53_utils.get_hosted_zone_id('example.com', REGION)
+
+    def _zones_response(self, zone_id):
+        self.stubber.add_response(
+            'list_hosted_zones_by_name',
+            {'HostedZones': [_zone(zone_id, 'example.com.')],
+             'IsTruncated': False, 'MaxItems': '100'},
+            {'DNSName': 'example.com.', 'MaxItems': '100'})
+
+    def test_zone_cache_entry_expires(self):
+        # the file is fresh but the entry was looked up two days ago
+        path = os.path.join(self.tmp.name, route53_utils.ZONE_CACHE)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as stream:
+            json.dump({'|example.com.|None': {
+                'Id': '/hostedzone/OLD', 'Time': time.time() - 172800}},
+                stream)
+        self._zones_response('NEW')
+        self.assertEqual(
+            '/hostedzone/NEW',
+            route53_utils.get_hosted_zone_id('example.com', REGION))
+        self.stubber.assert_no_pending_responses()
+
+    def test_deleted_zone_looked_up_again(self):
+        self._zones_response('OLD')
+        self.stubber.add_client_error(
+            'change_resource_record_sets', 'NoSuchHostedZone',
+            expected_params={'HostedZoneId': '/hostedzone/OLD',
+                             'ChangeBatch': ANY})
+        self._zones_response('NEW')
+        self.stubber.add_response(
+            'change_resource_record_sets', _change_info(),
+            {'HostedZoneId': '/hostedzone/NEW', 'ChangeBatch': ANY})
+        status = route53_utils.create_or_update_dns_a_record(
+            'host', None, 'example.com', '10.0.0.1', region=REGION)
+        self.assertEqual('PENDING', status)
+        # the new id replaced the stale one on disk
+        route53_utils.clear_zone_cache()
+        self.assertEqual(
+            '/hostedzone/NEW',
+            route53_utils.get_hosted_zone_id('example.com', REGION))
+        self.stubber.assert_no_pending_responses()
+
+    def test_reconcile_deleted_zone_looked_up_again(self):
+        self._zones_response('OLD')
+        self.stubber.add_client_error(
+            'list_resource_record_sets', 'NoSuchHostedZone',
+            expected_params={'HostedZoneId': '/hostedzone/OLD',
+                             'MaxItems': '300'})
+        self._zones_response('NEW')
+        self.stubber.add_response(
+            'list_resource_record_sets',
+            {'ResourceRecordSets': [], 'IsTruncated': False,
+             'MaxItems': '300'},
+            {'HostedZoneId': '/hostedzone/NEW', 'MaxItems': '300'})
+        batch = route53_utils.reconcile_a_records(
+            {'host.example.com': ['10.0.0.1']}, 'example.com', region=REGION)
+        self.assertEqual(['/hostedzone/NEW'],
+                         [zone_id for zone_id, _ in batch.batches()])
+        self.stubber.assert_no_pending_responses()
+
+    def test_batch_grouped_and_split(self):
+        batch = route53_utils.ChangeBatch(REGION)
+        for i in range(600):
+            batch.upsert_a_record('host-%s' % i, None, 'example.com',
+                                  '10.0.0.%s' % (i % 250), zone_id='Z1')
+        # replaces the earlier change to the same record set
+        batch.upsert_a_record('HOST-0', None, 'example.com', '10.1.1.1',
+                              zone_id='Z1')
+        batch.upsert_a_record('host-0', None, 'example.org', '1.2.3.4',
+                              zone_id='Z2')
+        self.assertEqual(601, len(batch))
+        batches = batch.batches()
+        self.assertEqual([('Z1', 500), ('Z1', 100), ('Z2', 1)],
+                         [(z, len(c)) for z, c in batches])
+        self.assertEqual(
+            [{'Value': '10.1.1.1'}],
+            batches[0][1][0]['ResourceRecordSet']['ResourceRecords'])
+
+        for _ in batches:
+            self.stubber.add_response(
+                'change_resource_record_sets', _change_info(),
+                {'HostedZoneId': ANY, 'ChangeBatch': ANY})
+        self.assertEqual(3, len(batch.submit()))
+        self.assertEqual(0, len(batch))
+        self.stubber.assert_no_pending_responses()
+
+    def test_reconcile_submits_diff(self):
+        def a(name, *ips):
+            return {'Name': name, 'Type': 'A', 'TTL': 300,
+                    'ResourceRecords': [{'Value': ip} for ip in ips]}
+        alias = {'Name': 'lb.example.com.', 'Type': 'A', 'AliasTarget': {
+            'HostedZoneId': 'Z2', 'DNSName': 'lb.aws.com.',
+            'EvaluateTargetHealth': False}}
+        self.stubber.add_response(
+            'list_resource_record_sets',
+            {'ResourceRecordSets': [
+                a('same.example.com.', '10.0.0.2', '10.0.0.1'),
+                a('moved.example.com.', '10.0.0.3'),
+                a('stale.example.com.', '10.0.0.4'),
+                a('deep.stale.example.com.', '10.0.0.5'),
+                alias,
+                {'Name': 'example.com.', 'Type': 'NS', 'TTL': 300,
+                 'ResourceRecords': [{'Value': 'ns.aws.com.'}]},
+            ], 'IsTruncated': False, 'MaxItems': '300'},
+            {'HostedZoneId': 'Z1', 'MaxItems': '300'})
+        batch = route53_utils.reconcile_a_records(
+            {'same.example.com': ['10.0.0.1', '10.0.0.2'],
+             'moved.example.com': ['10.0.0.9'],
+             'new.example.com': ['10.0.0.10']},
+            zone_id='Z1', region=REGION, prune_domain='example.com')
+        changes = [(c['Action'], c['ResourceRecordSet']['Name'])
+                   for _, b in batch.batches() for c in b]
+        self.assertEqual([
+            ('UPSERT', 'moved.example.com'),
+            ('UPSERT', 'new.example.com'),
+            ('DELETE', 'stale.example.com.'),
+        ], changes)
+        self.stubber.assert_no_pending_responses()
+
+    def test_tracker_waits_for_insync(self):
+        # one worker polls C1 until it is INSYNC, then C2
+        for change_id, status in (('C1', 'PENDING'), ('C1', 'INSYNC'),
+                                  ('C2', 'INSYNC')):
+            self.stubber.add_response(
+                'get_change', _change_info(change_id, status),
+                {'Id': change_id})
+        with route53_utils.ChangeTracker(
+                ['C1', 'C2'], REGION, timeout=5,
+                max_workers=1, poll_delay=0.01) as tracker:
+            infos = tracker.wait()
+        self.assertEqual(['C1', 'C2'], list(infos))
+        self.assertEqual(['INSYNC', 'INSYNC'],
+                         [i['Status'] for i in infos.values()])
+        self.stubber.assert_no_pending_responses()
+
+    def test_tracker_deadline(self):
+        for _ in range(3):
+            self.stubber.add_response(
+                'get_change', _change_info('C1', 'PENDING'))
+        with route53_utils.ChangeTracker(
+                [_change_info('C1')['ChangeInfo']], REGION, timeout=0.05,
+                max_workers=1, poll_delay=0.04) as tracker:
+            with self.assertRaises(Exception):
+                list(tracker.as_completed())
+
+
+if __name__ == '__main__':
+    unittest.main()
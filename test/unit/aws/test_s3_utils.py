@@ -0,0 +1,413 @@
+import datetime
+import hashlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+from botocore.response import StreamingBody
+from botocore.stub import ANY, Stubber
+
+from bb.aws import client_factory
+from bb.aws import s3_utils
+
+REGION = 'us-east-1'
+
+
+def _body(data):
+    return StreamingBody(io.BytesIO(data), len(data))
+
+
+class _Pipe(io.RawIOBase):
+    """Non-seekable stream like stdin or stdout"""
+
+    def __init__(self, data=b''):
+        self.source = io.BytesIO(data)
+        self.written = io.BytesIO()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.source.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def write(self, b):
+        return self.written.write(b)
+
+
+class TestS3Utils(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = s3_utils.get_transfer_config(max_concurrency=1)
+        self.client = client_factory.get_s3_client(
+            REGION, max_pool_connections=10)
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+        self.tmp.cleanup()
+
+    def test_download_prefix(self):
+        self.stubber.add_response(
+            'list_objects_v2',
+            {'Contents': [
+                {'Key': 'bundle/', 'Size': 0, 'ETag': '"d"'},
+                {'Key': 'bundle/a/one.txt', 'Size': 3, 'ETag': '"1"'},
+                {'Key': 'bundle/a/two.txt', 'Size': 3, 'ETag': '"2"'},
+            ]},
+            {'Bucket': 'bucket', 'Prefix': 'bundle/', 'MaxKeys': 1000})
+        for data in (b'one', b'two'):
+            self.stubber.add_response(
+                'get_object',
+                {'Body': _body(data), 'ContentLength': 3},
+                {'Bucket': 'bucket', 'Key': ANY})
+        s3_utils.download('bucket', 'bundle/', self.tmp.name, REGION,
+                          transfer_config=self.config)
+        with open(os.path.join(self.tmp.name, 'a', 'one.txt'), 'rb') as f:
+            self.assertEqual(b'one', f.read())
+        with open(os.path.join(self.tmp.name, 'a', 'two.txt'), 'rb') as f:
+            self.assertEqual(b'two', f.read())
+        self.stubber.assert_no_pending_responses()
+
+    def test_remote_copy_prefix(self):
+        large = 6 * 1024 * 1024
+        config = s3_utils.get_transfer_config(
+            max_concurrency=1,
+            multipart_threshold=1024 * 1024,
+            multipart_chunksize=5 * 1024 * 1024)
+        self.stubber.add_response(
+            'list_objects_v2',
+            {'Contents': [
+                {'Key': 'release/small', 'Size': 3, 'ETag': '"s"'},
+                {'Key': 'release/large', 'Size': large, 'ETag': '"l"'},
+            ]},
+            {'Bucket': 'src', 'Prefix': 'release/', 'MaxKeys': 1000})
+        self.stubber.add_response(
+            'copy_object', {},
+            {'CopySource': {'Bucket': 'src', 'Key': 'release/small'},
+             'Bucket': 'dest', 'Key': 'promoted/small',
+             'CopySourceIfMatch': '"s"'})
+        self.stubber.add_response(
+            'head_object',
+            {'ContentLength': large, 'ContentType': 'text/plain'},
+            {'Bucket': 'src', 'Key': 'release/large'})
+        self.stubber.add_response(
+            'create_multipart_upload', {'UploadId': 'u'},
+            {'Bucket': 'dest', 'Key': 'promoted/large',
+             'ContentType': 'text/plain'})
+        for number, byte_range in enumerate(
+                ('bytes=0-5242879', 'bytes=5242880-6291455'), 1):
+            self.stubber.add_response(
+                'upload_part_copy',
+                {'CopyPartResult': {'ETag': '"p%s"' % number}},
+                {'CopySource': {'Bucket': 'src', 'Key': 'release/large'},
+                 'CopySourceRange': byte_range,
+                 'CopySourceIfMatch': '"l"',
+                 'Bucket': 'dest', 'Key': 'promoted/large',
+                 'UploadId': 'u', 'PartNumber': number})
+        self.stubber.add_response(
+            'complete_multipart_upload', {},
+            {'Bucket': 'dest', 'Key': 'promoted/large', 'UploadId': 'u',
+             'MultipartUpload': {'Parts': [
+                 {'ETag': '"p1"', 'PartNumber': 1},
+                 {'ETag': '"p2"', 'PartNumber': 2}]}})
+        s3_utils.remote_copy('src', 'release/', 'dest', 'promoted',
+                             REGION, transfer_config=config)
+        self.stubber.assert_no_pending_responses()
+
+    def test_remote_copy_multipart_keeps_encryption_and_tags(self):
+        size = 6 * 1024 * 1024
+        config = s3_utils.get_transfer_config(
+            max_concurrency=1,
+            multipart_threshold=1024 * 1024,
+            multipart_chunksize=5 * 1024 * 1024)
+        self.stubber.add_response(
+            'head_object',
+            {'ContentLength': size, 'ETag': '"l"',
+             'ServerSideEncryption': 'aws:kms', 'SSEKMSKeyId': 'key-1',
+             'BucketKeyEnabled': True, 'TagCount': 2},
+            {'Bucket': 'src', 'Key': 'large'})
+        self.stubber.add_response(
+            'get_object_tagging',
+            {'TagSet': [{'Key': 'team', 'Value': 'web'},
+                        {'Key': 'tier', 'Value': 'a b'}]},
+            {'Bucket': 'src', 'Key': 'large'})
+        self.stubber.add_response(
+            'create_multipart_upload', {'UploadId': 'u'},
+            {'Bucket': 'dest', 'Key': 'dir/large',
+             'ServerSideEncryption': 'aws:kms', 'SSEKMSKeyId': 'key-1',
+             'BucketKeyEnabled': True, 'Tagging': 'team=web&tier=a+b'})
+        for number in (1, 2):
+            self.stubber.add_response(
+                'upload_part_copy',
+                {'CopyPartResult': {'ETag': '"p%s"' % number}},
+                {'CopySource': {'Bucket': 'src', 'Key': 'large'},
+                 'CopySourceRange': ANY, 'CopySourceIfMatch': '"l"',
+                 'Bucket': 'dest', 'Key': 'dir/large',
+                 'UploadId': 'u', 'PartNumber': number})
+        self.stubber.add_response('complete_multipart_upload', {})
+        s3_utils.remote_copy('src', 'large', 'dest', 'dir/', REGION,
+                             transfer_config=config)
+        self.stubber.assert_no_pending_responses()
+
+    @mock.patch.object(s3_utils, 'MAX_COPY_OBJECT_SIZE', 5 * 1024 * 1024)
+    def test_remote_copy_above_copy_object_limit(self):
+        # below the threshold but too large for a single CopyObject
+        size = 6 * 1024 * 1024
+        config = s3_utils.get_transfer_config(
+            max_concurrency=1,
+            multipart_threshold=64 * 1024 * 1024,
+            multipart_chunksize=5 * 1024 * 1024)
+        self.stubber.add_response(
+            'head_object', {'ContentLength': size, 'ETag': '"l"'},
+            {'Bucket': 'src', 'Key': 'large'})
+        self.stubber.add_response(
+            'create_multipart_upload', {'UploadId': 'u'},
+            {'Bucket': 'dest', 'Key': 'dir/large'})
+        for number in (1, 2):
+            self.stubber.add_response(
+                'upload_part_copy',
+                {'CopyPartResult': {'ETag': '"p%s"' % number}},
+                {'CopySource': {'Bucket': 'src', 'Key': 'large'},
+                 'CopySourceRange': ANY, 'CopySourceIfMatch': '"l"',
+                 'Bucket': 'dest', 'Key': 'dir/large',
+                 'UploadId': 'u', 'PartNumber': number})
+        self.stubber.add_response('complete_multipart_upload', {})
+        s3_utils.remote_copy('src', 'large', 'dest', 'dir/', REGION,
+                             transfer_config=config)
+        self.stubber.assert_no_pending_responses()
+
+    @mock.patch.object(s3_utils.time, 'sleep')
+    def test_remote_copy_retries(self, sleep):
+        config = s3_utils.get_transfer_config(max_concurrency=1)
+        self.stubber.add_response(
+            'head_object', {'ContentLength': 3, 'ETag': '"e"'},
+            {'Bucket': 'src', 'Key': 'file'})
+        self.stubber.add_client_error(
+            'copy_object', 'SlowDown', http_status_code=503)
+        self.stubber.add_response('copy_object', {})
+        self.stubber.add_client_error(
+            'head_object', 'NoSuchKey', http_status_code=404)
+        s3_utils.remote_copy('src', 'file', 'dest', 'dir/', REGION,
+                             transfer_config=config)
+        self.assertEqual(1, sleep.call_count)
+        with self.assertRaises(Exception):
+            s3_utils.remote_copy('src', 'missing', 'dest', 'dir/',
+                                 REGION, transfer_config=config)
+        self.stubber.assert_no_pending_responses()
+
+    def test_upload_directory(self):
+        src = os.path.join(self.tmp.name, 'build')
+        os.makedirs(os.path.join(src, 'lib'))
+        for name in ('index.html', os.path.join('lib', 'app.js')):
+            with open(os.path.join(src, name), 'w') as f:
+                f.write(name)
+        keys = []
+        self.client.meta.events.register(
+            'before-parameter-build.s3.PutObject',
+            lambda params, **kwargs: keys.append(params['Key']))
+        for _ in range(2):
+            self.stubber.add_response('put_object', {})
+        s3_utils.upload(src, 'bucket', 'site/', REGION,
+                        transfer_config=self.config)
+        self.assertEqual(['site/build/index.html', 'site/build/lib/app.js'],
+                         sorted(keys))
+        self.stubber.assert_no_pending_responses()
+
+    def test_upload_sync_delete(self):
+        src = os.path.join(self.tmp.name, 'build')
+        os.makedirs(src)
+        for name in ('same.txt', 'changed.txt'):
+            with open(os.path.join(src, name), 'w') as f:
+                f.write('data')
+        later = datetime.datetime.now(datetime.timezone.utc) + (
+            datetime.timedelta(days=1))
+        self.stubber.add_response(
+            'list_objects_v2',
+            {'Contents': [
+                {'Key': 'site/build/same.txt', 'Size': 4,
+                 'LastModified': later},
+                {'Key': 'site/build/changed.txt', 'Size': 5,
+                 'LastModified': later},
+                {'Key': 'site/build/stale.txt', 'Size': 4,
+                 'LastModified': later},
+            ]},
+            {'Bucket': 'bucket', 'Prefix': 'site/build/', 'MaxKeys': 1000})
+        keys = []
+        self.client.meta.events.register(
+            'before-parameter-build.s3.PutObject',
+            lambda params, **kwargs: keys.append(params['Key']))
+        self.stubber.add_response('put_object', {})
+        self.stubber.add_response(
+            'delete_objects', {},
+            {'Bucket': 'bucket',
+             'Delete': {'Objects': [{'Key': 'site/build/stale.txt'}],
+                        'Quiet': True}})
+        s3_utils.upload(src, 'bucket', 'site', REGION,
+                        transfer_config=self.config,
+                        sync=s3_utils.SYNC_SIZE_MTIME, delete=True)
+        self.assertEqual(['site/build/changed.txt'], keys)
+        self.stubber.assert_no_pending_responses()
+
+    def test_upload_sync_single_file(self):
+        src = os.path.join(self.tmp.name, 'app')
+        with open(src, 'w') as f:
+            f.write('data')
+        later = datetime.datetime.now(datetime.timezone.utc) + (
+            datetime.timedelta(days=1))
+        self.stubber.add_response(
+            'head_object', {'ContentLength': 4, 'LastModified': later},
+            {'Bucket': 'bucket', 'Key': 'logs/app'})
+        self.stubber.add_client_error(
+            'head_object', 'NoSuchKey', http_status_code=404,
+            expected_params={'Bucket': 'bucket', 'Key': 'logs/app'})
+        self.stubber.add_response('put_object', {})
+        for _ in range(2):
+            s3_utils.upload(src, 'bucket', 'logs/', REGION,
+                            transfer_config=self.config,
+                            sync=s3_utils.SYNC_SIZE_MTIME)
+        self.stubber.assert_no_pending_responses()
+
+    def test_compute_etag(self):
+        path = os.path.join(self.tmp.name, 'file')
+        with open(path, 'wb') as f:
+            f.write(b'a' * 10 + b'b' * 5)
+        self.assertEqual(hashlib.md5(b'a' * 10 + b'b' * 5).hexdigest(),
+                         s3_utils.compute_etag(path))
+        digests = hashlib.md5(b'a' * 10).digest() + (
+            hashlib.md5(b'b' * 5).digest())
+        self.assertEqual(hashlib.md5(digests).hexdigest() + '-2',
+                         s3_utils.compute_etag(path, 10))
+
+    def test_upload_fileobj_multipart(self):
+        data = os.urandom(6 * 1024 * 1024)
+        config = s3_utils.get_transfer_config(
+            max_concurrency=1,
+            multipart_threshold=5 * 1024 * 1024,
+            multipart_chunksize=5 * 1024 * 1024)
+        parts = []
+        self.client.meta.events.register(
+            'before-parameter-build.s3.UploadPart',
+            lambda params, **kwargs: parts.append(params['Body'].read()))
+        self.stubber.add_response(
+            'create_multipart_upload', {'UploadId': 'u'})
+        for number in (1, 2):
+            self.stubber.add_response(
+                'upload_part', {'ETag': '"%s"' % number})
+        self.stubber.add_response('complete_multipart_upload', {})
+        s3_utils.upload_fileobj(_Pipe(data), 'bucket', 'dump.tar', REGION,
+                                transfer_config=config)
+        self.assertEqual(data, b''.join(parts))
+        self.stubber.assert_no_pending_responses()
+
+    def test_download_fileobj_ranges_in_order(self):
+        data = os.urandom(6 * 1024 * 1024)
+        split = 5 * 1024 * 1024
+        config = s3_utils.get_transfer_config(
+            max_concurrency=1,
+            multipart_threshold=split,
+            multipart_chunksize=split)
+        self.stubber.add_response(
+            'head_object', {'ContentLength': len(data), 'ETag': '"e"'},
+            {'Bucket': 'bucket', 'Key': 'dump.tar'})
+        for part in (data[:split], data[split:]):
+            self.stubber.add_response(
+                'get_object',
+                {'Body': _body(part), 'ContentLength': len(part)},
+                {'Bucket': 'bucket', 'Key': 'dump.tar', 'IfMatch': ANY,
+                 'Range': ANY})
+        out = _Pipe()
+        s3_utils.download_fileobj('bucket', 'dump.tar', out, REGION,
+                                  transfer_config=config)
+        self.assertEqual(data, out.written.getvalue())
+        self.stubber.assert_no_pending_responses()
+
+    def test_download_fileobj_appends_to_seekable(self):
+        data = os.urandom(6 * 1024 * 1024)
+        split = 5 * 1024 * 1024
+        config = s3_utils.get_transfer_config(
+            max_concurrency=1,
+            multipart_threshold=split,
+            multipart_chunksize=split)
+        self.stubber.add_response(
+            'head_object', {'ContentLength': len(data), 'ETag': '"e"'},
+            {'Bucket': 'bucket', 'Key': 'dump.tar'})
+        for part in (data[:split], data[split:]):
+            self.stubber.add_response(
+                'get_object',
+                {'Body': _body(part), 'ContentLength': len(part)},
+                {'Bucket': 'bucket', 'Key': 'dump.tar', 'IfMatch': ANY,
+                 'Range': ANY})
+        # like stdout redirected to a file that already has contents
+        out = io.BytesIO(b'HEADER\n')
+        out.seek(0, io.SEEK_END)
+        s3_utils.download_fileobj('bucket', 'dump.tar', out, REGION,
+                                  transfer_config=config)
+        self.assertEqual(b'HEADER\n' + data, out.getvalue())
+        self.stubber.assert_no_pending_responses()
+
+    def test_upload_fileobj_requires_key(self):
+        with self.assertRaises(Exception):
+            s3_utils.upload_fileobj(_Pipe(b'x'), 'bucket', 'dir/', REGION)
+
+    def test_download_large_object_resumes(self):
+        data = b'0123456789'
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        config = s3_utils.get_transfer_config(
+            max_concurrency=1, multipart_chunksize=4)
+        dest = os.path.join(self.tmp.name, 'snapshot.img')
+        # the first range was written before an interruption
+        with open(dest + '.bbpart', 'wb') as f:
+            f.write(data[:4] + b'\0' * 6)
+        with open(dest + '.bbpart.map', 'w') as f:
+            f.write(json.dumps(
+                {'etag': etag, 'size': len(data), 'chunksize': 4}))
+            f.write('\n1\n')
+        self.stubber.add_response(
+            'head_object', {'ContentLength': len(data), 'ETag': etag},
+            {'Bucket': 'bucket', 'Key': 'snapshot.img'})
+        for first, last in ((4, 7), (8, 9)):
+            self.stubber.add_response(
+                'get_object',
+                {'Body': _body(data[first:last + 1])},
+                {'Bucket': 'bucket', 'Key': 'snapshot.img', 'IfMatch': etag,
+                 'Range': 'bytes=%s-%s' % (first, last)})
+        s3_utils.download_large_object('bucket', 'snapshot.img', dest,
+                                       REGION, transfer_config=config)
+        with open(dest, 'rb') as f:
+            self.assertEqual(data, f.read())
+        self.assertFalse(os.path.exists(dest + '.bbpart.map'))
+        self.stubber.assert_no_pending_responses()
+
+    def test_download_large_object_etag_mismatch(self):
+        config = s3_utils.get_transfer_config(
+            max_concurrency=1, multipart_chunksize=4)
+        dest = os.path.join(self.tmp.name, 'snapshot.img')
+        self.stubber.add_response(
+            'head_object',
+            {'ContentLength': 3,
+             'ETag': '"%s"' % hashlib.md5(b'abc').hexdigest()})
+        self.stubber.add_response('get_object', {'Body': _body(b'abd')})
+        with self.assertRaises(Exception):
+            s3_utils.download_large_object('bucket', 'snapshot.img', dest,
+                                           REGION, transfer_config=config)
+        self.assertEqual([], os.listdir(self.tmp.name))
+
+    def test_transfer_config(self):
+        config = s3_utils.get_transfer_config(
+            multipart_chunksize=16 * 1024 * 1024, max_concurrency=4)
+        self.assertEqual(16 * 1024 * 1024, config.multipart_chunksize)
+        self.assertEqual(4, config.max_request_concurrency)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import contextlib
+import io
+import sys
+import unittest
+
+from unittest import mock
+
+from bb import route53_dns
+
+
+class TestRoute53Dns(unittest.TestCase):
+
+    def __assert_rejected(self, argv, message):
+        stderr = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['bb-route53-dns'] + argv), \
+                contextlib.redirect_stderr(stderr), \
+                self.assertRaises(SystemExit) as raised:
+            route53_dns.main()
+        self.assertEqual(2, raised.exception.code)
+        self.assertIn(message, stderr.getvalue())
+
+    def test_prune_rejected_with_asg_name(self):
+        self.__assert_rejected(
+            ['--reconcile', '--asg-name', 'web', '--prune',
+             '--private-zone', 'example.internal',
+             '--private-zone-prefix', 'web'],
+            '--prune can not be used with --asg-name')
+
+    def test_prune_requires_zone_prefix(self):
+        self.__assert_rejected(
+            ['--reconcile', '--vpc-id', 'vpc-1', '--prune',
+             '--private-zone', 'example.internal',
+             '--private-zone-prefix', 'dev',
+             '--public-zone', 'example.com'],
+            '--prune requires --private-zone-prefix')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import contextlib
+import io
+import sys
+import unittest
+
+from unittest import mock
+
+from bb import s3_cp
+
+
+class TestS3Cp(unittest.TestCase):
+
+    def __assert_rejected(self, argv, message):
+        stderr = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['bb-s3-cp'] + argv), \
+                contextlib.redirect_stderr(stderr), \
+                self.assertRaises(SystemExit) as raised:
+            s3_cp.main()
+        self.assertEqual(2, raised.exception.code)
+        self.assertIn(message, stderr.getvalue())
+
+    def test_large_object_rejected_for_stdout(self):
+        self.__assert_rejected(
+            ['--large-object', 's3://bucket/snapshot.img', '-'],
+            '--large-object only downloads from s3 to a local file')
+
+    def test_large_object_rejected_for_prefix(self):
+        self.__assert_rejected(
+            ['--large-object', 's3://bucket/snapshots/', '/tmp/snapshots'],
+            '--large-object downloads a single object, not a prefix')
+
+    def test_large_object_rejected_for_upload(self):
+        self.__assert_rejected(
+            ['--large-object', '/tmp/snapshot.img', 's3://bucket/'],
+            '--large-object only downloads from s3 to a local file')
+
+
+if __name__ == '__main__':
+    unittest.main()
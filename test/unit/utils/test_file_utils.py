@@ -1,15 +1,67 @@
+import hashlib
+import os
+import tempfile
 import unittest
+
+from unittest import mock
 from bb.utils import file_utils
 from test.testutils import test_resource
 
 
 class TestFileUtils(unittest.TestCase):
 
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(
+            os.environ, {'BB_CACHE_DIR': os.path.join(self.tmp.name, 'c')})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmp.cleanup()
+
     def test_read_yaml_file(self):
         yamlFilePath = test_resource.path("utils", "file_utils", "test.yml")
         yaml = file_utils.read_yaml_file(yamlFilePath)
         self.assertEqual(True, yaml["test"])
 
+    def test_compute_hashes(self):
+        path = os.path.join(self.tmp.name, 'file')
+        with open(path, 'wb') as f:
+            f.write(b'a' * 10 + b'b' * 5)
+        md5 = hashlib.md5(b'a' * 10 + b'b' * 5).hexdigest()
+        self.assertEqual((md5, md5), file_utils.compute_hashes(path))
+        digests = hashlib.md5(b'a' * 10).digest() + (
+            hashlib.md5(b'b' * 5).digest())
+        self.assertEqual(
+            (md5, hashlib.md5(digests).hexdigest() + '-2'),
+            file_utils.compute_hashes(path, 10))
+
+    def test_manifest_rehashes_changed_files(self):
+        root = os.path.join(self.tmp.name, 'tree')
+        os.makedirs(root)
+        paths = [os.path.join(root, n) for n in ('one', 'two')]
+        for path in paths:
+            with open(path, 'w') as f:
+                f.write(path)
+        with mock.patch.object(file_utils, 'compute_hashes',
+                               wraps=file_utils.compute_hashes) as hashes:
+            manifest = file_utils.FileManifest(root, max_workers=2)
+            first = manifest.get_etags(paths, 10)
+            manifest.save()
+            self.assertEqual(2, hashes.call_count)
+
+            with open(paths[0], 'w') as f:
+                f.write('changed')
+            manifest = file_utils.FileManifest(root, max_workers=2)
+            second = manifest.get_etags(paths, 10)
+            self.assertEqual(3, hashes.call_count)
+            self.assertEqual(first[paths[1]], second[paths[1]])
+            self.assertNotEqual(first[paths[0]], second[paths[0]])
+            # the md5 was recorded in the same pass
+            manifest.get_etag(paths[1])
+            self.assertEqual(3, hashes.call_count)
+
 
 if __name__ == '__main__':
     unittest.main()
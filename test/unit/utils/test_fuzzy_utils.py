@@ -0,0 +1,29 @@
+import unittest
+
+from bb.utils import fuzzy_utils
+
+
+class TestFuzzyUtils(unittest.TestCase):
+
+    def test_ranking(self):
+        names = ['prod-web-01', 'web-01', 'prod-kafka-01', 'beta-web-01']
+        ranked = sorted(
+            (n for n in names
+             if fuzzy_utils.match_score('web', n) is not None),
+            key=lambda n: -fuzzy_utils.match_score('web', n))
+        self.assertEqual('web-01', ranked[0])
+        self.assertNotIn('prod-kafka-01', ranked)
+        self.assertEqual(fuzzy_utils.EXACT_SCORE,
+                         fuzzy_utils.match_score('WEB-01', 'web-01'))
+
+    def test_subsequence_and_typos(self):
+        subsequence = fuzzy_utils.match_score('pw1', 'prod-web-01')
+        typo = fuzzy_utils.match_score('bastoin', 'prod-bastion-01')
+        self.assertGreaterEqual(subsequence, fuzzy_utils.SUBSEQUENCE_SCORE)
+        self.assertGreaterEqual(typo, fuzzy_utils.TRIGRAM_SCORE)
+        self.assertLess(typo, fuzzy_utils.SUBSEQUENCE_SCORE)
+        self.assertIsNone(fuzzy_utils.match_score('redis', 'prod-web-01'))
+
+
+if __name__ == '__main__':
+    unittest.main()
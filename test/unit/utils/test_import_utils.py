@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from bb.utils import import_utils
+
+# console script modules from setup.py
+SCRIPT_MODULES = ['bb.ec2_auto_tagger', 'bb.ec2_inventory', 'bb.ec2_ssh',
+                  'bb.route53_dns', 'bb.s3_cp', 'bb.vpc_inventory']
+
+
+def _run(code, env=None):
+    """Run code in a fresh interpreter and return its stdout"""
+    return subprocess.check_output(
+        [sys.executable, '-c', code],
+        env=dict(os.environ, **(env or {})),
+        universal_newlines=True).strip()
+
+
+class TestImportUtils(unittest.TestCase):
+
+    def test_lazy_import(self):
+        output = _run(
+            'import sys\n'
+            'from bb.utils import import_utils\n'
+            's3 = import_utils.lazy_import("bb.aws.s3_utils")\n'
+            'print("boto3" in sys.modules)\n'
+            'print(s3.LIST_PAGE_SIZE)\n'
+            'print("boto3" in sys.modules)\n'
+            'from bb.aws import s3_utils\n'
+            'print(s3_utils.download is s3.download)\n')
+        self.assertEqual(['False', '1000', 'True', 'True'],
+                         output.splitlines())
+
+    def test_lazy_import_threads(self):
+        # every thread races to be the first to touch the module
+        output = _run(
+            'import threading\n'
+            'from bb.utils import import_utils\n'
+            'ec2 = import_utils.lazy_import("bb.aws.ec2_utils")\n'
+            'barrier = threading.Barrier(16)\n'
+            'found = []\n'
+            'def touch():\n'
+            '    barrier.wait()\n'
+            '    found.append(callable(ec2.get_ec2_instances))\n'
+            'threads = [threading.Thread(target=touch) for _ in range(16)]\n'
+            'for t in threads:\n'
+            '    t.start()\n'
+            'for t in threads:\n'
+            '    t.join()\n'
+            'print(found.count(True))\n')
+        self.assertEqual('16', output)
+
+    def test_lazy_import_loaded_module(self):
+        self.assertIs(import_utils,
+                      import_utils.lazy_import('bb.utils.import_utils'))
+        with self.assertRaises(ImportError):
+            import_utils.lazy_import('bb.no_such_module')
+
+    def test_console_scripts_defer_dependencies(self):
+        output = _run(
+            'import sys\n'
+            + ''.join('import %s\n' % m for m in SCRIPT_MODULES)
+            + 'print(sorted(m for m in ("boto3", "botocore", "requests", '
+              '"yaml", "inquirer") if m in sys.modules))\n')
+        self.assertEqual('[]', output)
+
+    def test_inventory_cache_hit_defers_dependencies(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {'BB_CACHE_DIR': tmp, 'AWS_REGION': 'us-east-1',
+                   'INVENTORY_DEFINITION': 'ec2_groups: []', 'VPC_ID': 'vpc-1'}
+            _run(
+                'from bb.ansible import inventory_utils as inv\n'
+                'hit = lambda: {"hit": {"hosts": []}}\n'
+                'inv.get_cached_inventory(\n'
+                '    ["ec2", "ec2_groups: []", "us-east-1"], hit)\n'
+                'inv.get_cached_inventory(\n'
+                '    ["vpc", "vpc-1", None, None, "us-east-1"], hit)\n',
+                env)
+            for module in ('bb.ec2_inventory', 'bb.vpc_inventory'):
+                output = _run(
+                    'import sys\n'
+                    'sys.argv = ["inventory", "--list"]\n'
+                    'import %s as command\n'
+                    'command.main()\n'
+                    'print("botocore" in sys.modules)\n' % module,
+                    env)
+                self.assertIn('"hit"', output)
+                self.assertEqual('False', output.splitlines()[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()